@@ -0,0 +1,265 @@
+'''
+Runs the format, number and diff checks without the GUI.
+
+Takes Excel files, directories or globs, works out each file's config from
+its name with get_prefix, and runs the checks across a process pool. Every
+file gets a JSON result in output/batch, listed in its index.json, and a
+file that fails is recorded as an error without stopping the rest of the
+batch.
+
+    python batch.py ../input/diff ../input/numTest --checks format number diff
+'''
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import argparse
+import contextlib
+import glob
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+import traceback
+
+import diff
+import formatcheck
+import history
+import numberchecker
+
+
+RESULT_PATH = '../output/batch/'
+INDEX = RESULT_PATH + 'index.json'
+CHECKS = ('format', 'number', 'diff')
+
+
+def find_files(patterns):
+    '''Returns the Excel files matched by paths, directories and globs
+
+    Keyword Arguments:
+        patterns -- List of file paths, directories or glob patterns
+    '''
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = Path(pattern).glob('*.xlsx')
+        else:
+            matches = (Path(match) for match in glob.glob(pattern))
+        # Skips the lock files Excel leaves next to open workbooks
+        files.update(match.resolve() for match in matches
+                     if match.suffix == '.xlsx' and not match.name.startswith('~$'))
+    return sorted(files)
+
+
+def make_tasks(files, checks):
+    '''Returns the list of (check, paths) to run. Diffs pair each file with
+    the previous period of the same dataset
+
+    Keyword Arguments:
+        files -- List of Excel file paths
+        checks -- Names of the checks to run
+    '''
+    tasks = []
+    for path in files:
+        if 'format' in checks:
+            tasks.append(('format', (path,)))
+        if 'number' in checks:
+            tasks.append(('number', (path,)))
+    if 'diff' in checks:
+        datasets = {}
+        for path in files:
+            datasets.setdefault(numberchecker.get_prefix(path.name), []).append(path)
+        for paths in datasets.values():
+            paths = sorted(paths, key=diff.get_period)
+            tasks.extend(('diff', pair) for pair in zip(paths[:-1], paths[1:]))
+    return tasks
+
+
+def count_findings(found):
+    '''Returns the number of findings by rule'''
+    counts = {}
+    for (severity, rule, column), count in found.counts().items():
+        counts[rule] = counts.get(rule, 0) + count
+    return counts
+
+
+def run_format(path, options):
+    df = formatcheck.read_file(path)
+    found = formatcheck.do_check(df, formatcheck.get_prefix(path), path,
+                                 exceptions=options['exceptions'])
+    result = {'rows' : len(df), 'findings' : count_findings(found)}
+    # Only files that pass the format check go into the history store
+    if options['ingest'] and not any(severity == 'error' for severity, rule, column in found.counts()):
+        result['stored'] = str(history.ingest(path))
+    return result
+
+
+def run_number(path, options):
+    prefix = numberchecker.get_prefix(path)
+    # Raises instead of prompting for a new setup, which needs a console
+    numberchecker.read_config(prefix)
+    df = numberchecker.read_file(path)
+    # Files already run in parallel
+    cells, found = numberchecker.check_threshold(df, prefix, options['model'], options['window'],
+                                                 workers=1)
+    numberchecker.write_export(df, cells, path, found, exceptions=options['exceptions'])
+    return {'rows' : len(df), 'flagged_rows' : len(cells), 'findings' : count_findings(found)}
+
+
+def run_diff(path_OLD, path_NEW, options):
+    keys = diff.get_keys(path_NEW) if options['by_key'] else None
+    if options['stream']:
+        import streamdiff
+        output, counts = streamdiff.stream_files(path_OLD, path_NEW, keys)
+        return dict({'old_file' : str(path_OLD)}, **counts)
+    output, changes = diff.diff_files(path_OLD, path_NEW, keys)
+    counts = changes['Status'].value_counts()
+    return {'old_file' : str(path_OLD),
+            'new_rows' : int(counts.get('New', 0)),
+            'dropped_rows' : int(counts.get('Dropped', 0)),
+            'changed_rows' : int(counts.get('Changed', 0))}
+
+
+RUNNERS = {'format' : run_format, 'number' : run_number, 'diff' : run_diff}
+
+
+def run_task(check, paths, options):
+    '''Runs one check in a worker. Never raises, so one bad file cannot
+    stop the batch. Returns a dictionary describing the outcome
+
+    Keyword Arguments:
+        check -- Name of the check
+        paths -- Paths the check runs on
+        options -- Dictionary of by_key, whether diffs match rows on the
+                   config key columns, stream, whether diffs stream the
+                   workbooks in bounded memory, exceptions, the format to write
+                   flagged rows in or None, the model and window of
+                   number checks, and ingest, whether files that pass the
+                   format check are added to the history store
+    '''
+    result = {'check' : check, 'file' : str(paths[-1])}
+    console = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(console):
+            result.update(RUNNERS[check](*paths, options))
+        result['status'] = 'ok'
+    except Exception:
+        result['status'] = 'error'
+        result['error'] = traceback.format_exc()
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    result['console'] = console.getvalue()
+    return result
+
+
+def make_result_path():
+    '''Creates the batch output directory if it does not exist'''
+    if not os.path.exists(RESULT_PATH):
+        os.makedirs(RESULT_PATH)
+
+
+def result_name(file):
+    '''Returns the name of the result file of an input file. A hash of the
+    full path is added, so files of the same name in different folders
+    keep separate results'''
+    digest = hashlib.sha1(str(Path(file).resolve()).encode()).hexdigest()[:8]
+    return '{}-{}.json'.format(Path(file).stem, digest)
+
+
+def write_results(results):
+    '''Writes one JSON file per input file with the results of its checks,
+    and adds them to the index of input file to result file and status
+
+    Keyword Arguments:
+        results -- List of dictionaries from run_task
+    '''
+    make_result_path()
+    by_file = {}
+    for result in results:
+        by_file.setdefault(result['file'], []).append(result)
+    try:
+        with open(INDEX, 'r') as file:
+            index = json.load(file)
+    except (FileNotFoundError, ValueError):
+        index = {}
+    for file, checks in by_file.items():
+        status = 'error' if any(check['status'] == 'error' for check in checks) else 'ok'
+        with open(RESULT_PATH + result_name(file), 'w') as output:
+            json.dump({'file' : file, 'status' : status, 'checks' : checks}, output, indent=4)
+        index[file] = {'result' : result_name(file), 'status' : status}
+    with open(INDEX, 'w') as file:
+        json.dump(index, file, indent=4)
+
+
+def run_batch(patterns, checks=CHECKS, workers=None, by_key=False, exceptions=None,
+              model='sd', window=None, ingest=False, stream=False):
+    '''Runs the checks over all matched files in a process pool.
+    Returns the list of results
+
+    Keyword Arguments:
+        patterns -- List of file paths, directories or glob patterns
+        checks -- Names of the checks to run
+        workers -- Number of worker processes. Defaults to the CPU count
+        by_key -- Whether diffs match rows on the config key columns
+        exceptions -- Also writes flagged rows alone as 'xlsx' or 'csv'
+        model -- Bounds model of number checks, one of numberchecker.MODELS
+        window -- Number of most recent periods the mad and quantile models use
+        ingest -- Whether files that pass the format check go into the history store
+        stream -- Whether diffs stream the workbooks in bounded memory
+    '''
+    tasks = make_tasks(find_files(patterns), checks)
+    options = {'by_key' : by_key, 'exceptions' : exceptions, 'model' : model, 'window' : window,
+               'ingest' : ingest, 'stream' : stream}
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_task, check, paths, options) : (check, paths)
+                   for check, paths in tasks}
+        for future in as_completed(futures):
+            check, paths = futures[future]
+            try:
+                result = future.result()
+            except Exception:
+                # The worker itself died, e.g. out of memory
+                result = {'check' : check, 'file' : str(paths[-1]), 'status' : 'error',
+                          'error' : traceback.format_exc()}
+            print('[{}] {} {}'.format(result['status'].upper(), check, Path(result['file']).name))
+            results.append(result)
+    write_results(results)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs data quality checks without the GUI')
+    parser.add_argument('paths', nargs='+', help='Excel files, directories or globs')
+    parser.add_argument('--checks', nargs='+', choices=CHECKS, default=list(CHECKS),
+                        help='Checks to run (default: all)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: CPU count)')
+    parser.add_argument('--by-key', action='store_true',
+                        help='Match diff rows on the config key columns')
+    parser.add_argument('--stream', action='store_true',
+                        help='Diff in bounded memory, streaming both workbooks')
+    parser.add_argument('--exceptions', choices=('xlsx', 'csv'), default=None,
+                        help='Also write the flagged rows alone in this format')
+    parser.add_argument('--model', choices=numberchecker.MODELS, default='sd',
+                        help='Bounds of the number check (default: sd)')
+    parser.add_argument('--window', type=int, default=None,
+                        help='Periods the mad and quantile models look back (default: all)')
+    parser.add_argument('--ingest', action='store_true',
+                        help='Add files that pass the format check to the history store')
+    args = parser.parse_args(argv)
+
+    # Configs and outputs are relative to the scripts folder
+    patterns = [os.path.abspath(pattern) for pattern in args.paths]
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    results = run_batch(patterns, args.checks, args.workers, args.by_key, args.exceptions,
+                        args.model, args.window, args.ingest, args.stream)
+
+    failed = sum(result['status'] == 'error' for result in results)
+    print('\n{} checks run, {} failed. Results in {}'.format(len(results), failed,
+                                                             os.path.abspath(RESULT_PATH)))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+'''
+Scaling benchmark of the checks on synthetic workbooks.
+
+For every size, generate writes two consecutive months of a config and
+each check runs on them in a fresh Python process, so its peak memory is
+its own and nothing is warm from the run before. The sheet and config
+caches, the diff index and the number config live in a temporary folder
+for the run. Every run records wall and CPU seconds, peak resident memory
+and rows per second, and the whole suite is saved as JSON in
+output/benchmark.
+Passing an earlier results file prints the change in time of every check
+and size, and exits with 1 if any got slower than --tolerance allows.
+
+    python benchmark.py monthlyproduction --sizes 1000 10000 100000 1000000
+    python benchmark.py monthlyproduction --compare ../output/benchmark/<earlier>.json
+
+Sheets are parsed with openpyxl, which dominates the larger sizes.
+'''
+from pathlib import Path
+import argparse
+import contextlib
+import datetime
+import generate
+import io
+import json
+import os
+import platform
+import stages
+import subprocess
+import sys
+import tempfile
+import time
+
+
+RESULT_PATH = '../output/benchmark/'
+SIZES = (1000, 10000, 100000, 1000000)
+TOOLS = ('format', 'number', 'diff', 'streamdiff')
+TOLERANCE = 1.2
+
+
+def use_folder(folder):
+    '''Points the sheet and config caches, diff index and number configs
+    of this process at folder, so a run starts cold and leaves the real
+    ones alone'''
+    import configcache
+    import fingerprint
+    import numberchecker
+    import sheetcache
+    sheetcache.CACHE_PATH = folder + '/cache/'
+    sheetcache.MANIFEST = sheetcache.CACHE_PATH + 'manifest.json'
+    configcache.CACHE_PATH = folder + '/config/'
+    fingerprint.INDEX_PATH = folder + '/index/'
+    os.makedirs(folder + '/num-config', exist_ok=True)
+    numberchecker.TABLE_PATH = folder + '/num-config/sd-{}.arrow'
+    numberchecker.JSON_PATH = folder + '/num-config/sd-{}.json'
+    numberchecker.SKETCH_PATH = folder + '/num-config/sketch-{}.arrow'
+
+
+def number_groups(prefix, df):
+    '''Returns the group columns of the real number config of a prefix, or
+    the item column if it has none'''
+    import numberchecker
+    try:
+        if numberchecker.load_arrow() is not None:
+            return numberchecker.read_table('num-config/sd-{}.arrow'.format(prefix)).groups
+    except FileNotFoundError:
+        pass
+    try:
+        with open('num-config/sd-{}.json'.format(prefix), 'r') as file:
+            return json.load(file)['groups']
+    except FileNotFoundError:
+        return [generate.get_unit_col(list(df.columns)) or df.columns[0]]
+
+
+def run_format(path_OLD, path_NEW):
+    import formatcheck
+    df = formatcheck.read_file(path_NEW)
+    found = formatcheck.do_check(df, formatcheck.get_prefix(path_NEW), path_NEW)
+    return len(df), {'findings' : len(found)}
+
+
+def run_number(path_OLD, path_NEW):
+    '''Learns bounds from the old month, then checks the new one'''
+    import numberchecker
+    from sketch import QuantileSketch
+    prefix = numberchecker.get_prefix(path_NEW)
+    df_OLD = numberchecker.read_file(path_OLD)
+    groups = number_groups(prefix, df_OLD)
+    bounds = numberchecker.BoundsTable(groups, numberchecker.get_stats(df_OLD, groups))
+    sketch = QuantileSketch()
+    sketch.add(bounds.lookup(df_OLD), numberchecker.get_numbers(df_OLD).to_numpy())
+    numberchecker.save_config(bounds, prefix)
+    numberchecker.save_sketch(sketch, prefix)
+
+    df = numberchecker.read_file(path_NEW)
+    cells, found = numberchecker.check_threshold(df, prefix, workers=1)
+    numberchecker.write_export(df, cells, path_NEW, found)
+    return len(df), {'flagged_rows' : len(cells)}
+
+
+def run_diff(path_OLD, path_NEW):
+    import diff
+    output, changes = diff.diff_files(path_OLD, path_NEW, diff.get_keys(path_NEW))
+    return None, {'changes' : len(changes)}
+
+
+def run_streamdiff(path_OLD, path_NEW):
+    import diff
+    import streamdiff
+    streamdiff.stream_diff(path_OLD, path_NEW, diff.get_keys(path_NEW))
+    return None, {}
+
+
+RUNNERS = {'format' : run_format, 'number' : run_number, 'diff' : run_diff,
+           'streamdiff' : run_streamdiff}
+
+
+def run_tool(tool, path_OLD, path_NEW):
+    '''Runs one check in this process and returns its measurements.
+    Called in the child process started by measure
+
+    Keyword Arguments:
+        tool -- Name of the check, one of TOOLS
+        path_OLD -- Path of the earlier month
+        path_NEW -- Path of the later month
+    '''
+    path_OLD, path_NEW = Path(path_OLD), Path(path_NEW)
+    with tempfile.TemporaryDirectory() as folder:
+        use_folder(folder)
+        console = io.StringIO()
+        start, cpu = time.perf_counter(), time.process_time()
+        with contextlib.redirect_stdout(console):
+            rows, extra = RUNNERS[tool](path_OLD, path_NEW)
+        seconds, cpu = time.perf_counter() - start, time.process_time() - cpu
+    return dict({'seconds' : round(seconds, 3), 'cpu_seconds' : round(cpu, 3),
+                 'peak_rss_mb' : stages.max_rss(), 'rows' : rows}, **extra)
+
+
+def measure(tool, path_OLD, path_NEW, rows):
+    '''Runs a check in a new Python process. Returns its result
+
+    Keyword Arguments:
+        tool -- Name of the check, one of TOOLS
+        path_OLD -- Path of the earlier month
+        path_NEW -- Path of the later month
+        rows -- Rows of the later month, for checks that do not count them
+    '''
+    result = {'tool' : tool, 'size' : rows}
+    done = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', tool,
+                           str(path_OLD), str(path_NEW)], capture_output=True, text=True)
+    if done.returncode:
+        result.update({'status' : 'error', 'error' : done.stderr.strip()})
+        return result
+    result.update(json.loads(done.stdout.strip().splitlines()[-1]), status='ok')
+    result['rows'] = result['rows'] or rows
+    result['rows_per_second'] = round(result['rows'] / result['seconds']) if result['seconds'] else None
+    return result
+
+
+def run_suite(prefix, sizes=SIZES, tools=TOOLS, anomaly_rate=0.01, change_rate=0.05, seed=0,
+              reuse=False):
+    '''Generates the workbooks of every size and measures every check on
+    them. Returns the list of results
+
+    Keyword Arguments:
+        prefix -- Format config prefix, e.g. monthlyproduction
+        sizes -- Rows of the generated workbooks
+        tools -- Names of the checks to run
+        anomaly_rate -- Share of rows with an anomaly
+        change_rate -- Share of rows changing from month to month
+        seed -- Seed of the generated values
+        reuse -- Whether to keep workbooks already generated for a size
+    '''
+    results = []
+    for size in sizes:
+        paths = generate.file_paths(prefix, size)
+        if not (reuse and all(path.exists() for path in paths)):
+            print('Generating {} rows'.format(size))
+            paths = generate.generate(prefix, size, 2, anomaly_rate, change_rate, seed)
+        for tool in tools:
+            result = measure(tool, paths[0], paths[1], size)
+            if result['status'] == 'ok':
+                print('{:>10} {:>9} rows {:>9.2f}s {:>9} MB {:>11} rows/s'.format(
+                    tool, size, result['seconds'], result['peak_rss_mb'], result['rows_per_second']))
+            else:
+                print('{:>10} {:>9} rows failed:\n{}'.format(tool, size, result['error']))
+            results.append(result)
+    return results
+
+
+def environment():
+    '''Returns the versions and hardware the results were measured on'''
+    import numpy
+    import pandas
+    return {'python' : platform.python_version(), 'pandas' : pandas.__version__,
+            'numpy' : numpy.__version__, 'platform' : platform.platform(),
+            'cpus' : os.cpu_count()}
+
+
+def write_results(results, prefix):
+    '''Saves the results with their environment. Returns the path'''
+    os.makedirs(RESULT_PATH, exist_ok=True)
+    now = datetime.datetime.now()
+    path = RESULT_PATH + 'benchmark-{}-{}.json'.format(prefix, now.strftime('%Y%m%d-%H%M%S'))
+    with open(path, 'w') as file:
+        json.dump({'prefix' : prefix, 'started' : now.isoformat(timespec='seconds'),
+                   'environment' : environment(), 'results' : results}, file, indent=4)
+    return path
+
+
+def compare(old_path, results, tolerance=TOLERANCE):
+    '''Prints the change in seconds of every check and size against an
+    earlier results file. Returns the list of (tool, size) that got slower
+    by more than tolerance
+
+    Keyword Arguments:
+        old_path -- Path of an earlier results file
+        results -- List of results from run_suite
+        tolerance -- Ratio of new to old seconds that counts as a regression
+    '''
+    with open(old_path, 'r') as file:
+        old = {(result['tool'], result['size']) : result for result in json.load(file)['results']
+               if result['status'] == 'ok'}
+    slower = []
+    for result in results:
+        before = old.get((result['tool'], result['size']))
+        if before is None or result['status'] != 'ok':
+            continue
+        ratio = result['seconds'] / max(before['seconds'], 1e-3)
+        print('{:>10} {:>9} rows {:>9.2f}s -> {:>9.2f}s  x{:.2f}'.format(
+            result['tool'], result['size'], before['seconds'], result['seconds'], ratio))
+        if ratio > tolerance:
+            slower.append((result['tool'], result['size']))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the checks on synthetic workbooks')
+    parser.add_argument('prefix', nargs='?', default='monthlyproduction',
+                        help='Format config prefix (default: monthlyproduction)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--tools', nargs='+', choices=TOOLS, default=list(TOOLS))
+    parser.add_argument('--anomaly-rate', type=float, default=0.01)
+    parser.add_argument('--change-rate', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reuse', action='store_true',
+                        help='Keep workbooks already generated for a size')
+    parser.add_argument('--compare', default=None, help='Earlier results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='Slowdown that counts as a regression (default: 1.2)')
+    parser.add_argument('--run', nargs=3, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    if args.run:
+        print(json.dumps(run_tool(*args.run)))
+        return 0
+
+    results = run_suite(args.prefix, args.sizes, args.tools, args.anomaly_rate, args.change_rate,
+                        args.seed, args.reuse)
+    print('Results written to ' + os.path.abspath(write_results(results, args.prefix)))
+    if compare_path:
+        slower = compare(compare_path, results, args.tolerance)
+        if slower:
+            print('Slower than {}x: {}'.format(args.tolerance, slower))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
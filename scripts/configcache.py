@@ -0,0 +1,59 @@
+'''
+Compiled, cached configs for formatcheck and numberchecker.
+
+A config JSON is parsed once and handed to a compiler that turns it into
+the form the checks look things up in (frozensets, NumPy tables). The
+compiled form is pickled under cache/config and reused until the size or
+mtime of the JSON changes. Within one process the compiled form is also
+kept in memory, so the GUI does not even re-read the pickle.
+'''
+import hashlib
+import json
+import os
+import pickle
+
+
+CACHE_PATH = '../cache/config/'
+loaded = {}
+
+
+def make_cache_path():
+    '''Creates the config cache directory if it does not exist'''
+    if not os.path.exists(CACHE_PATH):
+        os.makedirs(CACHE_PATH)
+
+
+def load(path, compiler, version=1):
+    '''Returns the compiled form of a JSON config
+
+    Keyword Arguments:
+        path -- Path of the JSON file
+        compiler -- Function turning the decoded JSON into its compiled form.
+                    It should return builtins and NumPy arrays only, so the
+                    pickle loads no matter which script is __main__
+        version -- Version of the compiler. Bump it when the compiled form changes
+    '''
+    stat = os.stat(path)
+    stamp = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns,
+             compiler.__name__, version)
+    if stamp in loaded:
+        return loaded[stamp]
+
+    cache_file = CACHE_PATH + hashlib.sha1(repr(stamp[0]).encode()).hexdigest() + '.pkl'
+    try:
+        with open(cache_file, 'rb') as file:
+            entry = pickle.load(file)
+        if entry['stamp'] != stamp:
+            raise ValueError('Stale compiled config')
+        config = entry['config']
+    except (FileNotFoundError, EOFError, ValueError, AttributeError, pickle.UnpicklingError):
+        with open(path, 'r') as file:
+            config = compiler(json.load(file))
+        make_cache_path()
+        temp = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(temp, 'wb') as file:
+            pickle.dump({'stamp' : stamp, 'config' : config}, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, cache_file)
+
+    loaded[stamp] = config
+    return config
@@ -1,49 +1,203 @@
 # Credit to Matthew Kudija for the Source Code
 # https://matthewkudija.com/blog/2018/07/21/excel-diff/
-import pandas as pd
 import tkinter as tk
 from tkinter import StringVar, filedialog
 from pathlib import Path
-
-
-def excel_diff(path_OLD, path_NEW):
-
-    df_OLD = pd.read_excel(path_OLD).fillna(0)
-    df_NEW = pd.read_excel(path_NEW).fillna(0)
-
-    # Perform Diff
+from concurrent.futures import ProcessPoolExecutor
+from formatcheck import get_prefix
+import json
+import re
+import stages
+# pandas, NumPy, xlsxwriter and the modules built on them are imported where
+# they are used, so the window opens before they load
+
+
+EXCLUSION_SET = {"Volume", "Revenue"}
+
+
+def not_equal(values_OLD, values_NEW):
+    '''Returns a boolean mask of positions where two aligned columns differ
+
+    Keyword Arguments:
+        values_OLD -- NumPy array of old values
+        values_NEW -- NumPy array of new values, same length as values_OLD
+    '''
+    if values_OLD.dtype == values_NEW.dtype and values_OLD.dtype != object:
+        return values_OLD != values_NEW
+    # Mixed or object dtypes fall back to Python equality, element by element
+    return values_OLD.astype(object) != values_NEW.astype(object)
+
+
+def compare_cells(df_OLD, df_NEW, rows, sharedCols, dfDiff):
+    '''Compares shared columns for the given rows in one pass per column.
+    Writes "old→new" strings into dfDiff and returns the changed cells as a
+    DataFrame of Row, Column, Old and New, in the order they appear in the sheet
+
+    Keyword Arguments:
+        df_OLD -- Old pandas DataFrame
+        df_NEW -- New pandas DataFrame
+        rows -- Index labels present in both DataFrames
+        sharedCols -- Columns to compare
+        dfDiff -- DataFrame receiving the "old→new" strings
+    '''
+    import numpy as np
+    import pandas as pd
+    aligned_OLD = df_OLD.loc[rows]
+    aligned_NEW = df_NEW.loc[rows]
+    diff_pos = dfDiff.index.get_indexer(rows)
+    changes = []
+    for col in sharedCols:
+        values_OLD = aligned_OLD[col].to_numpy()
+        values_NEW = aligned_NEW[col].to_numpy()
+        mask = np.flatnonzero(not_equal(values_OLD, values_NEW))
+        if not len(mask):
+            continue
+        old = ['{}'.format(value) for value in values_OLD[mask]]
+        new = ['{}'.format(value) for value in values_NEW[mask]]
+        values = dfDiff[col].to_numpy(dtype=object, copy=True)
+        values[diff_pos[mask]] = [value_OLD + '→' + value_NEW
+                                  for value_OLD, value_NEW in zip(old, new)]
+        dfDiff[col] = values
+        changes.append(pd.DataFrame({'Row' : diff_pos[mask],
+                                     'Column' : col,
+                                     'Old' : old,
+                                     'New' : new,
+                                     'col_pos' : dfDiff.columns.get_loc(col)}))
+
+    if not changes:
+        return pd.DataFrame(columns=['Row', 'Column', 'Old', 'New'])
+    # Row-major order, as the cells appear in the sheet
+    changes = pd.concat(changes, ignore_index=True).sort_values(['Row', 'col_pos'], kind='stable')
+    changes['Row'] = dfDiff.index[changes['Row'].to_numpy()]
+    return changes.drop(columns='col_pos').reset_index(drop=True)
+
+
+def cell_refs(dfDiff, changes):
+    '''Returns the DIFF sheet cell reference of every changed cell
+
+    Keyword Arguments:
+        dfDiff -- The DIFF DataFrame
+        changes -- Changed cells from compare_cells
+    '''
+    from xlsxwriter.utility import xl_rowcol_to_cell
+    rows = dfDiff.index.get_indexer(changes['Row'])
+    cols = dfDiff.columns.get_indexer(changes['Column'])
+    # +1 for the header row and +1 for the index column of the DIFF sheet
+    return [xl_rowcol_to_cell(row + 1, col + 1) for row, col in zip(rows, cols)]
+
+
+def get_keys(path):
+    '''Returns the business key for a file. This is the header of its format
+    config, less the number columns
+
+    Keyword Arguments:
+        path -- Path of the Excel file
+    '''
+    with open('config/' + get_prefix(path.name) + 'config.json', 'r') as config:
+        header = json.load(config)['header']
+    return [col for col in header if col not in EXCLUSION_SET]
+
+
+def key_index(df, keys):
+    '''Returns a unique MultiIndex built from the key columns of df.
+    Repeated keys are told apart by their order of appearance
+
+    Keyword Arguments:
+        df -- A pandas DataFrame
+        keys -- List of key columns
+    '''
+    import pandas as pd
+    occurrence = df.groupby(keys, sort=False).cumcount().to_numpy()
+    arrays = [df[key].to_numpy() for key in keys] + [occurrence]
+    return pd.MultiIndex.from_arrays(arrays)
+
+
+def diff_on_index(df_OLD, df_NEW, fingerprints=None):
+    '''Matches rows by their position in the sheet
+
+    Keyword Arguments:
+        df_OLD -- Old pandas DataFrame
+        df_NEW -- New pandas DataFrame
+        fingerprints -- Old and new hashes from fingerprint.load. When given,
+                        only rows whose fingerprints differ are compared
+    '''
+    import fingerprint
+    import numpy as np
+    import pandas as pd
     dfDiff = df_NEW.copy()
-    droppedRows = []
-    newRows = []
-    changedCells = []
-    exclusionSet = {"Volume", "Revenue"}
-
-    cols_OLD = set(df_OLD.columns) - exclusionSet
-    cols_NEW = set(df_NEW.columns) - exclusionSet
-    sharedCols = list(cols_OLD & cols_NEW)
-    newCols = list(cols_NEW - cols_OLD)
-    droppedCols = list(cols_OLD - cols_NEW)
-
-    for row in dfDiff.index:
-        if (row in df_OLD.index) and (row in df_NEW.index):
-            for col in sharedCols:
-                value_OLD = df_OLD.loc[row,col]
-                value_NEW = df_NEW.loc[row,col]
-                if value_OLD==value_NEW:
-                    dfDiff.loc[row,col] = df_NEW.loc[row,col]
-                else:
-                    dfDiff.loc[row,col] = ('{}→{}').format(value_OLD,value_NEW)
-                    changedCells.append(chr(65 + sharedCols.index(col) + 1) + str(row))
-        else:
-            newRows.append(row)
-
-    for row in df_OLD.index:
-        if row not in df_NEW.index:
-            droppedRows.append(row)
-            dfDiff = dfDiff.append(df_OLD.loc[row,:])
-
-    dfDiff = dfDiff.sort_index().fillna('')
-    output_string = '\nNew Rows: {}'.format(newRows) + '\nDropped Rows: {}'.format(droppedRows)
+    sharedCols = [col for col in df_NEW.columns
+                  if col in df_OLD.columns and col not in EXCLUSION_SET]
+
+    shared = dfDiff.index.isin(df_OLD.index)
+    newRows = list(dfDiff.index[~shared])
+    rows = dfDiff.index[shared]
+    if fingerprints:
+        rows = rows[fingerprint.changed_rows(*fingerprints, df_OLD.index.get_indexer(rows),
+                                             np.flatnonzero(shared), sharedCols)]
+    changes = compare_cells(df_OLD, df_NEW, rows, sharedCols, dfDiff)
+
+    dropped = ~df_OLD.index.isin(df_NEW.index)
+    droppedRows = list(df_OLD.index[dropped])
+    dfDiff = pd.concat([dfDiff, df_OLD[dropped]])
+    return dfDiff, newRows, droppedRows, changes
+
+
+def diff_on_keys(df_OLD, df_NEW, keys, fingerprints=None):
+    '''Matches rows by a hash join on the key columns, so inserted or
+    deleted rows do not shift every row after them. Number columns are
+    compared too, since matched rows describe the same item
+
+    Keyword Arguments:
+        df_OLD -- Old pandas DataFrame
+        df_NEW -- New pandas DataFrame
+        keys -- List of key columns found in both DataFrames
+        fingerprints -- Old and new hashes from fingerprint.load. When given,
+                        only rows whose fingerprints differ are compared
+    '''
+    import fingerprint
+    import numpy as np
+    import pandas as pd
+    df_OLD = df_OLD.reset_index(drop=True)
+    df_NEW = df_NEW.reset_index(drop=True)
+    dfDiff = df_NEW.copy()
+    sharedCols = [col for col in df_NEW.columns
+                  if col in df_OLD.columns and col not in keys]
+
+    # Position of the matching old row for every new row, -1 if none
+    matches = key_index(df_OLD, keys).get_indexer(key_index(df_NEW, keys))
+    matched = matches >= 0
+    newRows = list(dfDiff.index[~matched])
+    aligned_OLD = df_OLD.iloc[matches[matched]]
+    aligned_OLD.index = dfDiff.index[matched]
+    rows = dfDiff.index[matched]
+    if fingerprints:
+        rows = rows[fingerprint.changed_rows(*fingerprints, matches[matched],
+                                             np.flatnonzero(matched), sharedCols)]
+    changes = compare_cells(aligned_OLD, df_NEW, rows, sharedCols, dfDiff)
+
+    # Unmatched old rows go after the new rows in a single concat
+    dropped = np.ones(len(df_OLD), dtype=bool)
+    dropped[matches[matched]] = False
+    df_dropped = df_OLD[dropped]
+    df_dropped.index = pd.RangeIndex(len(dfDiff), len(dfDiff) + len(df_dropped))
+    droppedRows = list(df_dropped.index)
+    dfDiff = pd.concat([dfDiff, df_dropped])
+    return dfDiff, newRows, droppedRows, changes
+
+
+def summarize(keys, newRows, droppedRows, changedCells, newCols, droppedCols):
+    '''Returns the console summary of a diff
+
+    Keyword Arguments:
+        keys -- Columns the rows were matched on, None for row index
+        newRows -- Labels of new rows
+        droppedRows -- Labels of dropped rows
+        changedCells -- Cell references of changed cells
+        newCols -- Columns only in the new file
+        droppedCols -- Columns only in the old file
+    '''
+    output_string = '\nMatched On: {}'.format(keys or 'Row Index')
+    output_string += '\nNew Rows: {}'.format(newRows) + '\nDropped Rows: {}'.format(droppedRows)
     if len(changedCells) <= 20:
         output_string += '\nChanged Cells: {}'.format(changedCells)
     else:
@@ -51,50 +205,282 @@ def excel_diff(path_OLD, path_NEW):
         output_string += '\nChanged Cells: {} changed cells'.format(len(changedCells))
     output_string += '\nNew Columns: {}'.format(newCols)
     output_string += '\nDropped Columns: {}\n'.format(droppedCols)
+    return output_string
+
+
+def change_set(dfDiff, keys, newRows, droppedRows, changes):
+    '''Returns every new, dropped or changed row as a DataFrame, with one
+    line per changed cell. Rows carry their key columns if keys is given
+
+    Keyword Arguments:
+        dfDiff -- The DIFF DataFrame
+        keys -- Columns the rows were matched on
+        newRows -- Labels of new rows
+        droppedRows -- Labels of dropped rows
+        changes -- Changed cells from compare_cells
+    '''
+    import pandas as pd
+    rows = pd.Series(newRows + droppedRows, dtype=dfDiff.index.dtype)
+    change_set = pd.concat([pd.DataFrame({'Row' : rows,
+                                          'Status' : ['New'] * len(newRows)
+                                                     + ['Dropped'] * len(droppedRows)}),
+                            changes.assign(Status='Changed')], ignore_index=True)
+    change_set = change_set[['Row', 'Status', 'Column', 'Old', 'New']]
+    if keys:
+        key_values = dfDiff.loc[change_set['Row'], keys].reset_index(drop=True)
+        change_set = pd.concat([key_values, change_set], axis=1)
+    return change_set
+
+
+def row_changes(change_set, keys):
+    '''Returns the key and status of every new, dropped or changed row
+
+    Keyword Arguments:
+        change_set -- DataFrame from change_set
+        keys -- Columns the rows were matched on
+    '''
+    return change_set.drop_duplicates('Row')[(keys or ['Row']) + ['Status']]
+
+
+def write_changes(change_set, path, changes_format):
+    '''Writes the change set for jobs that do not read Excel
+
+    Keyword Arguments:
+        change_set -- DataFrame from change_set
+        path -- Path of the output file, without a suffix
+        changes_format -- 'csv' or 'parquet'
+    '''
+    if changes_format == 'csv':
+        change_set.to_csv(path + '.csv', index=False)
+    elif changes_format == 'parquet':
+        # Mixed types cannot be stored in one Parquet column
+        change_set = change_set.copy()
+        for col in change_set.columns[change_set.dtypes == object]:
+            notnull = change_set[col].notna()
+            change_set[col] = change_set[col].where(~notnull, change_set[col].astype(str))
+        change_set.to_parquet(path + '.parquet', index=False)
+    else:
+        raise ValueError('Unknown change set format: {}'.format(changes_format))
+    return path + '.' + changes_format
+
+
+def excel_diff(path_OLD, path_NEW, keys=None, copies=True, changes_format=None):
+    '''Compares two Excel files and exports a DIFF workbook
+
+    Keyword Arguments:
+        path_OLD -- Path of the old Excel file
+        path_NEW -- Path of the new Excel file
+        keys -- Columns to match rows on. Rows are matched by position if None
+        copies -- Whether to add full copies of the old and new sheets
+        changes_format -- Also writes the change set as 'csv' or 'parquet'
+    '''
+    return diff_files(path_OLD, path_NEW, keys, copies, changes_format)[0]
+
+
+def diff_files(path_OLD, path_NEW, keys=None, copies=True, changes_format=None):
+    '''Compares two Excel files and exports a DIFF workbook.
+    Returns the console summary and the row changes
+
+    Keyword Arguments:
+        path_OLD -- Path of the old Excel file
+        path_NEW -- Path of the new Excel file
+        keys -- Columns to match rows on. Rows are matched by position if None
+        copies -- Whether to add full copies of the old and new sheets
+        changes_format -- Also writes the change set as 'csv' or 'parquet'
+    '''
+    import fingerprint
+    # Parsed sheets come from the fingerprint index when seen before
+    with stages.stage('diff', 'read', path_NEW) as stage:
+        df_OLD, hashes_OLD = fingerprint.load(path_OLD)
+        df_NEW, hashes_NEW = fingerprint.load(path_NEW)
+        stage.rows = len(df_OLD) + len(df_NEW)
+    return diff_frames(df_OLD, df_NEW, path_OLD.stem, path_NEW.stem, keys, copies,
+                       changes_format, (hashes_OLD, hashes_NEW))
+
+
+def read_period(dataset, period):
+    '''Returns a period of the history store the way fingerprint.load
+    returns a sheet, with blanks as 0
+
+    Keyword Arguments:
+        dataset -- Dataset name
+        period -- Stored period
+    '''
+    import history
+    import pandas as pd
+    df = history.query(dataset, [period])
+    if not len(df):
+        raise FileNotFoundError('No history for {} {}'.format(dataset, period))
+    for col in df.columns[~df.dtypes.map(pd.api.types.is_numeric_dtype)]:
+        df[col] = df[col].astype(object)
+    return df.fillna(0)
+
+
+def diff_periods(dataset, period_OLD, period_NEW, keys=None, copies=True, changes_format=None):
+    '''Compares two periods of the history store, e.g. a month against the
+    same month last year, without parsing either workbook. Returns the
+    console summary
+
+    Keyword Arguments:
+        dataset -- Dataset name
+        period_OLD -- Old stored period
+        period_NEW -- New stored period
+        keys -- Columns to match rows on. Rows are matched by position if None
+        copies -- Whether to add full copies of the old and new sheets
+        changes_format -- Also writes the change set as 'csv' or 'parquet'
+    '''
+    import fingerprint
+    with stages.stage('diff', 'read', dataset + ' ' + period_NEW) as stage:
+        df_OLD = read_period(dataset, period_OLD)
+        df_NEW = read_period(dataset, period_NEW)
+        fingerprints = (fingerprint.make_fingerprints(df_OLD), fingerprint.make_fingerprints(df_NEW))
+        stage.rows = len(df_OLD) + len(df_NEW)
+    return diff_frames(df_OLD, df_NEW, dataset + ' ' + period_OLD, dataset + ' ' + period_NEW,
+                       keys, copies, changes_format, fingerprints)[0]
+
+
+def diff_frames(df_OLD, df_NEW, name_OLD, name_NEW, keys=None, copies=True,
+                changes_format=None, fingerprints=None):
+    '''Compares two sheets and exports a DIFF workbook named after them.
+    Returns the console summary and the row changes
+
+    Keyword Arguments:
+        df_OLD -- Old pandas DataFrame
+        df_NEW -- New pandas DataFrame
+        name_OLD -- Name of the old sheet
+        name_NEW -- Name of the new sheet
+        keys -- Columns to match rows on. Rows are matched by position if None
+        copies -- Whether to add full copies of the old and new sheets
+        changes_format -- Also writes the change set as 'csv' or 'parquet'
+        fingerprints -- Old and new hashes from fingerprint, if known
+    '''
+    import export
+    # Perform Diff
+    with stages.stage('diff', 'compare', name_NEW, len(df_OLD) + len(df_NEW)):
+        cols_OLD = set(df_OLD.columns) - EXCLUSION_SET
+        cols_NEW = set(df_NEW.columns) - EXCLUSION_SET
+        newCols = list(cols_NEW - cols_OLD)
+        droppedCols = list(cols_OLD - cols_NEW)
+
+        if keys:
+            keys = [key for key in keys if key in df_OLD.columns and key in df_NEW.columns]
+        if keys:
+            dfDiff, newRows, droppedRows, changes = diff_on_keys(df_OLD, df_NEW, keys, fingerprints)
+        else:
+            dfDiff, newRows, droppedRows, changes = diff_on_index(df_OLD, df_NEW, fingerprints)
+
+        dfDiff = dfDiff.sort_index().fillna('')
+        changedCells = cell_refs(dfDiff, changes)
+        output_string = summarize(keys, newRows, droppedRows, changedCells,
+                                  newCols, droppedCols)
 
     # Save output and format
-    fname = '{} vs {}.xlsx'.format(path_OLD.stem,path_NEW.stem)
-    writer = pd.ExcelWriter('../output/diff/' + fname, engine='xlsxwriter')
-
-    dfDiff.to_excel(writer, sheet_name='DIFF', index=True)
-    df_NEW.to_excel(writer, sheet_name=path_NEW.stem, index=True)
-    df_OLD.to_excel(writer, sheet_name=path_OLD.stem, index=True)
-
-    # get xlsxwriter objects
-    workbook  = writer.book
-    worksheet = writer.sheets['DIFF']
-    worksheet.hide_gridlines(2)
-    worksheet.set_default_row(15)
-
-    # define formats
-    date_fmt = workbook.add_format({'align': 'center', 'num_format': 'yyyy-mm-dd'})
-    center_fmt = workbook.add_format({'align': 'center'})
-    number_fmt = workbook.add_format({'align': 'center', 'num_format': '#,##0.00'})
-    cur_fmt = workbook.add_format({'align': 'center', 'num_format': '$#,##0.00'})
-    perc_fmt = workbook.add_format({'align': 'center', 'num_format': '0%'})
-    grey_fmt = workbook.add_format({'font_color': '#E0E0E0'})
-    highlight_fmt = workbook.add_format({'font_color': '#FF0000', 'bg_color':'#B1B3B3'})
-    new_fmt = workbook.add_format({'font_color': '#32CD32','bold':True})
-
-    # set format over range
-    ## highlight changed cells
-    end = 'ZZ' + str(len(dfDiff))
-    worksheet.conditional_format('A1:'+ end, {'type': 'text',
-                                            'criteria': 'containing',
-                                            'value':'→',
-                                            'format': highlight_fmt})
-
-    # highlight new/changed rows
-    for row in range(dfDiff.shape[0]):
-        if row+1 in newRows:
-            worksheet.set_row(row+2, 15, new_fmt)
-        if row+1 in droppedRows:
-            worksheet.set_row(row+2, 15, grey_fmt)
-
-    # save
-    writer.save()
-
-    return output_string + '\nExported DIFF to ' + str(Path.cwd()) + '\\output\\' + fname + '\n'
+    with stages.stage('diff', 'export', name_NEW, len(dfDiff)):
+        fname = '{} vs {}'.format(name_OLD, name_NEW)
+        workbook = export.open_workbook('../output/diff/' + fname + '.xlsx')
+
+        # define formats
+        header_fmt = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+        grey_fmt = workbook.add_format({'font_color': '#E0E0E0'})
+        highlight_fmt = workbook.add_format({'font_color': '#FF0000', 'bg_color':'#B1B3B3'})
+        new_fmt = workbook.add_format({'font_color': '#32CD32','bold':True})
+
+        # highlight new/dropped rows as they are written
+        row_formats = dict.fromkeys(newRows, new_fmt)
+        row_formats.update(dict.fromkeys(droppedRows, grey_fmt))
+        worksheet = export.write_sheet(workbook, 'DIFF', dfDiff, header_fmt, row_formats)
+        worksheet.hide_gridlines(2)
+        worksheet.set_default_row(15)
+
+        ## highlight changed cells
+        end = 'ZZ' + str(len(dfDiff))
+        worksheet.conditional_format('A1:'+ end, {'type': 'text',
+                                                'criteria': 'containing',
+                                                'value':'→',
+                                                'format': highlight_fmt})
+
+        if copies:
+            export.write_sheet(workbook, name_NEW[:31], df_NEW, header_fmt)
+            export.write_sheet(workbook, name_OLD[:31], df_OLD, header_fmt)
+
+        # save
+        workbook.close()
+
+        output_string += '\nExported DIFF to ' + str(Path.cwd()) + '\\output\\' + fname + '.xlsx\n'
+        changed = change_set(dfDiff, keys, newRows, droppedRows, changes)
+        if changes_format:
+            changes_path = write_changes(changed, '../output/diff/' + fname, changes_format)
+            output_string += 'Exported changes to ' + changes_path + '\n'
+    return output_string, row_changes(changed, keys)
+
+
+def get_period(path):
+    '''Returns a sort key for a file from the MM-YYYY in its name
+
+    Keyword Arguments:
+        path -- Path of the Excel file
+    '''
+    found = re.search(r'(\d{2})-(\d{4})', path.stem)
+    if found:
+        return int(found.group(2)), int(found.group(1)), path.stem
+    return 0, 0, path.stem
+
+
+def index_file(path):
+    '''Parses a file into the fingerprint index without returning it'''
+    import fingerprint
+    fingerprint.load(path)
+
+
+def excel_diff_series(paths, keys=None, workers=None, copies=True, changes_format=None):
+    '''Diffs every file against the one before it, ordered by period.
+    Each workbook is parsed once and adjacent pairs run in worker processes.
+    Exports a summary of how each key changed across the series
+
+    Keyword Arguments:
+        paths -- Paths of the Excel files
+        keys -- Columns to match rows on. Rows are matched by position if None
+        workers -- Number of worker processes. Defaults to the CPU count
+        copies -- Whether to add full copies of the old and new sheets
+        changes_format -- Also writes each change set as 'csv' or 'parquet'
+    '''
+    import export
+    import pandas as pd
+    paths = sorted(paths, key=get_period)
+    if len(paths) < 2:
+        return '\n[ERROR] A series needs at least two files\n'
+    pairs = list(zip(paths[:-1], paths[1:]))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Parse each file once. The pairs then read it from the index
+        list(pool.map(index_file, paths))
+        results = list(pool.map(diff_files, *zip(*pairs), [keys] * len(pairs),
+                                [copies] * len(pairs), [changes_format] * len(pairs)))
+
+    output_string = ''
+    summaries = []
+    pair_names = []
+    for (path_OLD, path_NEW), (pair_string, changes) in zip(pairs, results):
+        pair_names.append('{} vs {}'.format(path_OLD.stem, path_NEW.stem))
+        output_string += '\n' + pair_names[-1] + pair_string
+        changes['Pair'] = pair_names[-1]
+        summaries.append(changes)
+
+    # One row per key, one column per pair
+    changes = pd.concat(summaries, ignore_index=True)
+    index = [col for col in changes.columns if col not in ('Status', 'Pair')]
+    summary = changes.pivot_table(index=index, columns='Pair', values='Status',
+                                  aggfunc='first', fill_value='')
+    summary = summary.reindex(columns=pair_names, fill_value='')
+
+    fname = 'series {} to {}.xlsx'.format(paths[0].stem, paths[-1].stem)
+    workbook = export.open_workbook('../output/diff/' + fname)
+    header_fmt = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+    summary.columns.name = None
+    export.write_sheet(workbook, 'SUMMARY', summary.reset_index(), header_fmt, index=False)
+    workbook.close()
+
+    output_string += '\nExported SUMMARY to ' + str(Path.cwd()) + '\\output\\' + fname + '\n'
+    return output_string
 
 
 class Application(tk.Frame):
@@ -104,6 +490,11 @@ class Application(tk.Frame):
         self.old = StringVar()
         self.new = StringVar()
         self.output = StringVar()
+        self.by_key = tk.BooleanVar()
+        self.stream = tk.BooleanVar()
+        self.skip_copies = tk.BooleanVar()
+        self.changes_format = StringVar()
+        self.changes_format.set('none')
         self.padx = 5
         self.pady = 10
         self.entry_width = 94
@@ -138,14 +529,77 @@ class Application(tk.Frame):
         run_msg = tk.Message(self, textvariable=self.output, width=200, relief="solid", bg="white")
         run_msg.grid(row=2, column=1)
 
+        run_series = tk.Button(self)
+        run_series["text"] = "Run Series"
+        run_series["command"] = self.start_series
+        run_series.grid(row=3, column=0, padx=self.padx, pady=self.pady)
+
+        by_key = tk.Checkbutton(self, variable=self.by_key)
+        by_key["text"] = "Match rows by key columns"
+        by_key.grid(row=3, column=1, sticky="w")
+
+        stream = tk.Checkbutton(self, variable=self.stream, command=self.toggle_stream)
+        stream["text"] = "Low memory (stream large files)"
+        stream.grid(row=4, column=1, sticky="w")
+
+        skip_copies = tk.Checkbutton(self, variable=self.skip_copies)
+        skip_copies["text"] = "Leave out old/new sheet copies"
+        skip_copies.grid(row=5, column=1, sticky="w")
+
+        changes_label = tk.Label(self, text="Change set file")
+        changes_label.grid(row=6, column=0, padx=self.padx)
+
+        self.changes_menu = tk.OptionMenu(self, self.changes_format, 'none', 'csv', 'parquet')
+        self.changes_menu.grid(row=6, column=1, sticky="w")
+
+    def toggle_stream(self):
+        # The streaming diff keeps no change set to write
+        if self.stream.get():
+            self.changes_format.set('none')
+            self.changes_menu.config(state='disabled')
+        else:
+            self.changes_menu.config(state='normal')
+
     def start_diff(self):
         try:
-            results = excel_diff(Path(self.old.get()), Path(self.new.get()))
+            path_NEW = Path(self.new.get())
+            keys = get_keys(path_NEW) if self.by_key.get() else None
+            if self.stream.get():
+                from streamdiff import stream_diff
+                results = stream_diff(Path(self.old.get()), path_NEW, keys,
+                                      self.get_export_options()[0])
+            else:
+                results = excel_diff(Path(self.old.get()), path_NEW, keys,
+                                     *self.get_export_options())
             print(results)
             self.output.set("Done. Check the console for the results")
         except PermissionError:
             error_msg = '[ERROR] Could not find file(s). Are both paths valid?'
             self.output.set(error_msg)
+        except FileNotFoundError:
+            error_msg = '[ERROR] Config not found for {}'.format(get_prefix(path_NEW.name))
+            self.output.set(error_msg)
+
+    def start_series(self):
+        paths = filedialog.askopenfilenames(initialdir = '../input/diff',
+                                            title = "Select files",
+                                            filetypes = (("xlsx files","*.xlsx"),("all files","*.*")))
+        try:
+            paths = [Path(path) for path in paths]
+            keys = get_keys(paths[0]) if self.by_key.get() and paths else None
+            results = excel_diff_series(paths, keys, None, *self.get_export_options())
+            print(results)
+            self.output.set("Done. Check the console for the results")
+        except PermissionError:
+            error_msg = '[ERROR] Could not find file(s). Are all paths valid?'
+            self.output.set(error_msg)
+        except FileNotFoundError:
+            error_msg = '[ERROR] Config not found for {}'.format(get_prefix(paths[0].name))
+            self.output.set(error_msg)
+
+    def get_export_options(self):
+        changes_format = self.changes_format.get()
+        return not self.skip_copies.get(), None if changes_format == 'none' else changes_format
 
     def set_old(self):
         self.old.set(self.get_file())
@@ -0,0 +1,124 @@
+'''
+Excel and CSV exports shared by diff, formatcheck and numberchecker.
+
+Workbooks are written with xlsxwriter in constant memory mode. Rows go out
+one at a time, in order, with their highlight formats applied as they are
+written, so nothing is rewritten afterwards and memory does not grow with
+the size of the sheet. write_exceptions writes only the flagged rows.
+'''
+from pathlib import Path
+import numpy as np
+import os
+import pandas as pd
+import xlsxwriter
+
+
+HIGHLIGHT = {'font_color': '#FF0000', 'bg_color':'#B1B3B3'}
+EXCEPTION_FORMATS = ('xlsx', 'csv')
+
+
+def open_workbook(path):
+    '''Returns a constant memory xlsxwriter Workbook. Cells are written as
+    they are, never turned into formulas or links
+
+    Keyword Arguments:
+        path -- Path of the new Excel file
+    '''
+    if not os.path.exists(Path(path).parent):
+        os.makedirs(Path(path).parent)
+    return xlsxwriter.Workbook(str(path), {'constant_memory': True,
+                                           'strings_to_formulas': False,
+                                           'strings_to_urls': False})
+
+
+def replace_values(df, to_replace):
+    '''Replaces whole cell values in the columns that contain them.
+    Columns without any are left alone
+
+    Keyword Arguments:
+        df -- A pandas DataFrame, changed in place
+        to_replace -- Dictionary of old value to new value
+    '''
+    if not to_replace:
+        return df
+    for col in df.columns:
+        if pd.api.types.is_numeric_dtype(df[col]):
+            continue
+        found = df[col].isin(list(to_replace))
+        if found.any():
+            df.loc[found, col] = df.loc[found, col].map(to_replace)
+    return df
+
+
+def write_sheet(workbook, name, df, header_fmt, row_formats=None,
+                highlights=None, highlight_fmt=None, index=True):
+    '''Writes a DataFrame one row at a time, in order, so the workbook can
+    use constant memory mode
+
+    Keyword Arguments:
+        workbook -- An xlsxwriter Workbook
+        name -- Name of the new sheet
+        df -- A pandas DataFrame
+        header_fmt -- Format of the header row and index column
+        row_formats -- Dictionary of row label to row format
+        highlights -- Boolean array with a row and column per cell of df,
+                      True for the cells to write in highlight_fmt
+        highlight_fmt -- Format of the highlighted cells
+        index -- Whether to write the index as the first column
+    '''
+    row_formats = row_formats or {}
+    worksheet = workbook.add_worksheet(name)
+    date_fmt = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+    dates = [i for i, dtype in enumerate(df.dtypes) if pd.api.types.is_datetime64_any_dtype(dtype)]
+    first = 1 if index else 0
+    worksheet.write_row(0, first, [str(col) for col in df.columns], header_fmt)
+
+    # Missing values are written as blank cells
+    values = df.to_numpy(dtype=object)
+    values[df.isna().to_numpy()] = None
+    flagged = np.zeros(len(df), dtype=bool) if highlights is None else highlights.any(axis=1)
+    for row, (label, cells) in enumerate(zip(df.index, values), 1):
+        row_fmt = row_formats.get(label)
+        if index:
+            worksheet.write(row, 0, label, header_fmt)
+        if flagged[row - 1]:
+            for col, value in enumerate(cells):
+                fmt = highlight_fmt if highlights[row - 1, col] else row_fmt
+                worksheet.write(row, col + first, value, fmt)
+        else:
+            worksheet.write_row(row, first, cells.tolist(), row_fmt)
+        for col in dates:
+            if cells[col] is not None:
+                fmt = highlight_fmt if flagged[row - 1] and highlights[row - 1, col] else row_fmt
+                worksheet.write_datetime(row, col + first, cells[col], fmt or date_fmt)
+    return worksheet
+
+
+def write_exceptions(df, highlights, path, exceptions_format='xlsx', first_row=2):
+    '''Writes only the rows with highlighted cells, with the row number
+    they have in the source sheet. Returns the path of the new file
+
+    Keyword Arguments:
+        df -- A pandas DataFrame
+        highlights -- Boolean array with a row and column per cell of df
+        path -- Path of the output file, without a suffix
+        exceptions_format -- 'xlsx' or 'csv'
+        first_row -- Sheet row number of the row labelled 0 in df
+    '''
+    if exceptions_format not in EXCEPTION_FORMATS:
+        raise ValueError('Unsupported exceptions format: ' + str(exceptions_format))
+    rows = np.flatnonzero(highlights.any(axis=1))
+    exceptions = df.iloc[rows]
+    exceptions.index = pd.Index(df.index[rows] + first_row, name='Row')
+    path = str(path) + '.' + exceptions_format
+    if exceptions_format == 'csv':
+        if not os.path.exists(Path(path).parent):
+            os.makedirs(Path(path).parent)
+        exceptions.to_csv(path)
+        return path
+    workbook = open_workbook(path)
+    header_fmt = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+    write_sheet(workbook, 'Exceptions', exceptions, header_fmt,
+                highlights=highlights[rows], highlight_fmt=workbook.add_format(HIGHLIGHT))
+    workbook.close()
+    return path
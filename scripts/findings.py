@@ -0,0 +1,144 @@
+'''
+Findings collected by formatcheck and numberchecker.
+
+A check adds its findings a column at a time, as arrays of rows and values.
+Nothing is printed per row. The findings can be exported as JSON Lines, CSV
+or Parquet, and the console gets a summary that is capped at SUMMARY_LIMIT
+examples, so reporting takes about the same time however many rows fail.
+
+Every record has the fields in FIELDS. row is the row number of the cell
+in the source sheet, counting the header as row 1. sheet is blank unless
+the findings of several sheets were merged into one report.
+'''
+from pathlib import Path
+import numpy as np
+import os
+import pandas as pd
+
+
+FIELDS = ('sheet', 'row', 'column', 'rule', 'value', 'severity')
+SEVERITIES = ('error', 'warning', 'info')
+SUMMARY_LIMIT = 20
+FORMATS = {'.jsonl' : 'jsonl', '.csv' : 'csv', '.parquet' : 'parquet'}
+
+
+class Findings:
+    '''
+    Columnar store of findings. Rows and values are kept as the arrays they
+    were added with, one chunk per sheet, column and rule
+    '''
+
+    __slots__ = ['chunks']
+
+    def __init__(self):
+        '''Constructor for Findings'''
+        self.chunks = []
+
+
+    def add(self, rows, column, rule, values, severity='error'):
+        '''Records one finding per row
+
+        Keyword Arguments:
+            rows -- Array of sheet row numbers
+            column -- Name of the column the rule was applied to
+            rule -- Name of the rule that failed
+            values -- Array of the offending values, one per row
+            severity -- One of SEVERITIES
+        '''
+        if severity not in SEVERITIES:
+            raise ValueError('Unknown severity: ' + str(severity))
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows):
+            self.chunks.append((rows, str(column), rule,
+                                np.asarray(values, dtype=object), severity, ''))
+
+
+    def merge(self, other, sheet):
+        '''Adds the findings of one sheet to this report
+
+        Keyword Arguments:
+            other -- Findings of the sheet
+            sheet -- Name of the sheet
+        '''
+        self.chunks.extend(chunk[:5] + (str(sheet),) for chunk in other.chunks)
+
+
+    def __len__(self):
+        return sum(len(chunk[0]) for chunk in self.chunks)
+
+
+    def counts(self):
+        '''Returns a dictionary of (severity, rule, column) to number of findings'''
+        counts = {}
+        for rows, column, rule, values, severity, sheet in self.chunks:
+            key = (severity, rule, column)
+            counts[key] = counts.get(key, 0) + len(rows)
+        return counts
+
+
+    def frame(self):
+        '''Returns the findings as a DataFrame with the columns in FIELDS'''
+        if not self.chunks:
+            return pd.DataFrame({'sheet' : [], 'row' : np.array([], dtype=np.int64),
+                                 'column' : [], 'rule' : [], 'value' : [],
+                                 'severity' : []})
+        rows, columns, rules, values, severities, sheets = zip(*self.chunks)
+        lengths = [len(chunk) for chunk in rows]
+        return pd.DataFrame({
+            'sheet' : pd.Categorical(np.repeat(sheets, lengths)),
+            'row' : np.concatenate(rows),
+            'column' : pd.Categorical(np.repeat(columns, lengths)),
+            'rule' : pd.Categorical(np.repeat(rules, lengths)),
+            'value' : np.concatenate(values).astype(str),
+            'severity' : pd.Categorical(np.repeat(severities, lengths),
+                                        categories=SEVERITIES),
+        })
+
+
+    def summary(self, limit=SUMMARY_LIMIT):
+        '''Returns a readable summary with counts by rule and column and at
+        most limit example rows
+
+        Keyword Arguments:
+            limit -- Number of example rows to include
+        '''
+        total = len(self)
+        if not total:
+            return 'No findings'
+        lines = ['Findings: ' + str(total)]
+        for (severity, rule, column), count in self.counts().items():
+            lines.append('  {:<8}{:<20}{}: {}'.format(severity, rule, column, count))
+        lines.append('')
+        shown = 0
+        for rows, column, rule, values, severity, sheet in self.chunks:
+            where = sheet + ' Row ' if sheet else 'Row '
+            for row, value in zip(rows[:limit - shown], values[:limit - shown]):
+                lines.append('{}{}: {} {} ({})'.format(where, row, rule, column, value))
+            shown += min(len(rows), limit - shown)
+            if shown == limit:
+                break
+        if total > shown:
+            lines.append('... and {} more. See the exported findings'.format(total - shown))
+        return '\n'.join(lines)
+
+
+    def export(self, path):
+        '''Writes the findings to path as JSON Lines, CSV or Parquet,
+        depending on its suffix. Returns the path
+
+        Keyword Arguments:
+            path -- Path of the output file
+        '''
+        path = Path(path)
+        if path.suffix not in FORMATS:
+            raise ValueError('Unsupported findings format: ' + path.suffix)
+        if not os.path.exists(path.parent):
+            os.makedirs(path.parent)
+        df = self.frame()
+        if FORMATS[path.suffix] == 'jsonl':
+            df.to_json(path, orient='records', lines=True)
+        elif FORMATS[path.suffix] == 'csv':
+            df.to_csv(path, index=False)
+        else:
+            df.to_parquet(path, index=False)
+        return path
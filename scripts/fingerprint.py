@@ -0,0 +1,103 @@
+'''
+Row fingerprints for incremental diffs.
+
+Each Excel file that excel_diff reads gets an index entry keyed by the hash
+of the file content. An entry holds a hash for every cell of every column
+and a hash for every row. The parsed sheet itself comes from sheetcache, so
+diffing next month's file against this one skips parsing the old workbook
+and compares only the rows whose fingerprints differ.
+'''
+from pathlib import Path
+import numpy as np
+import os
+import pandas as pd
+import pickle
+import sheetcache
+
+
+INDEX_PATH = '../output/diff/index/'
+# Bump when the layout of an index entry or the hashes change
+INDEX_VERSION = 3
+
+
+def hash_column(values):
+    '''Returns the hash of every cell of a column. Cells of object columns
+    are hashed by their string form, so the type of each cell is mixed in
+    too. Otherwise 0 and '0', or 1.0 and '1.0', would hash the same
+
+    Keyword Arguments:
+        values -- A pandas Series
+    '''
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    if values.dtype != object:
+        return hashes
+    codes, types = pd.factorize(values.map(type))
+    names = np.array([kind.__module__ + '.' + kind.__qualname__ for kind in types], dtype=object)
+    return hashes * np.uint64(1000003) ^ pd.util.hash_array(names)[codes]
+
+
+def make_fingerprints(df):
+    '''Returns the row hashes and per-column cell hashes of a DataFrame
+
+    Keyword Arguments:
+        df -- A pandas DataFrame
+    '''
+    col_hashes = pd.DataFrame({col: hash_column(df[col]) for col in df.columns})
+    row_hashes = np.zeros(len(df), dtype=np.uint64)
+    for col in col_hashes.columns:
+        row_hashes = row_hashes * np.uint64(1000003) ^ col_hashes[col].to_numpy()
+    return row_hashes, col_hashes
+
+
+def make_index_path():
+    '''Creates the index directory if it does not exist'''
+    if not os.path.exists(INDEX_PATH):
+        os.makedirs(INDEX_PATH)
+
+
+def load(path):
+    '''Returns the parsed sheet of an Excel file and its fingerprints.
+    Fingerprints are read from the index if the same content was seen
+    before, otherwise computed and added to the index
+
+    Keyword Arguments:
+        path -- Path of the Excel file
+    '''
+    df = sheetcache.read_excel(path).fillna(0)
+    index_file = Path(INDEX_PATH, sheetcache.file_digest(path) + '.pkl')
+    if index_file.exists():
+        with open(index_file, 'rb') as file:
+            entry = pickle.load(file)
+        if entry['version'] == INDEX_VERSION:
+            return df, (entry['row_hashes'], entry['col_hashes'])
+
+    row_hashes, col_hashes = make_fingerprints(df)
+    make_index_path()
+    with open(index_file, 'wb') as file:
+        pickle.dump({'version' : INDEX_VERSION,
+                     'source' : str(path),
+                     'row_hashes' : row_hashes,
+                     'col_hashes' : col_hashes}, file, pickle.HIGHEST_PROTOCOL)
+    return df, (row_hashes, col_hashes)
+
+
+def changed_rows(hashes_OLD, hashes_NEW, pos_OLD, pos_NEW, cols):
+    '''Returns a mask over row pairs whose fingerprints differ in cols
+
+    Keyword Arguments:
+        hashes_OLD -- Row and column hashes of the old file
+        hashes_NEW -- Row and column hashes of the new file
+        pos_OLD -- Positions of the old rows
+        pos_NEW -- Positions of the new rows, paired with pos_OLD
+        cols -- Columns being compared
+    '''
+    rows_OLD, cols_OLD = hashes_OLD
+    rows_NEW, cols_NEW = hashes_NEW
+    # Equal row hashes mean equal rows, so only the rest are checked by column
+    candidates = np.flatnonzero(rows_OLD[pos_OLD] != rows_NEW[pos_NEW])
+    mask = np.zeros(len(pos_NEW), dtype=bool)
+    if cols and len(candidates):
+        cells_OLD = cols_OLD[cols].to_numpy()[pos_OLD[candidates]]
+        cells_NEW = cols_NEW[cols].to_numpy()[pos_NEW[candidates]]
+        mask[candidates] = (cells_OLD != cells_NEW).any(axis=1)
+    return mask
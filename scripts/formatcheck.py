@@ -1,18 +1,28 @@
 '''
 For Checking anomolies within data
 '''
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from tkinter import filedialog, StringVar
+import configcache
+import contextlib
+import io
 import json
 import os
-import pandas as pd
+import stages
 import tkinter as tk
+# pandas, NumPy and the modules built on them are imported where they are
+# used, so the window opens before they load
 
 
 __author__ = 'Edward Chang'
 
 
+# Rules applied by FormatChecker.scan
+RULES = ('unit', 'year', 'field', 'nan', 'w', 'declared')
+
+
 class FormatChecker:
     '''
     Checks Excel File for Header format, Correct Units, and other fields
@@ -31,13 +41,12 @@ class FormatChecker:
 
 
     def read_config(self, prefix):
-        '''Returns an decoded json file
+        '''Returns the compiled config, from cache unless the json changed
 
         Keyword Arguments:
             prefix -- Prefix of the json file
         '''
-        with open('config/' + prefix + 'config.json', 'r') as config:
-            return json.load(config)
+        return configcache.load('config/' + prefix + 'config.json', compile_config, version=2)
 
 
     def get_w_count(self, df):
@@ -45,20 +54,7 @@ class FormatChecker:
         Keyword Arguments:
             df -- A pandas DataFrame
         '''
-        volume_w_count = 0
-        state_w_count = 0
-        # If Volume is present in df
-        if df.columns.contains('Volume'):
-            for entry in df['Volume']:
-                if entry in ('W', 'Withheld'):
-                    volume_w_count += 1
-        # If State is present in df
-        if df.columns.contains('State'):
-            for entry in df['State']:
-                if entry in ('W', 'Withheld'):
-                    state_w_count += 1
-        # Returns Tuple of W count
-        return volume_w_count, state_w_count
+        return self.scan(df, ('w',))[1]
 
 
     def check_header(self, df):
@@ -92,68 +88,31 @@ class FormatChecker:
 
         Keyword Arguments:
             df -- A pandas DataFrame
-            replace -- Dictionary with values to replace
         '''
-        default = self.config['unit_dict']
-        replace = self.config['replace_dict']
-        col = get_com_pro(df)
-        invalid = False
-        replaced_dict = {i:[] for i in replace.keys()}
-        is_replaced = False
-        if col == 'n/a':
+        if get_com_pro(df) == 'n/a':
             return 'No Units Available'
-        for row in range(len(df[col])):
-            cell = df.loc[row, col]
-            if replace and replace.__contains__(cell):
-                replaced_dict.get(cell).append(row + 1)
-                is_replaced = True
-                continue
-            if self._check_unit(cell, default, row) == 1:
-                df.loc[row, col] = '[!]' + cell
-                invalid = True
-        if is_replaced:
-            print('Items to replace: ', replaced_dict)
-        if not invalid:
-            print('All units valid :)')
+        return self.report(df, ('unit',))
 
 
-    def _check_unit(self, string, default, index):
-        '''Checks if item and unit in unit_dict'''
+    def _check_unit(self, string, default):
+        '''Returns the rule an item and unit break in unit_dict,
+        or None if they are valid'''
         if string == '':
-            return 0
+            return None
         # Splits line by Item and Unit
         line = split_unit(string)
         # Checks if Item is valid and has correct units
         if default.__contains__(line[0]):
             if line[1] not in default.get(line[0]):
-                print('Row ' + str(index + 2) + ': Unexpected Unit - (' + line[1]
-                      + ') [For Item: ' + line[0] + ']')
-                return 1
+                return 'unexpected_unit'
         elif line[0] != '':
-            print('Row ' + str(index) + ': Unknown Item: ' + line[0])
-            return 1
-        return 0
+            return 'unknown_item'
+        return None
 
 
     def check_misc_cols(self, df):
         '''Checks non-numerical columns for Unexpected Values'''
-        default = self.config['field_dict']
-        invalid = False
-        if df.columns.contains('Calendar Year'):
-            self.check_year(df['Calendar Year'])
-        elif df.columns.contains('Fiscal Year'):
-            self.check_year(df['Fiscal Year'])
-        for field in default:
-            if df.columns.contains(field):
-                for row in range(len(df[field])):
-                    cell = df.loc[row, field]
-                    if cell not in default.get(field) and cell != '':
-                        print(field + ' Row ' + str(row + 2)
-                              + ': Unexpected Entry: ' + str(cell))
-                        invalid = True
-                        df.loc[row, field] = '[!]' + cell
-        if not invalid:
-            print('All fields valid :)')
+        return self.report(df, ('year', 'field'))
 
 
     def check_year(self, col):
@@ -162,23 +121,142 @@ class FormatChecker:
         Keyword Arguments:
             col -- Column in which year is located
         '''
-        current_year = datetime.now().year
-        years = {i for i in range(current_year, 1969, -1)}
-        for row, year in enumerate(col):
-            if year not in years:
-                print('Row ' + str(row + 2) + ': Invalid year ' + str(year))
+        import numpy as np
+        for row in np.flatnonzero(~col.isin(get_years())):
+            print('Row ' + str(row + 2) + ': Invalid year ' + str(col.iloc[row]))
 
 
     def check_nan(self, df):
         '''Checks if specific columns are missing values
         '''
-        cols = self.config['na_check']
-        for col in cols:
-            if df.columns.contains(col):
-                for row in range(len(df.index)):
-                    if df.loc[row, col] == '':
-                        print('Row ' + str(row + 2) + ': Missing ' + col)
-                        df.loc[row, col] = '[!]'
+        return self.report(df, ('nan',))
+
+
+    def report(self, df, rules=RULES):
+        '''Runs scan and prints a summary of the findings.
+        Returns the findings
+
+        Keyword Arguments:
+            df -- A pandas DataFrame
+            rules -- Names of the rules to apply, see RULES
+        '''
+        found = self.scan(df, rules)[2]
+        if len(found):
+            print(found.summary())
+        return found
+
+
+    def scan(self, df, rules=RULES):
+        '''Checks the DataFrame one column at a time. Each column is
+        factorized once, every rule that applies to it is evaluated over its
+        distinct values, and the results are broadcast back to the rows.
+        Marks flagged cells with [!] and returns a DataFrame of flags, the
+        (Volume, Location) W counts and the Findings
+
+        Keyword Arguments:
+            df -- A pandas DataFrame
+            rules -- Names of the rules to apply, see RULES
+        '''
+        from findings import Findings
+        import numpy as np
+        import pandas as pd
+        import ruleengine
+        unit_dict = self.config['unit_dict']
+        replace = self.config['replace_dict']
+        field_dict = self.config['field_dict'] if 'field' in rules else {}
+        na_check = self.config['na_check'] if 'nan' in rules else []
+        # Configs set up from files without units have no unit_dict
+        unit_col = get_com_pro(df) if 'unit' in rules and unit_dict else 'n/a'
+        year_col = None
+        if 'year' in rules:
+            year_col = next((col for col in ('Calendar Year', 'Fiscal Year')
+                             if col in df.columns), None)
+        w_cols = ('Volume', 'State') if 'w' in rules else ()
+
+        found = Findings()
+        flags = pd.DataFrame(False, index=df.index, columns=df.columns)
+        w_count = {col: 0 for col in ('Volume', 'State')}
+
+        # Rules from the config are evaluated before any cell is marked
+        declared = {}
+        if 'declared' in rules:
+            for rule, bad in ruleengine.evaluate(df, self.config['rules']):
+                col = rule['column']
+                rows = np.flatnonzero(bad)
+                found.add(rows + 2, col, rule['name'], df[col].to_numpy()[rows], rule['severity'])
+                declared[col] = declared.get(col, False) | bad
+
+        for col in df.columns:
+            if (col not in (unit_col, year_col) and col not in field_dict
+                    and col not in na_check and col not in w_cols and col not in declared):
+                continue
+            codes, uniques = pd.factorize(df[col])
+            # Missing values get code -1, which indexes the trailing ''
+            values = np.array(list(uniques) + [''], dtype=object)
+            count = np.bincount(codes, minlength=len(values))
+            prefix = np.zeros(len(values), dtype=bool)
+            blank = np.zeros(len(values), dtype=bool)
+
+            if col == unit_col:
+                to_replace = np.array([value in replace for value in values], dtype=bool)
+                errors = np.array([None if is_replaced else self._check_unit(value, unit_dict)
+                                   for value, is_replaced in zip(values, to_replace)], dtype=object)
+                self._add(found, codes, values, to_replace, col, 'replace', 'info')
+                for rule in ('unknown_item', 'unexpected_unit'):
+                    prefix |= self._add(found, codes, values, errors == rule, col, rule)
+            if col == year_col:
+                years = get_years()
+                bad = np.array([value not in years for value in values], dtype=bool)
+                flags[col] = self._add(found, codes, values, bad, col,
+                                       'invalid_year', 'warning')[codes]
+            if col in field_dict:
+                allowed = field_dict[col]
+                bad = np.array([value not in allowed and value != '' for value in values], dtype=bool)
+                prefix |= self._add(found, codes, values, bad, col, 'unexpected_entry')
+            if col in na_check:
+                blank = np.array([value == '' for value in values], dtype=bool)
+                self._add(found, codes, values, blank, col, 'missing')
+            if col in w_cols:
+                is_w = np.array([value in ('W', 'Withheld') for value in values], dtype=bool)
+                w_count[col] = int(count[is_w].sum())
+
+            # One assignment per column for every flagged cell
+            marks = prefix[codes] | blank[codes] | declared.get(col, False)
+            if marks.any():
+                marked = np.array(['[!]' + str(value) for value in values], dtype=object)
+                marked[blank] = '[!]'
+                flagged = np.flatnonzero(marks)
+                cells = df[col].to_numpy(dtype=object, copy=True)
+                cells[flagged] = marked[codes[flagged]]
+                df[col] = cells
+                flags[col] |= marks
+
+        rules_found = {rule for severity, rule, column in found.counts()}
+        if unit_col != 'n/a' and not rules_found & {'unknown_item', 'unexpected_unit'}:
+            print('All units valid :)')
+        if 'field' in rules and 'unexpected_entry' not in rules_found:
+            print('All fields valid :)')
+        return flags, (w_count['Volume'], w_count['State']), found
+
+
+    def _add(self, found, codes, values, bad, col, rule, severity='error'):
+        '''Adds a finding for every row whose distinct value is bad.
+        Returns bad
+
+        Keyword Arguments:
+            found -- Findings to add to
+            codes -- Codes of the rows from pd.factorize
+            values -- Distinct values of the column
+            bad -- Mask over values that break the rule
+            col -- Name of the column
+            rule -- Name of the rule
+            severity -- Severity of the findings
+        '''
+        import numpy as np
+        if bad.any():
+            rows = np.flatnonzero(bad[codes])
+            found.add(rows + 2, col, rule, values[codes[rows]], severity)
+        return bad
 
 
 class Setup:
@@ -208,24 +286,62 @@ class Setup:
         col = get_com_pro(self.df)
         if col == 'n/a':
             return None
-        for row in self.df[col]:
+        # Each distinct entry is split once
+        for row in self.df[col].unique():
             # Key and Value split
             line = split_unit(row)
             key, value = line[0], line[1]
             add_item(key, value, units)
-        return units
+        return sorted_values(units)
 
 
-    # Returns a dictionary of fields not listed in col_wlist
-    def get_misc_cols(self):
+    # Returns the columns not listed in col_wlist
+    def get_field_cols(self):
         col_wlist = {'Revenue', 'Volume', 'Month', 'Production Volume',
                      'Total', 'Calendar Year'}
         col_wlist.add(get_com_pro(self.df))
-        fields = {}
-        for col in self.df.columns:
-            if col not in col_wlist:
-                fields[col] = list({i for i in self.df[col]})
-        return fields
+        return [col for col in self.df.columns if col not in col_wlist]
+
+
+    # Returns a dictionary of fields not listed in col_wlist
+    def get_misc_cols(self):
+        return {col: self.df[col].unique().tolist() for col in self.get_field_cols()}
+
+
+    def get_frequencies(self):
+        '''Returns how often each value appears in the unit and field
+        columns, as a dictionary of column to value_counts'''
+        cols = self.get_field_cols()
+        if get_com_pro(self.df) != 'n/a':
+            cols.append(get_com_pro(self.df))
+        return {col: self.df[col].value_counts() for col in cols}
+
+
+    def merge_config(self, config, frequencies, min_count=1):
+        '''Adds the units and fields of the DataFrame to a config.
+        Values are accepted once they have been seen min_count times in
+        all learned files
+
+        Keyword Arguments:
+            config -- Config from value_sets, changed in place
+            frequencies -- Dictionary of column to value to count over all
+                           learned files, changed in place
+            min_count -- Times a value must be seen before it is accepted
+        '''
+        unit_col = get_com_pro(self.df)
+        for col, counts in self.get_frequencies().items():
+            seen = frequencies.setdefault(col, {})
+            for value, count in counts.items():
+                seen[str(value)] = seen.get(str(value), 0) + int(count)
+            accepted = [value for value in counts.index.tolist() if seen[str(value)] >= min_count]
+            if col == unit_col:
+                if config['unit_dict'] is None:
+                    config['unit_dict'] = {}
+                for value in accepted:
+                    line = split_unit(value)
+                    add_item(line[0], line[1], config['unit_dict'])
+            else:
+                config['field_dict'].setdefault(col, set()).update(accepted)
 
 
     def get_na_check(self):
@@ -251,13 +367,149 @@ class Setup:
         '''
         self.make_config_path()
         with open('config/' + prefix + 'config.json', 'w') as config:
-            json_config = {'header' : self.get_header(),
-                           'unit_dict' : self.get_unit_dict(),
-                           'field_dict' : self.get_misc_cols(),
-                           'replace_dict' : self.get_replace_dict(),
-                           'na_check' : self.get_na_check(),
-                           }
-            json.dump(json_config, config, indent=4)
+            json.dump(self.make_config(), config, indent=4)
+
+
+    def make_config(self):
+        '''Returns a new config based on the given Excel File'''
+        return {'header' : self.get_header(),
+                'unit_dict' : self.get_unit_dict(),
+                'field_dict' : self.get_misc_cols(),
+                'replace_dict' : self.get_replace_dict(),
+                'na_check' : self.get_na_check(),
+                'rules' : [],
+                }
+
+
+def read_json(path, default=None):
+    '''Returns a decoded json file, or default if it does not exist'''
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return default
+
+
+def learn_config(paths, prefix, min_count=1):
+    '''Learns a config from many Excel files and merges it into the
+    existing one. Files already learned are recognised by their content
+    hash and skipped, so adding a new month only reads that month. Value
+    counts over all learned files are kept in config/[prefix]setup.json.
+    Returns the values held back for review
+
+    Keyword Arguments:
+        paths -- Paths of the Excel files
+        prefix -- Prefix of the json file
+        min_count -- Times a value must be seen before it is accepted
+    '''
+    import sheetcache
+    config_path = 'config/' + prefix + 'config.json'
+    setup_path = 'config/' + prefix + 'setup.json'
+    config = read_json(config_path)
+    if config is not None:
+        config = value_sets(config)
+    state = read_json(setup_path, {'files' : {}, 'frequencies' : {}})
+    setup = None
+    for path in paths:
+        digest = sheetcache.file_digest(path)
+        if digest in state['files']:
+            continue
+        print('Learning from ' + Path(path).name)
+        setup = Setup(sheetcache.read_excel(path).fillna(''))
+        if config is None:
+            config = {'header' : setup.get_header(),
+                      'unit_dict' : None,
+                      'field_dict' : {},
+                      'replace_dict' : setup.get_replace_dict(),
+                      'na_check' : setup.get_na_check(),
+                      'rules' : []}
+        setup.merge_config(config, state['frequencies'], min_count)
+        state['files'][digest] = Path(path).name
+    if setup is None:
+        print('No new files for ' + prefix)
+        return {}
+
+    setup.make_config_path()
+    for path, data in ((config_path, value_lists(config)), (setup_path, state)):
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'w') as file:
+            json.dump(data, file, indent=4)
+        os.replace(temp, path)
+    held_back = {}
+    for col, seen in state['frequencies'].items():
+        values = [value for value, count in seen.items() if count < min_count]
+        if values:
+            held_back[col] = values
+            print('Held back in {} (seen fewer than {} times): {}'.format(col, min_count, values))
+    return held_back
+
+
+def learn_folder(folder, min_count=1):
+    '''Learns a config for every dataset in a folder of Excel files.
+    Files are grouped by the prefix of their name
+
+    Keyword Arguments:
+        folder -- Path of the folder
+        min_count -- Times a value must be seen before it is accepted
+    '''
+    datasets = {}
+    for path in sorted(Path(folder).glob('*.xlsx')):
+        if not path.name.startswith('~$'):
+            datasets.setdefault(get_prefix(path.name), []).append(path)
+    for prefix, paths in datasets.items():
+        learn_config(paths, prefix, min_count)
+
+
+def compile_config(config):
+    '''Returns a decoded config with the allowed values of unit_dict and
+    field_dict as frozensets, so every lookup is O(1), and its declared
+    rules checked by ruleengine
+
+    Keyword Arguments:
+        config -- Decoded json config
+    '''
+    import ruleengine
+    config = dict(config)
+    for name in ('unit_dict', 'field_dict'):
+        if config.get(name) is not None:
+            config[name] = {key: frozenset(values) for key, values in config[name].items()}
+    config['rules'] = ruleengine.compile_rules(config.get('rules', []))
+    return config
+
+
+def value_sets(config):
+    '''Returns a decoded config with the values of unit_dict and field_dict
+    as sets, so merging a file adds each value in O(1)
+
+    Keyword Arguments:
+        config -- Decoded json config
+    '''
+    config = dict(config)
+    for name in ('unit_dict', 'field_dict'):
+        if config.get(name) is not None:
+            config[name] = {key: set(values) for key, values in config[name].items()}
+    return config
+
+
+def value_lists(config):
+    '''Returns a config from value_sets with sorted lists of values again,
+    the way it is written to json'''
+    config = dict(config)
+    for name in ('unit_dict', 'field_dict'):
+        if config.get(name) is not None:
+            config[name] = sorted_values(config[name])
+    return config
+
+
+def sorted_values(dct):
+    '''Returns a dictionary of key to a sorted list of its values. Values
+    of mixed types are sorted by their text'''
+    return {key: sorted(values, key=str) for key, values in dct.items()}
+
+
+def get_years():
+    '''Returns the set of valid years, 1970 to the current year'''
+    return set(range(1970, datetime.now().year + 1))
 
 
 def add_item(key, value, dct):
@@ -266,15 +518,9 @@ def add_item(key, value, dct):
     Keyword Arguments:
         key -- Key entry for the dict, e.g. A commodity
         value -- Value entry corresponding to key, e.g. Unit or Value
-        dictionary -- Reference to dictionary
+        dictionary -- Reference to dictionary of sets
     '''
-    # Adds Value to Set if Key exists
-    if key in dct:
-        if value not in dct[key]:
-            dct[key].append(value)
-    # Else adds new key with value
-    else:
-        dct[key] = [value]
+    dct.setdefault(key, set()).add(value)
 
 
 def get_prefix(name):
@@ -318,8 +564,21 @@ def get_com_pro(df):
         return 'Product'
 
 
-def check_sheet_name(xlfile):
-    if 'data' not in xlfile.sheet_names:
+def read_file(path):
+    '''Returns the first sheet of an Excel file, ready to be checked
+
+    Keyword Arguments:
+        path -- Path of the Excel file
+    '''
+    import sheetcache
+    with stages.stage('format', 'read', path) as stage:
+        df = sheetcache.read_excel(path).fillna('')
+        stage.rows = len(df)
+    return df
+
+
+def check_sheet_name(sheet_names):
+    if not any('data' in str(name).lower() for name in sheet_names):
         warning = 'WARNING! Keyword "data" is missing from sheet names'
         sep_line = '-' * len(warning)
         print(sep_line, warning, sep_line, sep='\n')
@@ -327,49 +586,157 @@ def check_sheet_name(xlfile):
     else:
         return True
 
+
+def match_sheets(path, sheet_names, prefix_of=get_prefix,
+                 config_of=lambda prefix: 'config/' + prefix + 'config.json'):
+    '''Returns a dictionary of data sheet name to config prefix. A sheet
+    whose own name gives a prefix with a config uses that config. Otherwise
+    a sheet named like "data", or the only sheet, uses the workbook's
+    config. Other sheets are left out
+
+    Keyword Arguments:
+        path -- Path of the Excel file
+        sheet_names -- Names of the sheets in the workbook
+        prefix_of -- Function giving the config prefix of a name
+        config_of -- Function giving the config path of a prefix
+    '''
+    matched = {}
+    for name in sheet_names:
+        prefix = prefix_of(name)
+        if prefix.strip('_') and os.path.exists(config_of(prefix)):
+            matched[name] = prefix
+        elif 'data' in str(name).lower() or len(sheet_names) == 1:
+            matched[name] = prefix_of(Path(path).name)
+    return matched
+
+
+# Exports an Excel df with replaced entries and flagged cells highlighted
+def export_sheet(workbook, df, flags, to_replace, sheet_name='Sheet1'):
+    import export
+    export.replace_values(df, to_replace)
+    header_format = workbook.add_format({
+        'align' : 'center',
+        'bold' : False,
+        'border' : 1,
+        'bg_color' : '#C0C0C0',
+        'valign' : 'bottom'
+    })
+#    cur_format = workbook.add_format({'num_format': '$#,##0.00'})
+#    num_format = workbook.add_format({'num_format': '#,##0.00'})
+    export.write_sheet(workbook, sheet_name, df, header_format,
+                       highlights=flags.to_numpy(),
+                       highlight_fmt=workbook.add_format(export.HIGHLIGHT),
+                       index=False)
+
+
+def run_checks(check, df):
+    '''Runs every check on a DataFrame and prints the results.
+    Returns the flags and the findings'''
+    with stages.stage('format', 'validate', rows=len(df)):
+        check.check_header(df)
+        print()
+        flags, w_count, found = check.scan(df)
+    print(found.summary())
+    print('\n(Volume) Ws Found: ' + str(w_count[0]))
+    print('(Location) Ws Found: ' + str(w_count[1]))
+    return flags, found
+
+
 # Creates FormatChecker and runs methods
-def do_check(df, prefix, pathname):
+def do_check(df, prefix, pathname, findings_format='jsonl', exceptions=None):
+    '''Checks a DataFrame, exports the marked sheet and the findings.
+    Returns the findings
 
+    Keyword Arguments:
+        df -- A pandas DataFrame
+        prefix -- Prefix of the json config
+        pathname -- Path of the Excel file
+        findings_format -- jsonl, csv or parquet
+        exceptions -- Also writes the flagged rows alone as 'xlsx' or 'csv'
+    '''
+    import export
     check = FormatChecker(prefix)
-    # Exports an Excel df with replaced entries
-    def export_excel(df, to_replace):
-        df.replace(to_replace, inplace=True)
-        writer = pd.ExcelWriter('../output/format/[new] ' + pathname.stem + '.xlsx', engine='xlsxwriter')
-        df.to_excel(writer, index=False, header=False)
-        workbook = writer.book
-        worksheet = writer.sheets['Sheet1']
-        highlight_fmt = workbook.add_format({'font_color': '#FF0000', 'bg_color':'#B1B3B3'})
-        header_format = workbook.add_format({
-            'align' : 'center',
-            'bold' : False,
-            'border' : 1,
-            'bg_color' : '#C0C0C0',
-            'valign' : 'bottom'
-        })
-    #    cur_format = workbook.add_format({'num_format': '$#,##0.00'})
-    #    num_format = workbook.add_format({'num_format': '#,##0.00'})
-        for col_num, value in enumerate(df.columns.values):
-            worksheet.write(0, col_num, value, header_format)
-
-        end = 'ZZ' + str(len(df))
-        worksheet.conditional_format('A1:'+ end, {'type': 'text',
-                                                'criteria': 'containing',
-                                                'value':'[!]',
-                                                'format': highlight_fmt})
-
-        writer.save()
+    flags, found = run_checks(check, df)
+
+    with stages.stage('format', 'export', pathname, len(df)):
+        workbook = export.open_workbook('../output/format/[new] ' + pathname.stem + '.xlsx')
+        export_sheet(workbook, df, flags, check.config['replace_dict'])
+        workbook.close()
         print('Exported new df to output')
+        if exceptions:
+            export.write_exceptions(df, flags.to_numpy(), '../output/format/[exceptions] '
+                                    + pathname.stem, exceptions)
+            print('Exported flagged rows to output')
+        found.export('../output/format/findings-' + pathname.stem + '.' + findings_format)
+        print('Exported findings to output')
+    return found
 
-    check.check_header(df)
-    print()
-    check.check_unit_dict(df)
-    check.check_misc_cols(df)
-    check.check_nan(df)
-    w_count = check.get_w_count(df)
-    print('\n(Volume) Ws Found: ' + str(w_count[0]))
-    print('(Location) Ws Found: ' + str(w_count[1]))
 
-    export_excel(df, check.config['replace_dict'])
+def check_sheet(df, prefix):
+    '''Checks one sheet in a worker process. Returns the marked
+    DataFrame, its flags, the findings, the console output and the
+    replace_dict
+
+    Keyword Arguments:
+        df -- The sheet as a pandas DataFrame
+        prefix -- Prefix of the json config
+    '''
+    console = io.StringIO()
+    with contextlib.redirect_stdout(console):
+        check = FormatChecker(prefix)
+        flags, found = run_checks(check, df)
+    return df, flags, found, console.getvalue(), check.config['replace_dict']
+
+
+def check_workbook(pathname, workers=None, findings_format='jsonl'):
+    '''Checks every data sheet of a workbook in parallel workers and
+    exports one marked workbook and one findings file for all of them.
+    The workbook is parsed once. Returns the merged findings
+
+    Keyword Arguments:
+        pathname -- Path of the Excel file
+        workers -- Number of worker processes. Defaults to the CPU count
+        findings_format -- jsonl, csv or parquet
+    '''
+    from findings import Findings
+    import export
+    import sheetcache
+    with stages.stage('format', 'read', pathname) as stage:
+        sheets = sheetcache.read_workbook(pathname)
+        stage.rows = sum(len(sheet) for sheet in sheets.values())
+    check_sheet_name(list(sheets))
+    matched = match_sheets(pathname, list(sheets))
+    for name in sheets:
+        if name not in matched:
+            print('Skipping sheet ' + str(name) + ': no config matched')
+
+    found = Findings()
+    workbook = export.open_workbook('../output/format/[new] ' + pathname.stem + '.xlsx')
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(check_sheet, sheets[name].fillna(''), prefix)
+                   for name, prefix in matched.items()}
+        # Results are merged in sheet order, whichever worker finishes first
+        for name, future in futures.items():
+            sep_line = '-' * len(str(name))
+            print(sep_line + '\n' + str(name) + '\n' + sep_line)
+            try:
+                df, flags, sheet_found, console, to_replace = future.result()
+            except FileNotFoundError:
+                print('[ERROR] Config not found for {}\n'.format(matched[name]))
+                continue
+            except Exception as error:
+                print('[ERROR] Could not check sheet: {!r}\n'.format(error))
+                continue
+            print(console)
+            found.merge(sheet_found, name)
+            with stages.stage('format', 'export', pathname, len(df)):
+                export_sheet(workbook, df, flags, to_replace, str(name)[:31])
+    with stages.stage('format', 'export', pathname):
+        workbook.close()
+        print('Exported new workbook to output')
+        found.export('../output/format/findings-' + pathname.stem + '.' + findings_format)
+    print('Exported findings to output')
+    return found
 
 
 class Application(tk.Frame):
@@ -386,11 +753,21 @@ class Application(tk.Frame):
         setup["command"] = self.do_setup
         setup.pack(side="top", pady=10)
 
+        learn = tk.Button(self)
+        learn["text"] = "Learn From Folder"
+        learn["command"] = self.do_learn
+        learn.pack()
+
         check = tk.Button(self)
         check["text"] = "Start Form Check"
         check["command"] = self.start_check
         check.pack(padx=100, pady=10)
 
+        sheets = tk.Button(self)
+        sheets["text"] = "Check All Sheets"
+        sheets["command"] = self.start_workbook_check
+        sheets.pack(pady=(0, 10))
+
         run_msg = tk.Label(self, textvariable=self.output, relief="solid", bg="white", pady=10)
         run_msg.pack()
 
@@ -403,6 +780,14 @@ class Application(tk.Frame):
         except TypeError:
             self.set_error_msg("Setup")
 
+    def do_learn(self):
+        folder = filedialog.askdirectory(initialdir = '../input', title = "Select folder")
+        if not folder:
+            self.set_error_msg("Learn")
+            return
+        learn_folder(folder)
+        self.output.set("Learning done. Check console for details")
+
     def start_check(self):
         try:
             file = self.get_file()
@@ -416,12 +801,23 @@ class Application(tk.Frame):
             self.output.set(msg)
             print(msg)
 
+    def start_workbook_check(self):
+        path = filedialog.askopenfilename(initialdir = '../input',
+                                          title = "Select file",
+                                          filetypes = (("xlsx files","*.xlsx"),("all files","*.*")))
+        if not path:
+            self.set_error_msg("Check")
+            return
+        print('\n')
+        check_workbook(Path(path))
+        self.output.set("Done. Check console for details")
+
     def get_file(self):
         try:
             path = Path(filedialog.askopenfilename(initialdir = '../input',
                                                    title = "Select file",
                                                    filetypes = (("xlsx files","*.xlsx"),("all files","*.*"))))
-            return pd.read_excel(path).fillna(''), get_prefix(path), path
+            return read_file(path), get_prefix(path), path
         except PermissionError:
             self.set_error_msg("File Search")
 
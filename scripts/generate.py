@@ -0,0 +1,297 @@
+'''
+Synthetic workbooks for testing and benchmarking the checks at size.
+
+Rows are drawn from a format config in config/: the same header, items and
+units from unit_dict, allowed values from field_dict, valid years, and
+heavy-tailed numbers whose scale depends on the item, so the number check
+has groups to learn. A share of rows is then broken on purpose, one
+anomaly per row, and the anomalies are saved next to the workbook so a
+run can be scored against them.
+
+Like the real files, sheets are cumulative: a monthly sheet holds every
+month of its year so far, and a sheet without months holds several years.
+next_period derives the following file from a sheet the way the real ones
+grow. Earlier rows stay, some of their numbers are revised, and the rows
+of the new period are added at the end, which gives diff realistic changes
+to find.
+
+    python generate.py monthlyproduction --rows 100000 --periods 2
+'''
+from pathlib import Path
+import argparse
+import export
+import json
+import numpy as np
+import os
+import pandas as pd
+
+
+GENERATE_PATH = '../input/synthetic/'
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+          'August', 'September', 'October', 'November', 'December']
+# Distinct values made up for columns a config has no allowed values for
+FILLER_VALUES = 50
+# Years a sheet without a Month column covers
+YEARS = 5
+# Year and month of the latest rows of the first workbook
+FIRST_PERIOD = (2019, 6)
+
+
+def read_config(prefix):
+    '''Returns the format config of a prefix, e.g. monthlyproduction'''
+    with open('config/' + prefix + '_config.json', 'r') as file:
+        return json.load(file)
+
+
+def get_unit_col(header):
+    '''Returns the column holding items and units, like get_com_pro'''
+    if 'Commodity' in header:
+        return 'Commodity'
+    return 'Product' if 'Product' in header else None
+
+
+def get_year_col(header):
+    return next((col for col in ('Calendar Year', 'Fiscal Year') if col in header), None)
+
+
+def unit_items(unit_dict):
+    '''Returns every item with its unit the way it appears in a sheet,
+    e.g. Gas Prod Vol (mcf)'''
+    items = []
+    for item, units in (unit_dict or {}).items():
+        for unit in units:
+            if item:
+                items.append(item + ' (' + unit + ')' if unit else item)
+    return items
+
+
+def make_sheet(config, rows, period=FIRST_PERIOD, anomaly_rate=0.01, seed=0):
+    '''Returns a synthetic sheet for a config and the anomalies put in it,
+    as a DataFrame of row, column and anomaly
+
+    Keyword Arguments:
+        config -- Decoded format config
+        rows -- Number of rows
+        period -- Year and month of the latest rows of the sheet
+        anomaly_rate -- Share of rows with one anomaly each
+        seed -- Seed of the random values
+    '''
+    rng = np.random.default_rng(seed)
+    header = config['header']
+    field_dict = config.get('field_dict') or {}
+    unit_col = get_unit_col(header)
+    year_col = get_year_col(header)
+    number_col = header[-1] if not header[-1].startswith('Unnamed') else \
+        next(col for col in reversed(header) if not col.startswith('Unnamed'))
+
+    # Rows are in period order, from January or from YEARS years back
+    if 'Month' in header:
+        periods = np.sort(rng.integers(0, period[1], rows))
+    else:
+        periods = np.sort(rng.integers(period[0] - YEARS + 1, period[0] + 1, rows))
+    columns = {}
+    for col in header:
+        if col.startswith('Unnamed'):
+            columns[col] = np.full(rows, np.nan)
+        elif col == 'Month':
+            columns[col] = np.array(MONTHS, dtype=object)[periods]
+        elif col == year_col:
+            columns[col] = np.full(rows, period[0]) if 'Month' in header else periods
+        elif col == unit_col and unit_items(config.get('unit_dict')):
+            columns[col] = rng.choice(np.array(unit_items(config['unit_dict']), dtype=object), rows)
+        elif col == number_col:
+            continue
+        elif col in field_dict and len(field_dict[col]):
+            values = [value for value in field_dict[col] if value != ''] or field_dict[col]
+            columns[col] = rng.choice(np.array(values, dtype=object), rows)
+        else:
+            columns[col] = rng.choice(np.array(['{} {}'.format(col, i) for i in
+                                                range(FILLER_VALUES)], dtype=object), rows)
+
+    # Every item has its own scale, so groups differ the way real ones do
+    item_col = unit_col if unit_col in columns else next(
+        (col for col in header if col in columns and columns[col].dtype == object), None)
+    codes = pd.factorize(columns[item_col])[0] if item_col else np.zeros(rows, dtype=np.int64)
+    scales = 10 ** rng.uniform(2, 8, codes.max() + 1)
+    columns[number_col] = np.round(scales[codes] * rng.lognormal(0, 1, rows), 2)
+    df = pd.DataFrame(columns)[header]
+    return df, add_anomalies(df, config, anomaly_rate, rng)
+
+
+def add_anomalies(df, config, rate, rng):
+    '''Breaks a share of rows in place, one anomaly per row. Returns the
+    anomalies as a DataFrame of row (in the sheet, header is row 1),
+    column and anomaly
+
+    Keyword Arguments:
+        df -- A sheet from make_sheet
+        config -- Decoded format config
+        rate -- Share of rows to break
+        rng -- NumPy random Generator
+    '''
+    header = list(df.columns)
+    unit_col = get_unit_col(header)
+    year_col = get_year_col(header)
+    number_col = df.select_dtypes('number').columns[-1]
+    field_cols = [col for col in (config.get('field_dict') or {}) if col in header
+                  and col not in (unit_col, year_col, number_col)]
+    na_cols = [col for col in config.get('na_check', []) if col in header]
+    kinds = {'unknown_item' : unit_col if unit_items(config.get('unit_dict')) else None,
+             'unexpected_unit' : unit_col if unit_items(config.get('unit_dict')) else None,
+             'invalid_year' : year_col,
+             'unexpected_entry' : field_cols[0] if field_cols else None,
+             'missing' : na_cols[0] if na_cols else None,
+             'outlier' : number_col}
+    kinds = {kind: col for kind, col in kinds.items() if col is not None}
+
+    rows = rng.choice(len(df), int(len(df) * rate), replace=False)
+    chosen = rng.choice(np.array(list(kinds), dtype=object), len(rows))
+    for kind, col in kinds.items():
+        where = rows[chosen == kind]
+        if not len(where):
+            continue
+        if kind == 'unknown_item':
+            value = 'Unobtainium (kg)'
+        elif kind == 'unexpected_unit':
+            df[col] = df[col].astype(object)
+            df.iloc[where, df.columns.get_loc(col)] = [split + ' (zz)' for split in
+                                                       df[col].iloc[where].str.rsplit(' (', n=1).str[0]]
+            continue
+        elif kind == 'invalid_year':
+            value = 1900
+        elif kind == 'unexpected_entry':
+            value = 'Unexpected Entry'
+        elif kind == 'missing':
+            value = np.nan
+        else:
+            df.iloc[where, df.columns.get_loc(col)] = df[col].iloc[where].to_numpy() * 1000
+            continue
+        if df[col].dtype != object and not isinstance(value, (int, float)):
+            df[col] = df[col].astype(object)
+        df.iloc[where, df.columns.get_loc(col)] = value
+    return pd.DataFrame({'row' : rows + 2, 'column' : [kinds[kind] for kind in chosen],
+                         'anomaly' : chosen}).sort_values('row', ignore_index=True)
+
+
+def next_period(df, change_rate=0.05, seed=1):
+    '''Returns the sheet of the following period. Every row of df stays,
+    change_rate of their numbers are revised, and the rows of the latest
+    month (or year) are repeated with new numbers as the next one. The
+    index holds the position in df of every row, new rows being copies
+
+    Keyword Arguments:
+        df -- A sheet from make_sheet or next_period
+        change_rate -- Share of earlier rows whose number is revised
+        seed -- Seed of the random changes
+    '''
+    rng = np.random.default_rng(seed)
+    df = df.reset_index(drop=True)
+    number_col = df.select_dtypes('number').columns[-1]
+    year_col = get_year_col(list(df.columns))
+    changed = rng.random(len(df)) < change_rate
+    df.loc[changed, number_col] = np.round(df.loc[changed, number_col] *
+                                           rng.normal(1, 0.1, changed.sum()), 2)
+
+    if 'Month' in df.columns and df['Month'].iloc[-1] in MONTHS:
+        month = MONTHS.index(df['Month'].iloc[-1])
+        new = df[df['Month'] == MONTHS[month]].copy()
+        new['Month'] = MONTHS[(month + 1) % 12]
+        if month == 11 and year_col:
+            latest = df[year_col].max()
+            new[year_col] = np.where(new[year_col] == latest, latest + 1, new[year_col])
+    elif year_col:
+        latest = df[year_col].max()
+        new = df[df[year_col] == latest].copy()
+        new[year_col] = latest + 1
+    else:
+        new = df.copy()
+    new[number_col] = np.round(new[number_col] * rng.lognormal(0, 0.1, len(new)), 2)
+    return pd.concat([df, new])
+
+
+def write_sheet(df, path):
+    '''Writes a sheet as an Excel file in constant memory. Returns the path'''
+    workbook = export.open_workbook(path)
+    header_fmt = workbook.add_format({'bold': True})
+    export.write_sheet(workbook, 'Data', df, header_fmt, index=False)
+    workbook.close()
+    return path
+
+
+def file_name(prefix, rows, year, month):
+    '''Returns a file name get_prefix and the period parsers understand.
+    The period comes first so the 31 character sheet names diff copies the
+    files into still differ'''
+    return '{:02d}-{}_{}_{}rows.xlsx'.format(month, year, prefix, rows)
+
+
+def file_paths(prefix, rows, periods=2, folder=GENERATE_PATH):
+    '''Returns the paths generate writes the workbooks of a config to:
+    one per month from FIRST_PERIOD, or one per year for configs without
+    a Month column'''
+    year, month = FIRST_PERIOD
+    monthly = 'Month' in read_config(prefix)['header']
+    paths = []
+    for i in range(periods):
+        paths.append(Path(folder, file_name(prefix, rows, year, month)))
+        if monthly:
+            month = month % 12 + 1
+            year += month == 1
+        else:
+            year += 1
+    return paths
+
+
+def generate(prefix, rows, periods=2, anomaly_rate=0.01, change_rate=0.05, seed=0,
+             folder=GENERATE_PATH):
+    '''Writes periods consecutive workbooks for a config, each with its
+    anomalies as a csv next to it. Returns the paths of the workbooks
+
+    Keyword Arguments:
+        prefix -- Format config prefix, e.g. monthlyproduction
+        rows -- Rows of the first workbook
+        periods -- Number of consecutive months, or years for configs
+                   without a Month column
+        anomaly_rate -- Share of rows with an anomaly
+        change_rate -- Share of earlier rows revised from file to file
+        seed -- Seed of the random values
+        folder -- Output folder
+    '''
+    config = read_config(prefix)
+    paths = []
+    for i, path in enumerate(file_paths(prefix, rows, periods, folder)):
+        if not i:
+            df, anomalies = make_sheet(config, rows, FIRST_PERIOD, anomaly_rate, seed)
+        else:
+            df = next_period(df, change_rate, seed + i)
+            # Anomalies follow their rows to where they are now
+            moved = pd.DataFrame({'source' : df.index + 2, 'now' : np.arange(len(df)) + 2})
+            anomalies = (anomalies.merge(moved, left_on='row', right_on='source')
+                         .assign(row=lambda found: found['now'])[['row', 'column', 'anomaly']]
+                         .sort_values('row', ignore_index=True))
+            df = df.reset_index(drop=True)
+        write_sheet(df, path)
+        anomalies.to_csv(path.with_suffix('.anomalies.csv'), index=False)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Writes synthetic workbooks from format configs')
+    parser.add_argument('prefixes', nargs='+', help='Config prefixes, e.g. monthlyproduction')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--periods', type=int, default=2)
+    parser.add_argument('--anomaly-rate', type=float, default=0.01)
+    parser.add_argument('--change-rate', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    for prefix in args.prefixes:
+        for path in generate(prefix, args.rows, args.periods, args.anomaly_rate,
+                             args.change_rate, args.seed):
+            print('Wrote ' + str(path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+'''
+Columnar store of past data files, for checks and diffs over history.
+
+ingest appends the first sheet of a checked Excel file to a local Parquet
+store, partitioned by dataset and period:
+
+    history/dataset=monthlyproduction/period=2019-06/part-<hash>.parquet
+
+The dataset is the config prefix of the file and the period the MM-YYYY
+(or YYYY) in its name. Ingesting a file again replaces its period. query
+reads the store through pyarrow.dataset, so periods outside a filter are
+never opened, row groups whose statistics rule out the key filter are
+skipped, and only the requested columns are read. numberchecker rebuilds
+bounds from it and diff compares two of its periods without parsing a
+workbook.
+
+    python history.py ingest ../input/diff
+    python history.py periods monthlyproduction
+    python history.py bounds monthlyproduction
+    python history.py diff monthlyproduction 2019-06 2019-07 --by-key
+'''
+from pathlib import Path
+from formatcheck import get_prefix
+import argparse
+import os
+import pandas as pd
+import re
+import sheetcache
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+STORE_PATH = '../history/'
+# Rows per Parquet row group. Smaller groups let key filters skip more
+ROW_GROUP_ROWS = 1 << 16
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError('The history store needs pyarrow')
+
+
+def get_dataset(path):
+    '''Returns the dataset of an Excel file, its config prefix'''
+    return get_prefix(Path(path).name).rstrip('_')
+
+
+def get_period(path):
+    '''Returns the period of an Excel file from the MM-YYYY or YYYY in its
+    name, as YYYY-MM or YYYY
+
+    Keyword Arguments:
+        path -- Path of the Excel file
+    '''
+    stem = Path(path).stem
+    found = re.search(r'(\d{2})-(\d{4})', stem)
+    if found:
+        return '{}-{}'.format(found.group(2), found.group(1))
+    found = re.search(r'(?<!\d)((?:19|20)\d{2})(?!\d)', stem)
+    if found:
+        return found.group(1)
+    raise ValueError('No period in file name: ' + Path(path).name)
+
+
+def dataset_path(dataset):
+    return Path(STORE_PATH, 'dataset=' + dataset)
+
+
+def normalize(df):
+    '''Returns a sheet with types that stay the same from period to
+    period: whole numbers as int64, other numbers as float64 (the store
+    reads a column as float64 once any period has decimals), dates as
+    timestamps and everything else as text, with blanks kept as missing
+
+    Keyword Arguments:
+        df -- A pandas DataFrame
+    '''
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_integer_dtype(values):
+            values = values.astype('int64')
+        elif pd.api.types.is_bool_dtype(values) or pd.api.types.is_numeric_dtype(values):
+            values = values.astype('float64')
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            values = values.astype('datetime64[ns]')
+        else:
+            values = values.where(values.isna(), values.astype(str)).astype('string')
+        columns[str(col)] = values
+    return pd.DataFrame(columns, index=pd.RangeIndex(len(df)))
+
+
+def ingest(path, df=None, dataset=None, period=None):
+    '''Stores a sheet as the period of its dataset, replacing what was
+    stored for that period before. Returns the path of the Parquet file
+
+    Keyword Arguments:
+        path -- Path of the Excel file
+        df -- The sheet, if already read. Read from the file if None
+        dataset -- Dataset name. Defaults to the config prefix of the file
+        period -- Period name. Defaults to the period in the file name
+    '''
+    require_pyarrow()
+    dataset = dataset or get_dataset(path)
+    period = period or get_period(path)
+    if df is None:
+        df = sheetcache.read_excel(path)
+    partition = dataset_path(dataset) / ('period=' + period)
+    os.makedirs(partition, exist_ok=True)
+
+    target = partition / 'part-{}.parquet'.format(sheetcache.file_digest(path)[:16])
+    temp = '{}.{}.tmp'.format(target, os.getpid())
+    table = pa.Table.from_pandas(normalize(df), preserve_index=False)
+    table = table.replace_schema_metadata({'source' : Path(path).name})
+    pq.write_table(table, temp, row_group_size=ROW_GROUP_ROWS)
+    os.replace(temp, target)
+    for old in partition.glob('*.parquet'):
+        if old != target:
+            old.unlink()
+    return target
+
+
+def periods(dataset):
+    '''Returns the stored periods of a dataset, oldest first'''
+    return sorted(path.name.split('=', 1)[1] for path in dataset_path(dataset).glob('period=*')
+                  if any(path.glob('*.parquet')))
+
+
+def open_dataset(dataset):
+    '''Returns a pyarrow Dataset over every period of a dataset. Columns
+    that changed type between periods are read as their widest type
+
+    Keyword Arguments:
+        dataset -- Dataset name
+    '''
+    require_pyarrow()
+    files = sorted(dataset_path(dataset).glob('period=*/*.parquet'))
+    if not files:
+        raise FileNotFoundError('No history for ' + dataset)
+    schema = pa.unify_schemas([pq.read_schema(file) for file in files],
+                              promote_options='permissive')
+    schema = pa.unify_schemas([schema, pa.schema([('period', pa.string())])])
+    partitioning = ds.partitioning(pa.schema([('period', pa.string())]), flavor='hive')
+    return ds.dataset([str(file) for file in files], schema=schema, format='parquet',
+                      partitioning=partitioning,
+                      partition_base_dir=str(dataset_path(dataset)))
+
+
+def get_columns(dataset):
+    '''Returns the data columns of a dataset'''
+    return [name for name in open_dataset(dataset).schema.names if name != 'period']
+
+
+def query(dataset, periods=None, filters=None, columns=None, with_period=False):
+    '''Returns the stored rows of a dataset as a DataFrame. Filters are
+    pushed down to the store, so only matching periods and row groups are
+    read
+
+    Keyword Arguments:
+        dataset -- Dataset name
+        periods -- List of periods to read, or None for all
+        filters -- Dictionary of column to a value or list of values to keep
+        columns -- Columns to read, or None for all
+        with_period -- Whether to add the period as the first column
+    '''
+    store = open_dataset(dataset)
+    expression = None
+    conditions = dict(filters or {})
+    if periods is not None:
+        conditions['period'] = periods
+    for col, values in conditions.items():
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        condition = ds.field(col).isin(pa.array(list(values), store.schema.field(col).type))
+        expression = condition if expression is None else expression & condition
+    names = columns or [name for name in store.schema.names if name != 'period']
+    df = store.to_table(columns=list(names) + ['period'], filter=expression).to_pandas()
+    # Periods in order, rows in their order within each period
+    df = df.sort_values('period', kind='stable').reset_index(drop=True)
+    period = df.pop('period')
+    if with_period:
+        df.insert(0, 'period', period)
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stores and queries past data files')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest', help='Store Excel files by dataset and period')
+    ingest_parser.add_argument('paths', nargs='+', help='Excel files, directories or globs')
+    periods_parser = commands.add_parser('periods', help='List the stored periods of a dataset')
+    periods_parser.add_argument('dataset')
+    bounds_parser = commands.add_parser('bounds', help='Rebuild number bounds from the store')
+    bounds_parser.add_argument('dataset')
+    bounds_parser.add_argument('--periods', nargs='+', default=None)
+    diff_parser = commands.add_parser('diff', help='Diff two stored periods')
+    diff_parser.add_argument('dataset')
+    diff_parser.add_argument('old')
+    diff_parser.add_argument('new')
+    diff_parser.add_argument('--by-key', action='store_true',
+                             help='Match rows on the config key columns')
+    args = parser.parse_args(argv)
+
+    # Configs and the store are relative to the scripts folder
+    paths = [os.path.abspath(path) for path in getattr(args, 'paths', [])]
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    if args.command == 'ingest':
+        from batch import find_files
+        for path in find_files(paths):
+            print('Stored {} as {}'.format(path.name, ingest(path)))
+    elif args.command == 'periods':
+        print('\n'.join(periods(args.dataset)))
+    elif args.command == 'bounds':
+        import numberchecker
+        numberchecker.rebuild_config(args.dataset, args.periods)
+    else:
+        import diff
+        keys = diff.get_keys(Path(args.dataset)) if args.by_key else None
+        print(diff.diff_periods(args.dataset, args.old, args.new, keys))
+
+
+if __name__ == '__main__':
+    main()
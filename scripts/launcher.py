@@ -0,0 +1,117 @@
+'''
+Menu for the diff, format and number checks, run in one Python process.
+
+The menu only needs the standard library, so it shows at once. A tool is
+imported the first time it is chosen. Its window opens before pandas and
+xlsxwriter load, since the tools import them when a check first runs.
+Tools and libraries stay imported after their window is closed, so every
+later run in the session opens straight away instead of starting Python
+and pandas again. With --preload they are imported in the background
+while the menu waits for a choice.
+
+    python launcher.py
+'''
+import argparse
+import importlib
+import os
+import sys
+import threading
+import time
+import traceback
+
+
+# Menu key, name and module of every tool
+TOOLS = {'1' : ('diff', 'diff'),
+         '2' : ('format', 'formatcheck'),
+         '3' : ('number', 'numberchecker')}
+# Window sizes the tools set when run on their own
+MINSIZE = {'diff' : (500, 100), 'number' : (300, 100)}
+PRELOAD = ('pandas', 'xlsxwriter')
+QUIT = ('q', 'quit', 'exit')
+
+
+def print_menu():
+    for key, (name, module) in TOOLS.items():
+        print('{}. {}'.format(key, name))
+    print('q. quit')
+
+
+def load(name, module):
+    '''Returns the module of a tool, importing it if this is its first run
+
+    Keyword Arguments:
+        name -- Name of the tool
+        module -- Name of its module
+    '''
+    if module not in sys.modules:
+        print('Loading {}...'.format(name))
+        start = time.perf_counter()
+        importlib.import_module(module)
+        print('Loaded in {:.1f}s'.format(time.perf_counter() - start))
+    return sys.modules[module]
+
+
+def preload():
+    '''Imports the libraries and tools without running any, so the
+    first choice does not wait for them'''
+    for module in PRELOAD + tuple(module for name, module in TOOLS.values()):
+        try:
+            importlib.import_module(module)
+        except Exception:
+            # Reported when the tool is chosen
+            return
+
+
+def run_tool(name, module):
+    '''Opens the window of a tool and returns when it is closed
+
+    Keyword Arguments:
+        name -- Name of the tool
+        module -- Name of its module
+    '''
+    import tkinter as tk
+    tool = load(name, module)
+    root = tk.Tk()
+    if name in MINSIZE:
+        root.minsize(*MINSIZE[name])
+    tool.Application(master=root)
+    root.mainloop()
+
+
+def clear():
+    os.system('cls' if os.name == 'nt' else 'clear')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs the checks from one menu')
+    parser.add_argument('--preload', action='store_true',
+                        help='Import the tools in the background while the menu waits')
+    args = parser.parse_args(argv)
+
+    # Configs and outputs are relative to the scripts folder
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    if args.preload:
+        threading.Thread(target=preload, daemon=True).start()
+    while True:
+        print_menu()
+        try:
+            answer = input('Type in a Number: ').strip().lower()
+        except (EOFError, KeyboardInterrupt):
+            return 0
+        if answer in QUIT:
+            return 0
+        if answer not in TOOLS:
+            print('Unknown choice: ' + answer + '\n')
+            continue
+        try:
+            run_tool(*TOOLS[answer])
+        except Exception:
+            # Stays on screen, the menu comes back below it
+            traceback.print_exc()
+            print()
+            continue
+        clear()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
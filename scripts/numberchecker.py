@@ -1,14 +1,35 @@
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from tkinter import StringVar, filedialog
+import ast
+import configcache
+import contextlib
+import formatcheck
+import io
 import json
 import os
-import pandas as pd
+import stages
 import tkinter as tk
+# pandas, NumPy, pyarrow and the modules built on them are imported where
+# they are used, so the window opens before they load
 
 
 __author__ = 'Edward Chang'
 
 
+# Bounds tables and sketches are the saved configs and are kept in git.
+# A json config is only read to import one saved before the tables
+TABLE_PATH = 'num-config/sd-{}.arrow'
+JSON_PATH = 'num-config/sd-{}.json'
+SKETCH_PATH = 'num-config/sketch-{}.arrow'
+STATS = ['count', 'mean', 'm2', 'min', 'max']
+DEFAULT_SD = 3
+MODELS = ('sd', 'mad', 'quantile')
+QUANTILES = (0.01, 0.99)
+# Scales MAD to the standard deviation of normally distributed values
+MAD_SCALE = 1.4826
+
+
 def get_prefix(name):
     '''For naming config files
 
@@ -25,6 +46,16 @@ def get_prefix(name):
     return final_prefix
 
 
+def load_arrow():
+    '''Returns pyarrow with its IPC module, or None if it is not installed'''
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+    except ImportError:
+        return None
+    return pa
+
+
 # Setup Stuff
 def get_num_col(df):
     '''Returns the last column (numbers) in a given DataFrame
@@ -38,28 +69,46 @@ def get_num_col(df):
         return df.columns[-1]
 
 
-def get_sd(grouped_df, sd):
-    '''Calculates default standard deviation
+def get_numbers(df):
+    '''Returns the number column as floats, NaN where it is not a number'''
+    import pandas as pd
+    return pd.to_numeric(df[get_num_col(df)], errors='coerce')
+
+
+def get_stats(df, groups, workers=None):
+    '''Returns the running statistics of the number column for every
+    group: count, mean, m2 (sum of squared differences from the mean), min
+    and max, with a column for each group key and a row per group
 
     Keyword Arguments:
-        grouped_df -- A grouped Pandas DataFrame
-        sd -- Multiplier for standard deviation
+        df -- A Pandas DataFrame
+        groups -- Columns to group by
+        workers -- Number of worker processes, see parallel.pick_workers
+    '''
+    import pandas as pd
+    import parallel
+    codes, keys = parallel.group_codes(df[groups], workers)
+    stats = parallel.group_stats(codes, get_numbers(df).to_numpy(dtype=float), len(keys), workers)
+    stats = pd.concat([keys, pd.DataFrame(stats)], axis=1)
+    # Groups keyed by a single blank cell are not checked
+    if len(groups) == 1:
+        stats = stats[stats[groups[0]] != '']
+    return stats.reset_index(drop=True)
+
+
+def merge_stats(old, new):
+    '''Returns the statistics of two sets of rows combined, from the
+    statistics of each. Rows of old and new are the same groups, in the
+    same order
+
+    Keyword Arguments:
+        old -- DataFrame of STATS
+        new -- DataFrame of STATS
     '''
-    from math import isnan
-
-    sd_dict = {}
-    for item, item_df in grouped_df:
-        item = str(item)
-        col = get_num_col(item_df)
-        if item == '':
-            continue
-        mean = item_df[col].mean()
-        std = item_df[col].std() * sd
-        if isnan(std):
-            sd_dict[item] = (item_df[col].min(), item_df[col].max())
-        else:
-            sd_dict[item] = (mean - std, mean + std)
-    return sd_dict
+    import pandas as pd
+    import parallel
+    return pd.DataFrame(parallel.combine({col: old[col].to_numpy() for col in STATS},
+                                         {col: new[col].to_numpy() for col in STATS}))
 
 
 def make_config_path():
@@ -86,104 +135,611 @@ Seperate the columns by commas followed by a space ", "\n\
 Your input here -> ').split(', ')
 
 
-def write_config(df, prefix):
-    '''Writes a json file with columns to groupby and default sd
+def write_config(df, prefix, path=None):
+    '''Writes a bounds table with columns to groupby and default sd
+
+    Keyword Arguments:
+        df -- A Pandas DataFrame
+        prefix -- Prefix of the config
+        path -- Path of the Excel file df was read from
+    '''
+    from sketch import QuantileSketch
+    import sheetcache
+    group_by = get_col_input(df)
+    with stages.stage('number', 'compute-bounds', path, len(df)):
+        bounds = BoundsTable(group_by, get_stats(df, group_by))
+        if path is not None:
+            bounds.files[sheetcache.file_digest(path)] = Path(path).name
+        sketch = QuantileSketch()
+        sketch.add(bounds.lookup(df), get_numbers(df).to_numpy())
+    save_config(bounds, prefix)
+    save_sketch(sketch, prefix)
+    print('Default SD written to file')
+
+
+def update_config(df, prefix, path=None):
+    ''' Folds the rows of df into the running statistics of the config.
+    Costs the size of df, not of the history already in the config. A file
+    that was already folded in is skipped. Raises ValueError for a config
+    imported from an old json, whose groups have bounds but no rows
+
+    Keyword Arguments:
+        df -- A Pandas DataFrame
+        prefix -- Prefix of the config
+        path -- Path of the Excel file df was read from
+    '''
+    import sheetcache
+    bounds = read_config(prefix)[1]
+    saved_only = bounds.saved_only().sum()
+    if saved_only:
+        # The statistics of the first file would replace the saved bounds
+        raise ValueError('{} groups of {} only have the bounds of an old json config. Learn them '
+                         'from rows first with python history.py bounds {} or Setup'
+                         .format(saved_only, prefix, prefix))
+    if path is not None:
+        digest = sheetcache.file_digest(path)
+        if digest in bounds.files:
+            print('Already in config: ' + bounds.files[digest])
+            return bounds
+        bounds.files[digest] = Path(path).name
+    with stages.stage('number', 'compute-bounds', path, len(df)):
+        bounds.update(get_stats(df, bounds.groups))
+        sketch = read_sketch(prefix)
+        sketch.add(bounds.lookup(df), get_numbers(df).to_numpy())
+    save_config(bounds, prefix)
+    save_sketch(sketch, prefix)
+    print('Groups have been updated')
+    return bounds
+
+
+def rebuild_config(prefix, periods=None):
+    '''Rebuilds the bounds table and quantile sketch of a config from the
+    history store, keeping its groups and sd. Every stored period is a
+    period of the sketch. Only the group and number columns are read
+
+    Keyword Arguments:
+        prefix -- Prefix of the config, the dataset in the store
+        periods -- Stored periods to use, or None for all
+    '''
+    from sketch import QuantileSketch
+    import history
+    import numpy as np
+    import pandas as pd
+    groups, old = read_config(prefix)
+    with stages.stage('number', 'read', prefix) as stage:
+        number = get_num_col(pd.DataFrame(columns=history.get_columns(prefix)))
+        df = history.query(prefix, periods, columns=groups + [number], with_period=True)
+        stage.rows = len(df)
+    with stages.stage('number', 'compute-bounds', prefix, len(df)):
+        bounds = BoundsTable(groups, get_stats(df, groups), old.sd)
+        # Rows come ordered by period
+        codes, names = pd.factorize(df['period'], sort=True)
+        starts = np.searchsorted(codes, np.arange(len(names) + 1))
+        positions = bounds.lookup(df)
+        numbers = get_numbers(df).to_numpy(dtype=float)
+        sketch = QuantileSketch()
+        for first, last in zip(starts[:-1], starts[1:]):
+            sketch.add(positions[first:last], numbers[first:last])
+    bounds.files = {'history:' + name : name for name in names}
+    save_config(bounds, prefix)
+    save_sketch(sketch, prefix)
+    print('Rebuilt {} groups from {} periods of history'.format(len(bounds), len(names)))
+    return bounds
+
+
+class BoundsTable:
+    '''
+    Running statistics of the number column for every group, as a DataFrame
+    with a column per group key plus count, mean, m2, min and max. A group's
+    bounds are sd standard deviations either side of its mean, or its min
+    and max when it has no standard deviation. files maps the digest of
+    every Excel file folded in to its name
+    '''
+
+    __slots__ = ['groups', 'table', 'sd', 'files']
+
+    def __init__(self, groups, table, sd=DEFAULT_SD, files=None):
+        '''Constructor for BoundsTable
+
+        Keyword Arguments:
+            groups -- Columns to group by, in order
+            table -- DataFrame of the group keys and STATS
+            sd -- Multiplier for standard deviation
+            files -- Dictionary of file digest to name of the files folded in
+        '''
+        if set(groups) & set(STATS):
+            raise ValueError('Group columns cannot be named ' + ', '.join(STATS))
+        self.groups = list(groups)
+        self.table = table
+        self.sd = sd
+        self.files = files if files is not None else {}
+
+
+    def std(self):
+        '''Returns the sample standard deviation of every group, NaN for
+        groups of less than two rows'''
+        import numpy as np
+        count = self.table['count'].to_numpy(dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 1, np.sqrt(self.table['m2'].to_numpy(dtype=float) / (count - 1)),
+                            np.nan)
+
+
+    def bounds(self):
+        '''Returns the low and high bound of every group as NumPy arrays'''
+        import numpy as np
+        mean = self.table['mean'].to_numpy(dtype=float)
+        std = self.std() * self.sd
+        no_std = np.isnan(std)
+        low = np.where(no_std, self.table['min'].to_numpy(dtype=float), mean - std)
+        high = np.where(no_std, self.table['max'].to_numpy(dtype=float), mean + std)
+        return low, high
+
+
+    def lookup(self, df):
+        '''Joins df to the table on the group columns. Returns the table row
+        of every row of df, -1 where its group is not in the table and -2
+        where it has no group
+
+        Keyword Arguments:
+            df -- A Pandas DataFrame with the group columns
+        '''
+        from pandas.api.types import is_numeric_dtype
+        import pandas as pd
+        left, right = [], []
+        for col in self.groups:
+            # Keys are matched as numbers if both sides are numbers, else as text
+            if is_numeric_dtype(df[col]) and is_numeric_dtype(self.table[col]):
+                left.append(df[col].astype(float))
+                right.append(self.table[col].astype(float))
+            else:
+                left.append(df[col].astype(str))
+                right.append(self.table[col].astype(str))
+        positions = pd.MultiIndex.from_arrays(right).get_indexer(pd.MultiIndex.from_arrays(left))
+        missing = df[self.groups].isna().any(axis=1)
+        if len(self.groups) == 1:
+            missing = missing | (df[self.groups[0]] == '')
+        positions[missing.to_numpy()] = -2
+        return positions
+
+
+    def saved_only(self):
+        '''Returns a mask of the groups imported from an old json config,
+        which have bounds but no rows'''
+        return ((self.table['count'] == 0) & self.table['min'].notna()).to_numpy()
+
+
+    def update(self, stats):
+        '''Folds the statistics of new rows into the table. Groups not seen
+        before are added at the end
+
+        Keyword Arguments:
+            stats -- DataFrame of group keys and STATS from get_stats
+        '''
+        import pandas as pd
+        positions = self.lookup(stats)
+        seen = positions >= 0
+        merged = merge_stats(self.table.iloc[positions[seen]], stats[seen])
+        table = self.table.copy()
+        for col in STATS:
+            table[col] = table[col].astype(merged[col].dtype)
+            table.loc[table.index[positions[seen]], col] = merged[col].to_numpy()
+        self.table = pd.concat([table, stats[~seen]], ignore_index=True)
+
+
+    def __len__(self):
+        return len(self.table)
+
+
+def config_path(prefix):
+    '''Returns the path of the config in use for a prefix, the bounds
+    table unless only a json config exists'''
+    if os.path.exists(TABLE_PATH.format(prefix)) or not os.path.exists(JSON_PATH.format(prefix)):
+        return TABLE_PATH.format(prefix)
+    return JSON_PATH.format(prefix)
+
+
+def write_arrow(df, metadata, path):
+    '''Writes a DataFrame as an Arrow IPC file in one step, so readers
+    never see a half written file
+
+    Keyword Arguments:
+        df -- A Pandas DataFrame
+        metadata -- Dictionary of strings to keep in the schema
+        path -- Path of the Arrow file
+    '''
+    pa = load_arrow()
+    table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(metadata)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    with pa.OSFile(temp, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp, path)
+
+
+def read_arrow(path):
+    '''Returns the DataFrame and schema metadata of an Arrow IPC file.
+    The file is memory mapped rather than read
+
+    Keyword Arguments:
+        path -- Path of the Arrow file
+    '''
+    pa = load_arrow()
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return table.to_pandas(), table.schema.metadata
+
+
+def save_config(bounds, prefix):
+    '''Saves a bounds table as an Arrow file, with its group columns and sd
+    in the schema metadata. Without pyarrow the same columns are written
+    as a json config, with null for missing values
+
+    Keyword Arguments:
+        bounds -- A BoundsTable
+        prefix -- Prefix of the config
     '''
-    with open('num-config/sd-' + prefix + '.json', 'w') as file:
-        group_by = get_col_input(df)
-        df_grouped = df.groupby(group_by)
-        config = {
-            'groups' : group_by,
-            'sd_dict' : get_sd(df_grouped, 3)
-        }
-        make_config_path()
-        json.dump(config, file, indent=4)
-        print('Default SD written to file')
-
-
-def update_config(df, prefix):
-    ''' Reads json file for list of Columns
-    Will create new SD-Dictionary based on new groups
+    make_config_path()
+    if load_arrow() is not None:
+        write_arrow(bounds.table, {'groups' : json.dumps(bounds.groups),
+                                   'sd' : str(bounds.sd),
+                                   'files' : json.dumps(bounds.files)}, TABLE_PATH.format(prefix))
+        return
+    table = bounds.table.astype(object)
+    path = JSON_PATH.format(prefix)
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp, 'w') as file:
+        json.dump({'groups' : bounds.groups, 'sd' : bounds.sd,
+                   'stats' : table.where(table.notna(), None).to_dict('list'),
+                   'files' : bounds.files}, file, indent=4, allow_nan=False)
+    os.replace(temp, path)
+
+
+def read_table(path):
+    '''Returns the BoundsTable saved in an Arrow file
+
+    Keyword Arguments:
+        path -- Path of the Arrow file
+    '''
+    table, metadata = read_arrow(path)
+    return BoundsTable(json.loads(metadata[b'groups']), table, float(metadata[b'sd']),
+                       json.loads(metadata.get(b'files', b'{}')))
+
+
+def save_sketch(sketch, prefix):
+    '''Saves the quantile sketch of a config next to its bounds table.
+    Sketches need pyarrow and are not kept without it
+
+    Keyword Arguments:
+        sketch -- A QuantileSketch
+        prefix -- Prefix of the config
+    '''
+    if load_arrow() is not None:
+        write_arrow(sketch.counts, {'alpha' : str(sketch.alpha)}, SKETCH_PATH.format(prefix))
+
+
+def read_sketch(prefix):
+    '''Returns the quantile sketch of a config, empty if there is none
+
+    Keyword Arguments:
+        prefix -- Prefix of the config
     '''
-    groups = read_config(prefix)[0]
-    df_grouped = df.groupby(groups)
-    with open('num-config/sd-' + prefix + '.json', 'w') as file:
-        config = {
-            'groups' : groups,
-            'sd_dict' : get_sd(df_grouped, 3)
-        }
-        json.dump(config, file, indent=4)
-        print('Groups have been updated')
+    from sketch import QuantileSketch
+    if load_arrow() is None or not os.path.exists(SKETCH_PATH.format(prefix)):
+        return QuantileSketch()
+    counts, metadata = read_arrow(SKETCH_PATH.format(prefix))
+    return QuantileSketch(float(metadata[b'alpha']), counts)
+
+
+def parse_key(key, size):
+    '''Returns the group key values of an sd_dict key
+
+    Keyword Arguments:
+        key -- Key of sd_dict, the string form of the groupby key
+        size -- Number of group columns
+    '''
+    try:
+        values = ast.literal_eval(key)
+    except (ValueError, SyntaxError):
+        values = key
+    if not isinstance(values, tuple):
+        values = (values,)
+    if len(values) == size and all(isinstance(value, (str, int, float)) for value in values):
+        return values
+    # Single column keys that only look like literals, e.g. dates, stay text
+    if size == 1:
+        return (key,)
+    raise ValueError('Group key {} does not have {} values'.format(key, size))
+
+
+def compile_config(config):
+    '''Returns the columns of a bounds table from a decoded json config.
+    A json without running statistics only holds bounds, so they become
+    min and max of a group with no rows
+
+    Keyword Arguments:
+        config -- Decoded json config
+    '''
+    import numpy as np
+    groups = config['groups']
+    sd = config.get('sd', DEFAULT_SD)
+    if 'stats' in config:
+        return {'groups' : groups, 'columns' : config['stats'], 'sd' : sd,
+                'files' : config.get('files', {})}
+    keys = [parse_key(key, len(groups)) for key in config['sd_dict']]
+    bounds = np.array(list(config['sd_dict'].values()), dtype=float).reshape(len(keys), 2)
+    columns = {col: [key[i] for key in keys] for i, col in enumerate(groups)}
+    columns.update({'count' : np.zeros(len(keys), dtype=np.int64),
+                    'mean' : np.full(len(keys), np.nan),
+                    'm2' : np.zeros(len(keys)),
+                    'min' : bounds[:, 0],
+                    'max' : bounds[:, 1]})
+    return {'groups' : groups, 'columns' : columns, 'sd' : sd, 'files' : {}}
+
+
+def import_json(prefix):
+    '''Returns the bounds table of a json config, and saves it as a bounds
+    table when pyarrow is available
+
+    Keyword Arguments:
+        prefix -- Prefix of the config
+    '''
+    import pandas as pd
+    config = configcache.load(JSON_PATH.format(prefix), compile_config, version=4)
+    # Missing values are null in the json, which leaves some columns as objects
+    table = pd.DataFrame(config['columns']).astype(dict(dict.fromkeys(STATS, 'float64'),
+                                                        count='int64'))
+    bounds = BoundsTable(config['groups'], table, config['sd'], dict(config['files']))
+    if load_arrow() is not None:
+        save_config(bounds, prefix)
+    # A sketch counts groups by position, which the imported table may change
+    if os.path.exists(SKETCH_PATH.format(prefix)):
+        os.remove(SKETCH_PATH.format(prefix))
+    return bounds
 
 
 # Runtime Stuff
 def read_config(prefix):
-    '''Returns list of columns and sd-Dictionary'''
-    with open('num-config/sd-' + prefix + '.json', 'r') as file:
-        config = json.load(file)
-        return config['groups'], config['sd_dict']
+    '''Returns list of columns and the bounds table. A json config is
+    imported only if there is no bounds table. File times are not compared,
+    as a git checkout does not keep them'''
+    table_path = TABLE_PATH.format(prefix)
+    json_path = JSON_PATH.format(prefix)
+    if os.path.exists(table_path) and load_arrow() is not None:
+        bounds = read_table(table_path)
+    elif os.path.exists(json_path):
+        bounds = import_json(prefix)
+    else:
+        raise FileNotFoundError('No SD-Config for ' + prefix)
+    return bounds.groups, bounds
 
 
-def check_threshold(df, prefix):
-    '''Compares values of number column to sd-dict'''
-    groups, sd_dict = set_groups(df, prefix)
+def model_bounds(bounds, sketch, model='sd', window=None):
+    '''Returns the low and high bound of every group under a model:
+        sd -- sd standard deviations either side of the mean
+        mad -- sd scaled median absolute deviations either side of the median
+        quantile -- the QUANTILES of the group
+    mad and quantile read the quantile sketch, over the last window
+    periods or all of them. Groups the sketch has no values for, or whose
+    MAD is 0, fall back to the next model
+
+    Keyword Arguments:
+        bounds -- A BoundsTable
+        sketch -- The QuantileSketch of the same config
+        model -- One of MODELS
+        window -- Number of most recent periods, or None for all
+    '''
+    import numpy as np
+    if model not in MODELS:
+        raise ValueError('Unknown model: ' + str(model))
+    if model == 'sd' and window is not None:
+        raise ValueError('The sd model keeps no periods, use mad or quantile for a window')
+    low, high = bounds.bounds()
+    if model == 'sd':
+        return low, high
+    size = len(bounds)
+    q_low = sketch.quantiles(QUANTILES[0], size, window)
+    q_high = sketch.quantiles(QUANTILES[1], size, window)
+    if model == 'mad':
+        median = sketch.quantiles(0.5, size, window)
+        mad = sketch.mad(median, size, window) * MAD_SCALE * bounds.sd
+        q_low = np.where(mad > 0, median - mad, q_low)
+        q_high = np.where(mad > 0, median + mad, q_high)
+    counted = ~np.isnan(q_low)
+    return np.where(counted, q_low, low), np.where(counted, q_high, high)
+
+
+def check_threshold(df, prefix, model='sd', window=None, workers=None):
+    '''Compares values of number column to the bounds of their group.
+    Returns the rows to highlight and the Findings
+
+    Keyword Arguments:
+        df -- A Pandas DataFrame
+        prefix -- Prefix of the config
+        model -- One of MODELS, see model_bounds
+        window -- Number of most recent periods mad and quantile look at
+        workers -- Number of worker processes, see parallel.pick_workers
+    '''
+    from findings import Findings
+    import numpy as np
+    import parallel
+    groups, bounds = set_groups(df, prefix)
     column = get_num_col(df)
-    cells = []
-    for item, item_df in groups:
-        item = str(item)
-        if item == '':
-            continue
-        min_sig = sd_dict[item][0]
-        max_sig = sd_dict[item][1]
-        deviations = []
-        for row in item_df.index:
-            value = df.loc[row, column]
-            if value in ('W', 'Withheld'):
-                continue
-            elif value < min_sig:
-                deviations.append('Low Value Row ' +  str(row) + ': ' + str(value))
-                cells.append(row)
-            elif value > max_sig:
-                deviations.append('High Value Row ' +  str(row) + ': ' + str(value))
-                cells.append(row)
-        if deviations:
-            sep_line = '-' * len(item)
-            print(sep_line + '\n' + item + '\n' + sep_line)
-            for d in deviations:
-                print(d)
-    return cells
+    found = Findings()
+
+    # Joins the bounds of every group onto its rows. Rows without a group
+    # or with a group not in the config are not compared
+    with stages.stage('number', 'compute-bounds', prefix, len(df)):
+        sketch = read_sketch(prefix) if model != 'sd' else None
+        positions = np.concatenate(parallel.split_rows(bounds.lookup, df, workers))
+        low_bounds, high_bounds = model_bounds(bounds, sketch, model, window)
+    with stages.stage('number', 'compare', prefix, len(df)):
+        values = df[column]
+        low, high = parallel.check_bounds(positions, get_numbers(df).to_numpy(dtype=float),
+                                          low_bounds, high_bounds, workers)
+        # Index labels are sheet positions, the header is row 1
+        labels = df.index.to_numpy()
+        for rule, flagged in (('low_value', low), ('high_value', high)):
+            found.add(labels[flagged] + 2, column, rule, values.to_numpy()[flagged])
+        unknown = positions == -1
+        if unknown.any():
+            names = df.loc[unknown, groups[0]].astype(str)
+            for col in groups[1:]:
+                names = names + ', ' + df.loc[unknown, col].astype(str)
+            found.add(labels[unknown] + 2, ', '.join(groups), 'unknown_group',
+                      names.to_numpy(), 'warning')
+    print(found.summary())
+    return df.index[low | high].tolist(), found
 
 
 def set_groups(df, prefix):
+    '''Returns the columns to group by and the bounds table.
+    Runs setup if there is no config yet'''
     try:
-        config = read_config(prefix)
-        return df.groupby(config[0]), config[1]
+        return read_config(prefix)
     except FileNotFoundError:
         print('No SD-Config found. Will run setup\n')
         write_config(df, prefix)
-        config = read_config(prefix)
-    return df.groupby(config[0]), config[1]
+    return read_config(prefix)
+
 
+def clean(df):
+    '''Returns a sheet with Withheld values as 0 and empty rows dropped'''
+    to_check = df.replace({'W' : 0, 'Withheld' : 0})
+    to_check.dropna(how='all', inplace=True)
+    return to_check
 
-def write_export(df, cells, pathname):
-    col = get_num_col(df)
-    cindex = df.columns.get_loc(col) + 1
-    writer = pd.ExcelWriter('../output/number/NumChecked-' + pathname.stem + '.xlsx', engine='xlsxwriter')
 
-    df.to_excel(writer, sheet_name='Sheet1', index=True)
-    workbook = writer.book
-    worksheet = writer.sheets['Sheet1']
-    highlight_fmt = workbook.add_format({'font_color': '#FF0000', 'bg_color':'#B1B3B3'})
+def read_file(path):
+    '''Returns the first sheet of an Excel file with Withheld values as 0
+
+    Keyword Arguments:
+        path -- Path of the Excel file
+    '''
+    import sheetcache
+    with stages.stage('number', 'read', path) as stage:
+        df = clean(sheetcache.read_excel(path))
+        stage.rows = len(df)
+    return df
 
-    for row in cells:
-        value = df.loc[row, col]
-        worksheet.write(row + 1, cindex, value, highlight_fmt)
 
-    writer.save()
+def flag_cells(df, cells):
+    '''Returns a boolean array over the cells of df, True for the number
+    column of the rows in cells'''
+    import numpy as np
+    highlights = np.zeros(df.shape, dtype=bool)
+    highlights[df.index.get_indexer(cells), df.columns.get_loc(get_num_col(df))] = True
+    return highlights
 
 
-    print('\nExported NumberCheck to ' + str(Path.cwd()) +
-          '\\output\\NumChecked-' + pathname.stem + '\n')
+def highlight_sheet(workbook, df, cells, sheet_name='Sheet1'):
+    '''Writes a checked sheet to workbook with the flagged cells highlighted'''
+    import export
+    header_fmt = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+    export.write_sheet(workbook, sheet_name, df, header_fmt,
+                       highlights=flag_cells(df, cells),
+                       highlight_fmt=workbook.add_format(export.HIGHLIGHT))
+
+
+def write_export(df, cells, pathname, found=None, findings_format='jsonl', exceptions=None):
+    '''Exports the checked sheet with the flagged cells highlighted,
+    and the findings if given
+
+    Keyword Arguments:
+        df -- A Pandas DataFrame
+        cells -- Rows to highlight
+        pathname -- Path of the Excel file
+        found -- Findings from check_threshold
+        findings_format -- jsonl, csv or parquet
+        exceptions -- Also writes the flagged rows alone as 'xlsx' or 'csv'
+    '''
+    import export
+    with stages.stage('number', 'export', pathname, len(df)):
+        workbook = export.open_workbook('../output/number/NumChecked-' + pathname.stem + '.xlsx')
+        highlight_sheet(workbook, df, cells)
+        workbook.close()
+
+
+        print('\nExported NumberCheck to ' + str(Path.cwd()) +
+              '\\output\\NumChecked-' + pathname.stem + '\n')
+        if exceptions:
+            export.write_exceptions(df, flag_cells(df, cells), '../output/number/NumExceptions-'
+                                    + pathname.stem, exceptions)
+        if found is not None:
+            found.export('../output/number/findings-' + pathname.stem + '.' + findings_format)
+
+
+def check_sheet(df, prefix, model='sd', window=None):
+    '''Checks one sheet in a worker process. Returns the cleaned
+    DataFrame, the rows to highlight, the findings and the console output
+
+    Keyword Arguments:
+        df -- The sheet as a pandas DataFrame
+        prefix -- Prefix of the sd config
+        model -- One of MODELS, see model_bounds
+        window -- Number of most recent periods mad and quantile look at
+    '''
+    # Raises instead of prompting for a new setup, which needs a console
+    read_config(prefix)
+    df = clean(df)
+    console = io.StringIO()
+    with contextlib.redirect_stdout(console):
+        # The sheets already run in parallel
+        cells, found = check_threshold(df, prefix, model, window, workers=1)
+    return df, cells, found, console.getvalue()
+
+
+def check_workbook(pathname, workers=None, findings_format='jsonl', model='sd', window=None):
+    '''Checks every data sheet of a workbook in parallel workers and
+    exports one highlighted workbook and one findings file for all of
+    them. The workbook is parsed once. Returns the merged findings
+
+    Keyword Arguments:
+        pathname -- Path of the Excel file
+        workers -- Number of worker processes. Defaults to the CPU count
+        findings_format -- jsonl, csv or parquet
+        model -- One of MODELS, see model_bounds
+        window -- Number of most recent periods mad and quantile look at
+    '''
+    from findings import Findings
+    import export
+    import sheetcache
+    with stages.stage('number', 'read', pathname) as stage:
+        sheets = sheetcache.read_workbook(pathname)
+        stage.rows = sum(len(sheet) for sheet in sheets.values())
+    matched = formatcheck.match_sheets(pathname, list(sheets), get_prefix,
+                                       config_path)
+    for name in sheets:
+        if name not in matched:
+            print('Skipping sheet ' + str(name) + ': no config matched')
+
+    found = Findings()
+    workbook = export.open_workbook('../output/number/NumChecked-' + pathname.stem + '.xlsx')
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(check_sheet, sheets[name], prefix, model, window)
+                   for name, prefix in matched.items()}
+        # Results are merged in sheet order, whichever worker finishes first
+        for name, future in futures.items():
+            sep_line = '-' * len(str(name))
+            print(sep_line + '\n' + str(name) + '\n' + sep_line)
+            try:
+                df, cells, sheet_found, console = future.result()
+            except FileNotFoundError:
+                print('[ERROR] No SD-Config found for {}. Run Setup first\n'.format(matched[name]))
+                continue
+            except Exception as error:
+                print('[ERROR] Could not check sheet: {!r}\n'.format(error))
+                continue
+            print(console)
+            found.merge(sheet_found, name)
+            with stages.stage('number', 'export', pathname, len(df)):
+                highlight_sheet(workbook, df, cells, str(name)[:31])
+    with stages.stage('number', 'export', pathname):
+        workbook.close()
+        print('\nExported NumberCheck to ' + str(Path.cwd()) +
+              '\\output\\NumChecked-' + pathname.stem + '\n')
+        found.export('../output/number/findings-' + pathname.stem + '.' + findings_format)
+    return found
 
 
 class Application(tk.Frame):
@@ -191,6 +747,8 @@ class Application(tk.Frame):
         super().__init__(master)
         self.output = StringVar()
         self.output.set("run_msg here")
+        self.model = StringVar()
+        self.model.set(MODELS[0])
         self.pack()
         self.create_widgets()
 
@@ -210,6 +768,14 @@ class Application(tk.Frame):
         check["command"] = self.start_check
         check.pack(pady=10)
 
+        sheets = tk.Button(self)
+        sheets["text"] = "Check All Sheets"
+        sheets["command"] = self.start_workbook_check
+        sheets.pack(pady=(0, 10))
+
+        model = tk.OptionMenu(self, self.model, *MODELS)
+        model.pack(pady=(0, 10))
+
         run_msg = tk.Label(self, textvariable=self.output, relief="solid", bg="white")
         run_msg.pack()
 
@@ -217,7 +783,7 @@ class Application(tk.Frame):
         try:
             file = self.get_file()
             self.output.set('Supply input to the console')
-            write_config(file[0], file[1])
+            write_config(file[0], file[1], file[2])
             self.output.set('Default SD written to file')
         except TypeError:
             self.set_error_msg("Setup")
@@ -226,28 +792,39 @@ class Application(tk.Frame):
         try:
             self.output.set("Check console for input prompt")
             file = self.get_file()
-            to_highlight = check_threshold(file[0], file[1])
-            write_export(file[0], to_highlight, file[2])
+            to_highlight, found = check_threshold(file[0], file[1], self.model.get())
+            write_export(file[0], to_highlight, file[2], found)
             self.output.set("Done. Output printed to console")
         except TypeError:
             self.set_error_msg("Check")
 
+    def start_workbook_check(self):
+        path = filedialog.askopenfilename(initialdir = '../input',
+                                          title = "Select file",
+                                          filetypes = (("xlsx files","*.xlsx"),("all files","*.*")))
+        if not path:
+            self.set_error_msg("Check")
+            return
+        check_workbook(Path(path), model=self.model.get())
+        self.output.set("Done. Output printed to console")
+
     def update_json(self):
         try:
             file = self.get_file()
-            update_config(file[0], file[1])
+            update_config(file[0], file[1], file[2])
             self.output.set("update done")
         except TypeError:
             self.set_error_msg("JSON Update")
+        except ValueError as error:
+            print(error)
+            self.output.set("[ERROR] Config has no statistics. Check console")
 
     def get_file(self):
         try:
             path = path = Path(filedialog.askopenfilename(initialdir = '../input',
                                                    title = "Select file",
                                                    filetypes = (("xlsx files","*.xlsx"),("all files","*.*"))))
-            to_check = pd.read_excel(path).replace({'W' : 0, 'Withheld' : 0})
-            to_check.dropna(how='all', inplace=True)
-            return to_check, get_prefix(path), path
+            return read_file(path), get_prefix(path), path
         except PermissionError:
             self.set_error_msg("file search")
 
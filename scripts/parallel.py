@@ -0,0 +1,432 @@
+'''
+Per-group statistics and bounds checks across a process pool.
+
+Group keys and the bounds lookup work on columns of Python objects,
+which cost more to pickle than to process. split_rows hands them to
+forked workers, which inherit the frame, and each worker factorizes or
+looks up a chunk of rows. Where workers cannot be forked, as on Windows,
+these steps run in the calling process. group_codes merges the groups of
+every chunk in sorted order, so the codes are the same whatever the
+number of workers.
+
+The statistics and checks work on NumPy arrays of group codes, numbers
+and bounds. These are copied once into shared memory and every worker
+maps the same blocks, so nothing row sized is pickled. Statistics reduce
+fixed chunks of CHUNK_ROWS rows to partials per group, which are combined
+in chunk order, so the results are the same bit for bit whatever the
+number of workers. Checks split the rows into chunks and write their
+flags straight into shared output arrays.
+
+Inputs smaller than PARALLEL_ROWS run in the calling process. Running this
+file benchmarks every step for 1 up to the CPU count workers:
+
+    python parallel.py --rows 5000000 --groups 5000
+'''
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import argparse
+import multiprocessing
+import numpy as np
+import os
+import time
+
+
+# Measured with python parallel.py on one CPU, where 2 workers cost the
+# serial time plus their overhead: 0.13 s at 2M rows and 0.18 s at 5M,
+# against 0.25 s and 0.68 s for all steps in one process. Half the serial
+# time is what 2 cores save, which first covers the overhead at about 2M rows
+PARALLEL_ROWS = 2000000
+# Rows per chunk of group_stats. Fixed, so results do not depend on the
+# number of workers
+CHUNK_ROWS = 1 << 19
+# Chunks per worker in check_bounds and split_rows, so one slow chunk does
+# not hold up the rest
+CHUNKS = 4
+STATS = ('count', 'mean', 'm2', 'min', 'max')
+# Whether workers can inherit a frame instead of having it pickled
+FORK = 'fork' in multiprocessing.get_all_start_methods()
+# Function and frame of the split_rows running now, read by forked workers
+inherited = None
+
+
+def pick_workers(rows, workers=None):
+    '''Returns the number of workers to use for rows
+
+    Keyword Arguments:
+        rows -- Number of rows to process
+        workers -- Requested number of workers. Defaults to the CPU count
+                   for inputs of PARALLEL_ROWS or more, else 1. Spawned
+                   workers start 0.4 s to 0.8 s later than forked ones,
+                   more than the steps they share take, so the default is
+                   1 where workers cannot be forked
+    '''
+    if workers is None:
+        workers = os.cpu_count() if FORK and rows >= PARALLEL_ROWS else 1
+    return max(1, int(workers))
+
+
+class SharedArrays:
+    '''
+    NumPy arrays copied into shared memory blocks, by name. Used as a
+    context manager, the blocks are freed on exit
+    '''
+
+    __slots__ = ['blocks', 'specs']
+
+    def __init__(self, **arrays):
+        '''Constructor for SharedArrays
+
+        Keyword Arguments:
+            arrays -- NumPy arrays to share, by name
+        '''
+        self.blocks = []
+        self.specs = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, array.dtype, block.buf)[...] = array
+            self.blocks.append(block)
+            self.specs[name] = (block.name, array.shape, array.dtype.str)
+
+
+    def array(self, name):
+        '''Returns a view of a shared array in this process'''
+        block = self.blocks[list(self.specs).index(name)]
+        return np.ndarray(self.specs[name][1], self.specs[name][2], block.buf)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *error):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+def attach(specs):
+    '''Maps shared arrays in a worker. Returns the blocks, to close when
+    done, and a dictionary of name to array
+
+    Keyword Arguments:
+        specs -- The specs of a SharedArrays
+    '''
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in specs.items():
+        try:
+            block = shared_memory.SharedMemory(name=block_name, track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the block as well.
+            # Forked workers share the tracker of the creating process,
+            # which frees the block once
+            block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype, block.buf)
+    return blocks, arrays
+
+
+def detach(blocks, arrays):
+    '''Drops the views of a worker and closes its blocks'''
+    arrays.clear()
+    for block in blocks:
+        block.close()
+
+
+def call_chunk(first, last):
+    '''Calls the inherited function on rows first to last - 1 of the
+    inherited frame in a forked worker'''
+    function, frame = inherited
+    return function(frame.iloc[first:last])
+
+
+def split_rows(function, frame, workers=None):
+    '''Returns the results of function on consecutive chunks of rows of
+    frame, in row order. Chunks run in forked workers, which inherit
+    function and frame, so neither is pickled. Runs function on the whole
+    frame in this process if workers cannot be forked
+
+    Keyword Arguments:
+        function -- Function of a DataFrame of rows
+        frame -- A pandas DataFrame
+        workers -- Number of worker processes, see pick_workers
+    '''
+    global inherited
+    workers = pick_workers(len(frame), workers) if FORK else 1
+    if workers == 1:
+        return [function(frame)]
+    cuts = np.unique(np.linspace(0, len(frame), workers * CHUNKS + 1).astype(np.int64))
+    inherited = (function, frame)
+    try:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('fork')) as pool:
+            return list(pool.map(call_chunk, cuts[:-1], cuts[1:]))
+    finally:
+        inherited = None
+
+
+def local_groups(frame):
+    '''Returns the group code of every row of frame, -1 where a key is
+    missing, and the groups in order of appearance'''
+    grouped = frame.groupby(list(frame.columns), sort=False)
+    return (grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64),
+            grouped.size().index.to_frame(index=False))
+
+
+def group_codes(frame, workers=None):
+    '''Returns the group code of every row, -1 where a key is missing, and
+    a DataFrame of the groups in sorted order. Chunks of rows are grouped
+    in parallel and their groups merged, so the result is the same as a
+    sorted groupby whatever the number of workers
+
+    Keyword Arguments:
+        frame -- A pandas DataFrame of the group columns
+        workers -- Number of worker processes, see pick_workers
+    '''
+    import pandas as pd
+    parts = split_rows(local_groups, frame, workers)
+    keys = pd.concat([groups for codes, groups in parts], ignore_index=True)
+    merged = keys.groupby(list(frame.columns), sort=True)
+    # Sorted code of every group of every chunk, then -1 for missing keys
+    order = np.append(merged.ngroup().to_numpy(dtype=np.int64), -1)
+    starts = np.cumsum([0] + [len(groups) for codes, groups in parts])
+    codes = np.concatenate([order[np.where(codes >= 0, codes + start, -1)]
+                            for (codes, groups), start in zip(parts, starts)])
+    return codes, merged.size().index.to_frame(index=False)
+
+
+def reduce_groups(codes, values, size):
+    '''Returns count, mean, m2, min and max of values per group. NaN
+    values and negative codes are left out
+
+    Keyword Arguments:
+        codes -- Array of group codes, from 0 to size - 1
+        values -- Array of floats
+        size -- Number of groups
+    '''
+    keep = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[keep], values[keep]
+    count = np.bincount(codes, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(codes, weights=values, minlength=size) / count
+    m2 = np.bincount(codes, weights=(values - mean[codes]) ** 2, minlength=size)
+    low = np.full(size, np.inf)
+    high = np.full(size, -np.inf)
+    np.minimum.at(low, codes, values)
+    np.maximum.at(high, codes, values)
+    empty = count == 0
+    low[empty], high[empty] = np.nan, np.nan
+    return dict(zip(STATS, (count, mean, m2, low, high)))
+
+
+def combine(first, second):
+    '''Returns the statistics of two sets of rows combined, from the
+    statistics of each (Chan et al. pairwise update). Groups with no rows
+    on one side take the other side as it is
+
+    Keyword Arguments:
+        first -- Dictionary of STATS arrays
+        second -- Dictionary of STATS arrays of the same groups
+    '''
+    count_a = np.asarray(first['count'], dtype=np.int64)
+    count_b = np.asarray(second['count'], dtype=np.int64)
+    count = count_a + count_b
+    mean_a = np.where(count_a > 0, first['mean'], 0)
+    mean_b = np.where(count_b > 0, second['mean'], 0)
+    m2_a = np.where(count_a > 0, first['m2'], 0)
+    m2_b = np.where(count_b > 0, second['m2'], 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = mean_b - mean_a
+        mean = np.where(count > 0, mean_a + delta * count_b / count, np.nan)
+        m2 = m2_a + m2_b + np.where(count > 0, delta ** 2 * count_a * count_b / count, 0)
+    low = np.fmin(np.where(count_a > 0, first['min'], np.nan),
+                  np.where(count_b > 0, second['min'], np.nan))
+    high = np.fmax(np.where(count_a > 0, first['max'], np.nan),
+                   np.where(count_b > 0, second['max'], np.nan))
+    return dict(zip(STATS, (count, mean, m2, low, high)))
+
+
+def stats_chunk(specs, first, last, size):
+    '''Reduces rows first to last - 1 in a worker'''
+    blocks, arrays = attach(specs)
+    try:
+        rows = slice(first, last)
+        return reduce_groups(arrays['codes'][rows], arrays['values'][rows], size)
+    finally:
+        detach(blocks, arrays)
+
+
+def chunk_cuts(rows):
+    '''Returns the first row of every chunk and the row count. Chunks are
+    CHUNK_ROWS long whatever the number of workers'''
+    return np.append(np.arange(0, rows, CHUNK_ROWS), rows)
+
+
+def group_stats(codes, values, size, workers=None):
+    '''Returns a dictionary of STATS arrays, one value per group. NaN values
+    and negative codes are left out. Rows are reduced in chunks of
+    CHUNK_ROWS and the chunks are combined in order, so the result does not
+    depend on the number of workers
+
+    Keyword Arguments:
+        codes -- Array of the group code of every row, from 0 to size - 1
+        values -- Array of floats
+        size -- Number of groups
+        workers -- Number of worker processes, see pick_workers
+    '''
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+    cuts = chunk_cuts(len(codes))
+    workers = min(pick_workers(len(codes), workers), len(cuts) - 1)
+    if workers <= 1:
+        parts = [reduce_groups(codes[first:last], values[first:last], size)
+                 for first, last in zip(cuts[:-1], cuts[1:])]
+    else:
+        with SharedArrays(codes=codes, values=values) as shared:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(stats_chunk, [shared.specs] * (len(cuts) - 1),
+                                      cuts[:-1], cuts[1:], [size] * (len(cuts) - 1)))
+    stats = reduce_groups(codes[:0], values[:0], size)
+    for part in parts:
+        stats = combine(stats, part)
+    return stats
+
+
+def flag_rows(positions, numbers, low, high):
+    '''Returns the masks of numbers below and above the bounds of their
+    group. Rows with a negative position have no bounds
+
+    Keyword Arguments:
+        positions -- Array of the group position of every row
+        numbers -- Array of floats
+        low -- Array of the low bound of every group
+        high -- Array of the high bound of every group
+    '''
+    rows = np.where(positions >= 0, positions, len(low))
+    with np.errstate(invalid='ignore'):
+        return (numbers < np.append(low, np.nan)[rows],
+                numbers > np.append(high, np.nan)[rows])
+
+
+def check_chunk(specs, first, last):
+    '''Flags rows first to last - 1 in a worker'''
+    blocks, arrays = attach(specs)
+    try:
+        rows = slice(first, last)
+        below, above = flag_rows(arrays['positions'][rows], arrays['numbers'][rows],
+                                 arrays['low'], arrays['high'])
+        arrays['below'][rows] = below
+        arrays['above'][rows] = above
+    finally:
+        detach(blocks, arrays)
+
+
+def check_bounds(positions, numbers, low, high, workers=None):
+    '''Returns the masks of numbers below and above the bounds of their
+    group, checking chunks of rows in parallel
+
+    Keyword Arguments:
+        positions -- Array of the group position of every row, negative
+                     for rows without bounds
+        numbers -- Array of floats
+        low -- Array of the low bound of every group
+        high -- Array of the high bound of every group
+        workers -- Number of worker processes, see pick_workers
+    '''
+    positions = np.asarray(positions, dtype=np.int64)
+    numbers = np.asarray(numbers, dtype=float)
+    workers = pick_workers(len(numbers), workers)
+    if workers == 1:
+        return flag_rows(positions, numbers, low, high)
+
+    cuts = np.unique(np.linspace(0, len(numbers), workers * CHUNKS + 1).astype(np.int64))
+    flags = np.zeros(len(numbers), dtype=bool)
+    with SharedArrays(positions=positions, numbers=numbers, low=np.asarray(low, dtype=float),
+                      high=np.asarray(high, dtype=float), below=flags, above=flags) as shared:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(check_chunk, [shared.specs] * (len(cuts) - 1), cuts[:-1], cuts[1:]))
+        return shared.array('below').copy(), shared.array('above').copy()
+
+
+def timed(function, *args, repeat=3):
+    '''Returns the result of a call and its best wall time of repeat runs'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def same(first, second):
+    '''Whether two results are equal bit for bit, NaN included'''
+    return all(np.array_equal(a, b, equal_nan=a.dtype.kind == 'f')
+               for a, b in zip(first, second))
+
+
+def benchmark(rows, groups, workers_list, seed=0, repeat=3):
+    '''Times every step on synthetic heavy-tailed data, grouped by a text
+    key like the real sheets. Returns a list of dictionaries, one per
+    worker count
+
+    Keyword Arguments:
+        rows -- Number of rows
+        groups -- Number of groups
+        workers_list -- Worker counts to time
+        seed -- Seed of the synthetic data
+        repeat -- Runs per timing, the best is kept
+    '''
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    names = np.array(['group {}'.format(i) for i in range(groups)], dtype=object)
+    frame = pd.DataFrame({'group' : names[rng.integers(0, groups, rows)]})
+    values = rng.lognormal(10, 2, rows)
+    values[rng.random(rows) < 0.01] = np.nan
+
+    results, baseline = [], None
+    for workers in workers_list:
+        (codes, keys), codes_time = timed(group_codes, frame, workers, repeat=repeat)
+        stats, stats_time = timed(group_stats, codes, values, len(keys), workers, repeat=repeat)
+        index = pd.Index(keys['group'])
+        positions, lookup_time = timed(split_rows, lambda rows: index.get_indexer(rows['group']),
+                                       frame, workers, repeat=repeat)
+        positions = np.concatenate(positions)
+        std = np.sqrt(stats['m2'] / (stats['count'] - 1))
+        flags, check_time = timed(check_bounds, positions, values, stats['mean'] - 3 * std,
+                                  stats['mean'] + 3 * std, workers, repeat=repeat)
+        output = [codes, positions] + [stats[name] for name in STATS] + list(flags)
+        times = {'codes' : codes_time, 'stats' : stats_time, 'lookup' : lookup_time,
+                 'check' : check_time}
+        times['total'] = sum(times.values())
+        baseline = baseline or (output, times)
+        result = {'workers' : workers, 'identical' : same(output, baseline[0])}
+        for step, seconds in times.items():
+            result[step + '_seconds'] = round(seconds, 4)
+        result['speedup'] = round(baseline[1]['total'] / times['total'], 2)
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks parallel per-group stats and checks')
+    parser.add_argument('--rows', type=int, default=5000000)
+    parser.add_argument('--groups', type=int, default=5000)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count()} - {0}),
+                        help='Worker counts to time (default: 1, 2, 4 and the CPU count)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    print('{} rows, {} groups, {} CPUs, fork: {}'.format(args.rows, args.groups, os.cpu_count(),
+                                                        FORK))
+    print('{:>8}{:>11}{:>11}{:>11}{:>11}{:>11}{:>10}{:>11}'.format(
+        'workers', 'codes (s)', 'stats (s)', 'lookup (s)', 'check (s)', 'total (s)', 'speedup',
+        'identical'))
+    for result in benchmark(args.rows, args.groups, args.workers, args.seed):
+        print('{workers:>8}{codes_seconds:>11}{stats_seconds:>11}{lookup_seconds:>11}'
+              '{check_seconds:>11}{total_seconds:>11}{speedup:>10}{identical!s:>11}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
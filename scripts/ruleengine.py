@@ -0,0 +1,192 @@
+'''
+Extra rules declared in the "rules" list of a config/*_config.json file.
+
+Each rule is a dictionary with a "type" and the columns it applies to:
+
+    {"type": "range", "column": "Revenue", "min": 0, "allow": ["W", "Withheld"]}
+    {"type": "regex", "column": "Month", "pattern": "January|February|..."}
+    {"type": "compare", "column": "Fiscal Year", "op": ">=", "other": "Calendar Year"}
+    {"type": "lookup", "column": "Commodity", "key": "Land Class",
+     "table": {"Federal": ["Oil Prod Vol (bbl)", ...], ...}}
+
+range -- Values must be numbers within min and max. Both are optional, so
+         a range without them checks that the column is numeric. Values in
+         allow pass as they are
+regex -- Values must fully match pattern
+compare -- column op other must hold, where other is a column, or value is
+           a constant. <, <=, > and >= compare numbers, == and != compare text
+lookup -- Values must be listed in table under the value of the key column
+
+Every rule may also have a "name", used as the rule of its findings, and a
+"severity". Blank cells pass, missing values are na_check's job, and rules
+on columns the sheet does not have are skipped.
+
+compile_rules checks and normalizes the rules once, when the config is
+compiled. evaluate applies all of them to a DataFrame with pandas and NumPy
+operations over whole columns, so a new rule adds no loop over the rows.
+'''
+from findings import SEVERITIES
+import numpy as np
+import pandas as pd
+import re
+
+
+OPERATORS = {'<' : np.less, '<=' : np.less_equal, '>' : np.greater,
+             '>=' : np.greater_equal, '==' : np.equal, '!=' : np.not_equal}
+REQUIRED = {'range' : ('column',),
+            'regex' : ('column', 'pattern'),
+            'compare' : ('column', 'op'),
+            'lookup' : ('column', 'key', 'table')}
+
+
+def compile_rules(specs):
+    '''Returns the rules of a config, checked and normalized.
+    Raises ValueError for a rule that cannot be applied
+
+    Keyword Arguments:
+        specs -- List of rule dictionaries from the json config
+    '''
+    compiled = []
+    for number, spec in enumerate(specs):
+        kind = spec.get('type')
+        if kind not in REQUIRED:
+            raise ValueError('Rule {}: unknown type {!r}'.format(number, kind))
+        missing = [field for field in REQUIRED[kind] if field not in spec]
+        if missing:
+            raise ValueError('Rule {}: {} needs {}'.format(number, kind, ', '.join(missing)))
+        if spec.get('severity', 'error') not in SEVERITIES:
+            raise ValueError('Rule {}: unknown severity {!r}'.format(number, spec['severity']))
+        rule = {'type' : kind,
+                'column' : spec['column'],
+                'name' : spec.get('name', kind + ' ' + spec['column']),
+                'severity' : spec.get('severity', 'error')}
+        if kind == 'range':
+            rule['min'] = spec.get('min')
+            rule['max'] = spec.get('max')
+            rule['allow'] = frozenset(str(value) for value in spec.get('allow', []))
+        elif kind == 'regex':
+            try:
+                re.compile(spec['pattern'])
+            except re.error as error:
+                raise ValueError('Rule {}: bad pattern: {}'.format(number, error))
+            rule['pattern'] = spec['pattern']
+        elif kind == 'compare':
+            if spec['op'] not in OPERATORS:
+                raise ValueError('Rule {}: unknown operator {!r}'.format(number, spec['op']))
+            if ('other' in spec) == ('value' in spec):
+                raise ValueError('Rule {}: compare needs one of other or value'.format(number))
+            rule['op'] = spec['op']
+            rule['other'] = spec.get('other')
+            rule['value'] = spec.get('value')
+        else:
+            rule['key'] = spec['key']
+            rule['pairs'] = frozenset((str(key), str(value))
+                                      for key, values in spec['table'].items()
+                                      for value in values)
+        compiled.append(rule)
+    return compiled
+
+
+class Columns:
+    '''
+    Text and numeric forms of the columns of a DataFrame, each converted
+    at most once however many rules use it
+    '''
+
+    __slots__ = ['df', 'texts', 'numbers']
+
+    def __init__(self, df):
+        '''Constructor for Columns
+
+        Keyword Arguments:
+            df -- A pandas DataFrame
+        '''
+        self.df = df
+        self.texts = {}
+        self.numbers = {}
+
+
+    def text(self, col):
+        '''Returns a column as an array of strings'''
+        if col not in self.texts:
+            self.texts[col] = self.df[col].astype(str).to_numpy()
+        return self.texts[col]
+
+
+    def number(self, col):
+        '''Returns a column as floats, NaN where a value is not a number'''
+        if col not in self.numbers:
+            self.numbers[col] = pd.to_numeric(self.df[col], errors='coerce').to_numpy(dtype=float)
+        return self.numbers[col]
+
+
+    def blank(self, col):
+        '''Returns a mask of the blank cells of a column'''
+        return self.text(col) == ''
+
+
+def check_range(rule, columns):
+    col = rule['column']
+    numbers = columns.number(col)
+    # NaN fails both comparisons below, so non-numbers are bad
+    good = ~np.isnan(numbers)
+    if rule['min'] is not None:
+        good &= numbers >= rule['min']
+    if rule['max'] is not None:
+        good &= numbers <= rule['max']
+    if rule['allow']:
+        good |= np.isin(columns.text(col), list(rule['allow']))
+    return ~good
+
+
+def check_regex(rule, columns):
+    col = rule['column']
+    text = pd.Series(columns.text(col))
+    return ~text.str.fullmatch(rule['pattern']).to_numpy(dtype=bool)
+
+
+def check_compare(rule, columns):
+    col = rule['column']
+    operator = OPERATORS[rule['op']]
+    if rule['op'] in ('==', '!='):
+        left = columns.text(col)
+        right = columns.text(rule['other']) if rule['other'] else str(rule['value'])
+        bad = ~operator(left, right)
+    else:
+        left = columns.number(col)
+        right = columns.number(rule['other']) if rule['other'] else float(rule['value'])
+        with np.errstate(invalid='ignore'):
+            bad = ~operator(left, right)
+    if rule['other']:
+        bad &= ~columns.blank(rule['other'])
+    return bad
+
+
+def check_lookup(rule, columns):
+    pairs = pd.MultiIndex.from_arrays([columns.text(rule['key']),
+                                       columns.text(rule['column'])])
+    return ~pairs.isin(list(rule['pairs']))
+
+
+CHECKS = {'range' : check_range, 'regex' : check_regex,
+          'compare' : check_compare, 'lookup' : check_lookup}
+
+
+def evaluate(df, rules):
+    '''Applies the rules to a DataFrame. Returns a list of
+    (rule, mask of rows that break it), skipping rules whose columns are
+    not in the DataFrame
+
+    Keyword Arguments:
+        df -- A pandas DataFrame
+        rules -- List of rules from compile_rules
+    '''
+    columns = Columns(df)
+    results = []
+    for rule in rules:
+        needed = [rule['column'], rule.get('other'), rule.get('key')]
+        if any(col is not None and col not in df.columns for col in needed):
+            continue
+        bad = CHECKS[rule['type']](rule, columns) & ~columns.blank(rule['column'])
+        results.append((rule, bad))
+    return results
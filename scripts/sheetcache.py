@@ -0,0 +1,216 @@
+'''
+On-disk cache of parsed Excel sheets, shared by diff, formatcheck and
+numberchecker.
+
+Parsing a workbook is the slowest step of every check. The first read of
+a sheet stores it as Parquet (or a pickle when the sheet has mixed-type
+columns Parquet cannot hold), keyed by the content hash of the file. Later
+reads of the same file, from any of the tools, load that instead. The
+content hash itself is remembered by path, size and mtime, so an unchanged
+file is not re-hashed either. Sheets are cached by name, and the sheet
+names of a file are remembered alongside, so a sheet asked for by position
+and read_workbook, which reads every sheet of a file in one go, share
+entries. Least recently used entries are evicted once the cache grows
+past CACHE_LIMIT bytes.
+'''
+from pathlib import Path
+import hashlib
+import json
+import os
+import pandas as pd
+
+
+CACHE_PATH = '../cache/'
+MANIFEST = CACHE_PATH + 'manifest.json'
+CACHE_LIMIT = 2 * 1024 ** 3
+
+
+def content_hash(path):
+    '''Returns the SHA-256 hex digest of a file
+
+    Keyword Arguments:
+        path -- Path of the file
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_path():
+    '''Creates the cache directory if it does not exist'''
+    if not os.path.exists(CACHE_PATH):
+        os.makedirs(CACHE_PATH)
+
+
+def read_manifest():
+    '''Returns the dictionary of path to size, mtime and content hash'''
+    try:
+        with open(MANIFEST, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def temp_path(path):
+    '''Returns the path a file is written to before it replaces path.
+    It is unique to the process, so parallel writers do not collide'''
+    return '{}.{}.tmp'.format(path, os.getpid())
+
+
+def write_manifest(manifest):
+    '''Replaces the manifest in one step, so parallel readers never see
+    a half written file'''
+    make_cache_path()
+    temp = temp_path(MANIFEST)
+    with open(temp, 'w') as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(temp, MANIFEST)
+
+
+def file_digest(path):
+    '''Returns the content hash of a file. The hash in the manifest is
+    reused while the path, size and mtime of the file are unchanged
+
+    Keyword Arguments:
+        path -- Path of the file
+    '''
+    stat = os.stat(path)
+    key = str(Path(path).resolve())
+    manifest = read_manifest()
+    entry = manifest.get(key)
+    if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+        return entry['digest']
+    digest = content_hash(path)
+    manifest[key] = {'size' : stat.st_size,
+                     'mtime' : stat.st_mtime_ns,
+                     'digest' : digest}
+    write_manifest(manifest)
+    return digest
+
+
+def entry_stem(digest, sheet_name):
+    '''Returns the cache path of a sheet, without a suffix'''
+    sheet = hashlib.sha1(repr(sheet_name).encode()).hexdigest()[:12]
+    return CACHE_PATH + digest + '-' + sheet
+
+
+def store(df, stem):
+    '''Saves a sheet as Parquet, or as a pickle when Parquet cannot hold it.
+    The entry replaces the cache file in one step, so a reader never loads
+    half of it'''
+    make_cache_path()
+    temp = temp_path(stem)
+    try:
+        df.to_parquet(temp)
+        os.replace(temp, stem + '.parquet')
+    except (ImportError, ValueError, TypeError, NotImplementedError):
+        # Mixed-type columns or non-string column names
+        df.to_pickle(temp)
+        os.replace(temp, stem + '.pkl')
+
+
+def evict(limit=CACHE_LIMIT):
+    '''Removes the least recently used entries until the cache fits in limit
+
+    Keyword Arguments:
+        limit -- Size limit of the cache in bytes
+    '''
+    entries = [entry for entry in Path(CACHE_PATH).glob('*')
+               if entry.suffix in ('.parquet', '.pkl')]
+    stats = {entry: entry.stat() for entry in entries}
+    total = sum(stat.st_size for stat in stats.values())
+    # Reads touch the mtime, so the oldest mtime is the least recently used
+    for entry in sorted(entries, key=lambda entry: stats[entry].st_mtime):
+        if total <= limit:
+            break
+        try:
+            entry.unlink()
+            total -= stats[entry].st_size
+        except FileNotFoundError:
+            pass
+
+
+def names_path(digest):
+    '''Returns the path of the sheet names of a file in the cache'''
+    return CACHE_PATH + digest + '-sheets.json'
+
+
+def read_names(digest):
+    '''Returns the sheet names of a file, or None if they are not cached'''
+    try:
+        with open(names_path(digest), 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_names(digest, names):
+    '''Saves the sheet names of a file in one step'''
+    make_cache_path()
+    temp = temp_path(names_path(digest))
+    with open(temp, 'w') as file:
+        json.dump(list(names), file)
+    os.replace(temp, names_path(digest))
+
+
+def read_cached(stem):
+    '''Returns a cached sheet, or None if it is not in the cache'''
+    for suffix, reader in (('.parquet', pd.read_parquet), ('.pkl', pd.read_pickle)):
+        try:
+            os.utime(stem + suffix)
+            return reader(stem + suffix)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def read_excel(path, sheet_name=0):
+    '''Returns a sheet of an Excel file as a DataFrame, parsing the file
+    only if it is not in the cache. Works like pd.read_excel. Sheets are
+    cached by name, so a position reads the same entry as read_workbook
+
+    Keyword Arguments:
+        path -- Path of the Excel file
+        sheet_name -- Name or position of the sheet
+    '''
+    digest = file_digest(path)
+    names = read_names(digest)
+    if names is not None:
+        name = names[sheet_name] if isinstance(sheet_name, int) else sheet_name
+        df = read_cached(entry_stem(digest, name))
+        if df is not None:
+            return df
+
+    with pd.ExcelFile(path) as book:
+        names = book.sheet_names
+        name = names[sheet_name] if isinstance(sheet_name, int) else sheet_name
+        df = book.parse(name)
+    store(df, entry_stem(digest, name))
+    write_names(digest, names)
+    evict()
+    return df
+
+
+def read_workbook(path):
+    '''Returns every sheet of an Excel file as a dictionary of sheet name
+    to DataFrame. The workbook is opened once for all of its sheets, and
+    not at all if they are all in the cache
+
+    Keyword Arguments:
+        path -- Path of the Excel file
+    '''
+    digest = file_digest(path)
+    names = read_names(digest)
+    if names is not None:
+        sheets = {name: read_cached(entry_stem(digest, name)) for name in names}
+        if all(df is not None for df in sheets.values()):
+            return sheets
+
+    sheets = pd.read_excel(path, sheet_name=None)
+    for name, df in sheets.items():
+        store(df, entry_stem(digest, name))
+    write_names(digest, sheets)
+    evict()
+    return sheets
@@ -0,0 +1,203 @@
+'''
+Mergeable quantile sketches for numberchecker.
+
+Every group's values are counted in logarithmic buckets (the DDSketch
+layout): a value x falls in bucket ceil(log(|x|) / log(gamma)), and every
+value in a bucket is within ALPHA of the bucket's representative value.
+Quantiles read from the counts are therefore within ALPHA relative error,
+whatever the number of rows, and two sketches merge by adding counts.
+
+The counts of all groups are one long table of (period, group, bucket,
+count). Each file folded in is a new period, so bands can be taken over
+all history or over the last few periods only. Periods older than
+HISTORY are collapsed into one, which keeps the table small without
+holding any raw values.
+'''
+import numpy as np
+import pandas as pd
+
+
+ALPHA = 0.01
+HISTORY = 36
+# Values smaller than this count as zero. OFFSET keeps bucket keys of
+# positive values above zero and of negative values below it
+MIN_VALUE = 1e-9
+OFFSET = 1 << 20
+FIELDS = ('period', 'group', 'bucket', 'count')
+
+
+class QuantileSketch:
+    '''
+    Bucket counts of the number column per group and period. groups are
+    row positions in the bounds table
+    '''
+
+    __slots__ = ['alpha', 'counts']
+
+    def __init__(self, alpha=ALPHA, counts=None):
+        '''Constructor for QuantileSketch
+
+        Keyword Arguments:
+            alpha -- Relative accuracy of the quantiles
+            counts -- DataFrame with the columns in FIELDS
+        '''
+        self.alpha = alpha
+        if counts is None:
+            counts = pd.DataFrame({'period' : np.array([], dtype=np.int32),
+                                   'group' : np.array([], dtype=np.int64),
+                                   'bucket' : np.array([], dtype=np.int64),
+                                   'count' : np.array([], dtype=np.int64)})
+        self.counts = counts
+
+
+    def gamma(self):
+        return (1 + self.alpha) / (1 - self.alpha)
+
+
+    def buckets(self, values):
+        '''Returns the bucket key of every value. Keys sort in the same
+        order as the values they stand for
+
+        Keyword Arguments:
+            values -- Array of floats without NaN
+        '''
+        size = np.abs(values)
+        with np.errstate(divide='ignore'):
+            keys = np.ceil(np.log(np.maximum(size, MIN_VALUE)) / np.log(self.gamma()))
+        keys = keys.astype(np.int64) + OFFSET
+        return np.where(size < MIN_VALUE, 0, np.sign(values).astype(np.int64) * keys)
+
+
+    def values(self, buckets):
+        '''Returns the representative value of every bucket key
+
+        Keyword Arguments:
+            buckets -- Array of bucket keys
+        '''
+        gamma = self.gamma()
+        size = 2 * gamma ** (np.abs(buckets) - OFFSET).astype(float) / (gamma + 1)
+        return np.where(buckets == 0, 0.0, np.sign(buckets) * size)
+
+
+    def periods(self):
+        '''Returns the periods in the sketch, oldest first'''
+        return np.unique(self.counts['period'].to_numpy())
+
+
+    def add(self, groups, values):
+        '''Counts values as a new period. Groups and values are arrays of
+        the same length; NaN values and negative groups are ignored
+
+        Keyword Arguments:
+            groups -- Array of group positions
+            values -- Array of floats
+        '''
+        groups = np.asarray(groups, dtype=np.int64)
+        values = np.asarray(values, dtype=float)
+        keep = (groups >= 0) & ~np.isnan(values)
+        periods = self.periods()
+        period = periods[-1] + 1 if len(periods) else 0
+        new = pd.DataFrame({'group' : groups[keep], 'bucket' : self.buckets(values[keep])})
+        new = new.value_counts(sort=False).reset_index(name='count')
+        new.insert(0, 'period', np.int32(period))
+        self.counts = pd.concat([self.counts, new], ignore_index=True)
+        self.compact()
+        return period
+
+
+    def merge(self, other):
+        '''Adds the counts of another sketch of the same groups
+
+        Keyword Arguments:
+            other -- A QuantileSketch with the same alpha
+        '''
+        if other.alpha != self.alpha:
+            raise ValueError('Cannot merge sketches of different accuracy')
+        counts = pd.concat([self.counts, other.counts], ignore_index=True)
+        self.counts = (counts.groupby(['period', 'group', 'bucket'], sort=False)['count']
+                       .sum().reset_index())
+
+
+    def compact(self, history=HISTORY):
+        '''Collapses every period but the last history into the oldest
+        one kept
+
+        Keyword Arguments:
+            history -- Number of periods kept apart
+        '''
+        periods = self.periods()
+        if len(periods) <= history:
+            return
+        old = self.counts['period'] < periods[-history]
+        self.counts.loc[old, 'period'] = periods[-history] - 1
+        self.merge(QuantileSketch(self.alpha))
+
+
+    def window(self, periods=None):
+        '''Returns the bucket counts per group over the last periods, or
+        all of them, sorted by group and bucket
+
+        Keyword Arguments:
+            periods -- Number of most recent periods, or None for all
+        '''
+        counts = self.counts
+        if periods is not None:
+            counts = counts[counts['period'].isin(self.periods()[-periods:])]
+        counts = counts.groupby(['group', 'bucket'], sort=True)['count'].sum()
+        return (counts.index.get_level_values(0).to_numpy(),
+                counts.index.get_level_values(1).to_numpy(), counts.to_numpy())
+
+
+    def quantiles(self, q, size, periods=None):
+        '''Returns quantile q of every group, NaN for groups with no counts
+
+        Keyword Arguments:
+            q -- Quantile between 0 and 1
+            size -- Number of groups
+            periods -- Number of most recent periods, or None for all
+        '''
+        groups, buckets, counts = self.window(periods)
+        return weighted_quantile(groups, self.values(buckets), counts, q, size)
+
+
+    def mad(self, medians, size, periods=None):
+        '''Returns the median absolute deviation of every group from its
+        median, read from the bucket values
+
+        Keyword Arguments:
+            medians -- Array of the median of every group
+            size -- Number of groups
+            periods -- Number of most recent periods, or None for all
+        '''
+        groups, buckets, counts = self.window(periods)
+        deviations = np.abs(self.values(buckets) - medians[groups])
+        order = np.lexsort((deviations, groups))
+        return weighted_quantile(groups[order], deviations[order], counts[order], 0.5, size)
+
+
+    def __len__(self):
+        return len(self.counts)
+
+
+def weighted_quantile(groups, values, counts, q, size):
+    '''Returns quantile q of the counted values of every group, NaN for
+    groups with no counts. Rows must be sorted by group, then value
+
+    Keyword Arguments:
+        groups -- Array of group positions
+        values -- Array of values
+        counts -- Array of the count of every value
+        q -- Quantile between 0 and 1
+        size -- Number of groups
+    '''
+    result = np.full(size, np.nan)
+    if not len(groups):
+        return result
+    cumulative = np.cumsum(counts)
+    totals = np.bincount(groups, weights=counts, minlength=size)
+    before = np.cumsum(totals) - totals
+    present = np.flatnonzero(totals > 0)
+    # The first row whose running count passes the rank of the quantile
+    rank = before[present] + np.floor(q * (totals[present] - 1))
+    result[present] = values[np.searchsorted(cumulative, rank, side='right')]
+    return result
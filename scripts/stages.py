@@ -0,0 +1,269 @@
+'''
+Timing and memory of the stages of a check: read, validate,
+compute-bounds, compare and export.
+
+Off unless the STAGES environment variable is set, e.g. in run.bat:
+
+    set STAGES=1
+
+Then every stage run appends one JSON line to
+output/stages/stages-<date>-<pid>.jsonl with the tool, stage, file, wall
+and CPU seconds, rows and the memory of the stage. That is how far the
+stage raised the peak resident memory of the process (ru_maxrss, or the
+peak working set on Windows), which is 0 for a stage that stayed below an
+earlier peak. STAGES=memory instead traces Python and NumPy allocations,
+recording the peak each stage allocated on top of what it started with.
+Tracing slows the stages down, so their times are only comparable with
+tracing off. Every record names the measure it used.
+
+When off, stage returns one shared object that does nothing, so the
+stages cost a function call each.
+
+    python stages.py                 # totals per tool and stage
+    python stages.py ../output/stages/stages-20190601-1234.jsonl
+'''
+from pathlib import Path
+import argparse
+import datetime
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows, which has the peak working set instead
+    resource = None
+
+
+STAGE_PATH = '../output/stages/'
+ENABLED = os.environ.get('STAGES', '') not in ('', '0')
+TRACE = os.environ.get('STAGES', '') == 'memory'
+# Stages running now, innermost last
+running = []
+# What memory_mb of a record holds, by measure
+MEASURES = {'tracemalloc' : 'peak of Python and NumPy allocations above the start of the stage',
+            'ru_maxrss' : 'rise of the peak resident memory of the process during the stage',
+            'peak_wset' : 'rise of the peak working set of the process during the stage'}
+
+if TRACE:
+    tracemalloc.start()
+
+
+def enable(trace=False):
+    '''Turns recording on in this process
+
+    Keyword Arguments:
+        trace -- Whether to trace allocations for the peak of every stage
+    '''
+    global ENABLED, TRACE
+    ENABLED, TRACE = True, trace
+    if trace and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def peak_working_set():
+    '''Returns the peak working set of the process in bytes on Windows'''
+    import ctypes
+    from ctypes import wintypes
+
+    class Counters(ctypes.Structure):
+        # PROCESS_MEMORY_COUNTERS of psapi.h
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    counters = Counters()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess
+    process.restype = wintypes.HANDLE
+    info = ctypes.windll.psapi.GetProcessMemoryInfo
+    info.argtypes = [wintypes.HANDLE, ctypes.POINTER(Counters), wintypes.DWORD]
+    if not info(process(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize
+
+
+def peak_memory():
+    '''Returns the peak resident memory of the process in bytes and the
+    name of the measure, or None and None where neither can be read'''
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux counts kilobytes, macOS bytes
+        return peak * (1 if sys.platform == 'darwin' else 1024), 'ru_maxrss'
+    if sys.platform == 'win32':
+        try:
+            peak = peak_working_set()
+        except (AttributeError, OSError):
+            peak = None
+        if peak is not None:
+            return peak, 'peak_wset'
+    return None, None
+
+
+def max_rss():
+    '''Returns the peak resident memory of the process in MB, or None'''
+    peak = peak_memory()[0]
+    return None if peak is None else round(peak / 1024 ** 2, 1)
+
+
+def log_path():
+    return '{}stages-{}-{}.jsonl'.format(STAGE_PATH, datetime.date.today().strftime('%Y%m%d'),
+                                         os.getpid())
+
+
+class Stage:
+    '''
+    One stage of a check, used as a context manager. Set rows inside the
+    block if the count is only known there
+    '''
+
+    __slots__ = ['tool', 'name', 'file', 'rows', 'started', 'start', 'cpu', 'traced', 'peak',
+                 'peak_start']
+
+    def __init__(self, tool, name, file=None, rows=None):
+        self.tool = tool
+        self.name = name
+        self.file = None if file is None else Path(str(file)).stem
+        self.rows = rows
+
+
+    def __enter__(self):
+        if TRACE and tracemalloc.is_tracing():
+            # The peak of an enclosing stage is kept before it is reset
+            self.traced, peak = tracemalloc.get_traced_memory()
+            if running:
+                running[-1].peak = max(running[-1].peak, peak)
+            self.peak = self.traced
+            tracemalloc.reset_peak()
+        else:
+            self.traced = None
+            self.peak_start = peak_memory()[0]
+        running.append(self)
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self.start, self.cpu = time.perf_counter(), time.process_time()
+        return self
+
+
+    def __exit__(self, kind, error, trace):
+        seconds, cpu = time.perf_counter() - self.start, time.process_time() - self.cpu
+        running.remove(self)
+        peak, measure = peak_memory()
+        record = {'tool' : self.tool, 'stage' : self.name, 'file' : self.file,
+                  'started' : self.started,
+                  'seconds' : round(seconds, 4), 'cpu_seconds' : round(cpu, 4),
+                  'rows' : None if self.rows is None else int(self.rows),
+                  'max_rss_mb' : None if peak is None else round(peak / 1024 ** 2, 1)}
+        if self.traced is not None:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            record['memory_mb'] = round((self.peak - self.traced) / 1024 ** 2, 1)
+            record['memory_measure'] = 'tracemalloc'
+            if running:
+                running[-1].peak = max(running[-1].peak, self.peak)
+        elif peak is not None and self.peak_start is not None:
+            record['memory_mb'] = round((peak - self.peak_start) / 1024 ** 2, 1)
+            record['memory_measure'] = measure
+        if kind is not None:
+            record['error'] = kind.__name__
+        write_record(record)
+        return False
+
+
+class Off:
+    '''Stands in for Stage when recording is off'''
+
+    __slots__ = ['rows']
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, kind, error, trace):
+        return False
+
+
+OFF = Off()
+
+
+def stage(tool, name, file=None, rows=None):
+    '''Returns a context manager that records a stage if recording is on
+
+    Keyword Arguments:
+        tool -- diff, format or number
+        name -- read, validate, compute-bounds, compare or export
+        file -- Path or name of the file the stage works on
+        rows -- Rows the stage works on, if known before it starts
+    '''
+    if not ENABLED:
+        return OFF
+    return Stage(tool, name, file, rows)
+
+
+def write_record(record):
+    '''Appends a record to the log of this process'''
+    os.makedirs(STAGE_PATH, exist_ok=True)
+    with open(log_path(), 'a') as file:
+        file.write(json.dumps(record) + '\n')
+
+
+def read_records(paths):
+    '''Returns the records of stage logs as a list of dictionaries'''
+    records = []
+    for path in paths:
+        with open(path, 'r') as file:
+            records.extend(json.loads(line) for line in file if line.strip())
+    return records
+
+
+def summarize(records):
+    '''Returns a DataFrame of runs, seconds, rows and memory per tool,
+    stage and memory measure, the slowest stage first. Traced runs are
+    kept apart, since tracing slows them down'''
+    import pandas as pd
+    df = pd.DataFrame(records)
+    for col in ('rows', 'max_rss_mb', 'memory_mb', 'memory_measure'):
+        if col not in df.columns:
+            df[col] = None
+    for col in ('rows', 'max_rss_mb', 'memory_mb'):
+        df[col] = pd.to_numeric(df[col])
+    df['memory_measure'] = df['memory_measure'].fillna('none')
+    summary = df.groupby(['tool', 'stage', 'memory_measure']).agg(
+        runs=('seconds', 'size'), seconds=('seconds', 'sum'),
+        cpu_seconds=('cpu_seconds', 'sum'), rows=('rows', 'sum'),
+        max_rss_mb=('max_rss_mb', 'max'), memory_mb=('memory_mb', 'max'))
+    summary['rows_per_second'] = (summary['rows'] / summary['seconds']).round()
+    return summary.sort_values('seconds', ascending=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sums up recorded stage times')
+    parser.add_argument('paths', nargs='*', help='Stage logs (default: all in output/stages)')
+    args = parser.parse_args(argv)
+
+    paths = [os.path.abspath(path) for path in args.paths]
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    paths = paths or sorted(glob.glob(STAGE_PATH + '*.jsonl'))
+    records = read_records(paths)
+    if not records:
+        print('No stages recorded. Set STAGES=1 before running a check')
+        return
+    summary = summarize(records)
+    print(summary.to_string())
+    for measure in sorted(set(summary.index.get_level_values('memory_measure'))):
+        print('memory_mb by {}: {}'.format(measure, MEASURES.get(measure, 'not measured')))
+
+
+if __name__ == '__main__':
+    main()
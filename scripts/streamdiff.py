@@ -0,0 +1,353 @@
+'''
+Diffs Excel files row by row with bounded memory.
+
+Both workbooks are streamed in read-only mode. Rows matched by position
+are read from the two files in lockstep, so only the current pair of rows
+is in memory. Rows matched by key are hashed first, keeping a key hash
+and a row hash per row. The old rows that changed or were dropped are
+then spilled to a temporary file and read back as the new file is
+written. The DIFF workbook is written in constant memory mode, so no
+row contents are held beyond the row being written.
+'''
+from array import array
+from itertools import zip_longest
+from pathlib import Path
+from openpyxl import load_workbook
+from xlsxwriter.utility import xl_cell_to_rowcol, xl_rowcol_to_cell
+import export
+import numpy as np
+import pickle
+import tempfile
+
+from diff import EXCLUSION_SET, summarize
+
+
+# Spreads the occurrence number of a repeated key over the hash space
+OCCURRENCE_SALT = np.uint64(0x9E3779B97F4A7C15)
+
+
+def iter_sheet(path):
+    '''Yields the header, then every row of the first sheet as a tuple.
+    Empty cells are read as 0, like the fillna(0) in excel_diff
+
+    Keyword Arguments:
+        path -- Path of the Excel file
+    '''
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows)
+        width = len(header)
+        yield header
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            row = tuple(0 if value is None else value for value in row[:width])
+            yield row + (0,) * (width - len(row))
+    finally:
+        workbook.close()
+
+
+def read_header(path):
+    '''Returns the header of the first sheet as a list
+
+    Keyword Arguments:
+        path -- Path of the Excel file
+    '''
+    rows = iter_sheet(path)
+    header = list(next(rows))
+    rows.close()
+    return header
+
+
+def hash_sheet(path, key_cols, compare_cols):
+    '''Returns the key hash and row hash of every row as NumPy arrays.
+    Rows are keyed by position when key_cols is empty
+
+    Keyword Arguments:
+        path -- Path of the Excel file
+        key_cols -- Names of the key columns
+        compare_cols -- Names of the columns that make up the row hash
+    '''
+    rows = iter_sheet(path)
+    header = list(next(rows))
+    key_pos = [header.index(col) for col in key_cols]
+    compare_pos = [header.index(col) for col in compare_cols]
+    key_hashes = array('q')
+    row_hashes = array('q')
+    for number, row in enumerate(rows):
+        key_hashes.append(hash(tuple(row[i] for i in key_pos)) if key_pos else number)
+        row_hashes.append(hash(tuple(row[i] for i in compare_pos)))
+    return (unique_keys(np.frombuffer(key_hashes, dtype=np.int64)),
+            np.frombuffer(row_hashes, dtype=np.int64))
+
+
+def unique_keys(key_hashes):
+    '''Makes repeated keys unique by mixing in their order of appearance,
+    so the n-th copy of a key in one file matches the n-th copy in the other
+
+    Keyword Arguments:
+        key_hashes -- NumPy array of key hashes
+    '''
+    order = np.argsort(key_hashes, kind='stable')
+    ordered = key_hashes[order]
+    first = np.r_[True, ordered[1:] != ordered[:-1]]
+    position = np.arange(len(ordered))
+    start = np.maximum.accumulate(np.where(first, position, 0))
+    occurrence = np.empty(len(ordered), dtype=np.uint64)
+    occurrence[order] = position - start
+    return key_hashes.view(np.uint64) + occurrence * OCCURRENCE_SALT
+
+
+def match_keys(keys_OLD, keys_NEW):
+    '''Returns the position of the matching old row for every new row,
+    or -1 if the key is not in the old file
+
+    Keyword Arguments:
+        keys_OLD -- Unique key hashes of the old file
+        keys_NEW -- Unique key hashes of the new file
+    '''
+    if not len(keys_OLD):
+        return np.full(len(keys_NEW), -1)
+    order = np.argsort(keys_OLD)
+    ordered = keys_OLD[order]
+    found = np.searchsorted(ordered, keys_NEW).clip(max=len(ordered) - 1)
+    return np.where(ordered[found] == keys_NEW, order[found], -1)
+
+
+def compare_row(row, row_OLD, compare_pos, number, changedCells):
+    '''Returns a new row with every changed cell written as old→new, and
+    adds the changed cells to changedCells
+
+    Keyword Arguments:
+        row -- Row of the new file
+        row_OLD -- Matching row of the old file
+        compare_pos -- Pairs of new and old position of the compared columns
+        number -- Position of the row in the DIFF sheet
+        changedCells -- List of the references of changed cells
+    '''
+    row = list(row)
+    for i, j in compare_pos:
+        if row_OLD[j] != row[i]:
+            row[i] = '{}→{}'.format(row_OLD[j], row[i])
+            changedCells.append(xl_rowcol_to_cell(number + 1, i + 1))
+    return row
+
+
+def dropped_row(row_OLD, diff_header, old_pos):
+    '''Returns an old row laid out in the DIFF columns'''
+    return [row_OLD[old_pos[col]] if col in old_pos else '' for col in diff_header]
+
+
+def copy_header(rows, sheet, header_fmt):
+    '''Skips the header of a streamed sheet, writing it to its copy if
+    there is one'''
+    header = next(rows)
+    if sheet is not None:
+        sheet.write_row(0, 1, header, header_fmt)
+
+
+def copy_row(sheet, number, row, header_fmt):
+    if sheet is None:
+        return
+    sheet.write(number + 1, 0, number, header_fmt)
+    sheet.write_row(number + 1, 1, row)
+
+
+def diff_by_position(path_OLD, path_NEW, sheets, formats, diff_header, old_pos, compare_pos):
+    '''Writes the copies and the DIFF sheet of two files matched by row
+    position, reading both files in lockstep. Returns the new rows,
+    dropped rows, changed cells and the number of DIFF rows
+
+    Keyword Arguments:
+        path_OLD -- Path of the old Excel file
+        path_NEW -- Path of the new Excel file
+        sheets -- The DIFF, new and old worksheets. The copies are None
+                  when left out
+        formats -- Dictionary of the header, new and grey formats
+        diff_header -- Columns of the DIFF sheet
+        old_pos -- Dictionary of old column to its position
+        compare_pos -- Pairs of new and old position of the compared columns
+    '''
+    diff_sheet, new_sheet, old_sheet = sheets
+    header_fmt = formats['header']
+    rows_OLD = iter_sheet(path_OLD)
+    rows_NEW = iter_sheet(path_NEW)
+    copy_header(rows_OLD, old_sheet, header_fmt)
+    copy_header(rows_NEW, new_sheet, header_fmt)
+    newRows, droppedRows, changedCells = [], [], []
+    number = -1
+    for number, (row_OLD, row) in enumerate(zip_longest(rows_OLD, rows_NEW)):
+        diff_sheet.write(number + 1, 0, number, header_fmt)
+        if row_OLD is not None:
+            copy_row(old_sheet, number, row_OLD, header_fmt)
+        if row is not None:
+            copy_row(new_sheet, number, row, header_fmt)
+        if row_OLD is None:
+            newRows.append(number)
+            diff_sheet.write_row(number + 1, 1, row, formats['new'])
+        elif row is None:
+            droppedRows.append(number)
+            diff_sheet.write_row(number + 1, 1, dropped_row(row_OLD, diff_header, old_pos),
+                                 formats['grey'])
+        else:
+            diff_sheet.write_row(number + 1, 1,
+                                 compare_row(row, row_OLD, compare_pos, number, changedCells))
+    return newRows, droppedRows, changedCells, number + 1
+
+
+def diff_by_key(path_OLD, path_NEW, keys, sharedCols, sheets, formats, diff_header, old_pos,
+                compare_pos):
+    '''Writes the copies and the DIFF sheet of two files matched on key
+    columns. Returns the new rows, dropped rows, changed cells and the
+    number of DIFF rows
+
+    Keyword Arguments:
+        path_OLD -- Path of the old Excel file
+        path_NEW -- Path of the new Excel file
+        keys -- Columns to match rows on
+        sharedCols -- Columns compared between the files
+        sheets -- The DIFF, new and old worksheets. The copies are None
+                  when left out
+        formats -- Dictionary of the header, new and grey formats
+        diff_header -- Columns of the DIFF sheet
+        old_pos -- Dictionary of old column to its position
+        compare_pos -- Pairs of new and old position of the compared columns
+    '''
+    diff_sheet, new_sheet, old_sheet = sheets
+    header_fmt = formats['header']
+
+    # Pass 1 and 2: hash both files and join on the key hashes
+    keys_OLD, hashes_OLD = hash_sheet(path_OLD, keys, sharedCols)
+    keys_NEW, hashes_NEW = hash_sheet(path_NEW, keys, sharedCols)
+    matches = match_keys(keys_OLD, keys_NEW)
+    matched = matches >= 0
+    changed = np.zeros(len(keys_NEW), dtype=bool)
+    changed[matched] = hashes_OLD[matches[matched]] != hashes_NEW[matched]
+    dropped = np.ones(len(keys_OLD), dtype=bool)
+    dropped[matches[matched]] = False
+    wanted = dropped.copy()
+    wanted[matches[changed]] = True
+    del keys_OLD, keys_NEW, hashes_OLD, hashes_NEW
+
+    with tempfile.TemporaryFile() as spill:
+        # Pass 3: copy the old sheet and spill the old rows the DIFF needs
+        offsets = np.full(len(wanted), -1, dtype=np.int64)
+        rows = iter_sheet(path_OLD)
+        copy_header(rows, old_sheet, header_fmt)
+        for number, row in enumerate(rows):
+            copy_row(old_sheet, number, row, header_fmt)
+            if wanted[number]:
+                offsets[number] = spill.tell()
+                pickle.dump(row, spill, pickle.HIGHEST_PROTOCOL)
+
+        def read_old(position):
+            spill.seek(offsets[position])
+            return pickle.load(spill)
+
+        # Pass 4: copy the new sheet and write the DIFF rows in order
+        newRows, changedCells = [], []
+        rows = iter_sheet(path_NEW)
+        copy_header(rows, new_sheet, header_fmt)
+        for number, row in enumerate(rows):
+            copy_row(new_sheet, number, row, header_fmt)
+            diff_sheet.write(number + 1, 0, number, header_fmt)
+            if not matched[number]:
+                newRows.append(number)
+                diff_sheet.write_row(number + 1, 1, row, formats['new'])
+            elif changed[number]:
+                diff_sheet.write_row(number + 1, 1,
+                                     compare_row(row, read_old(matches[number]), compare_pos,
+                                                 number, changedCells))
+            else:
+                diff_sheet.write_row(number + 1, 1, row)
+
+        # Dropped rows follow the new rows, laid out in the DIFF columns
+        droppedRows = []
+        number = len(matched)
+        for position in np.flatnonzero(dropped):
+            droppedRows.append(number)
+            diff_sheet.write(number + 1, 0, number, header_fmt)
+            diff_sheet.write_row(number + 1, 1, dropped_row(read_old(position), diff_header,
+                                                            old_pos), formats['grey'])
+            number += 1
+    return newRows, droppedRows, changedCells, number
+
+
+def stream_diff(path_OLD, path_NEW, keys=None, copies=True):
+    '''Compares two Excel files and exports a DIFF workbook using bounded
+    memory. Finds the same new, dropped and changed rows and cells as
+    excel_diff. Values are written as the workbooks store them, so whole
+    numbers in a column pandas reads as floats show without a .0
+
+    Keyword Arguments:
+        path_OLD -- Path of the old Excel file
+        path_NEW -- Path of the new Excel file
+        keys -- Columns to match rows on. Rows are matched by position if None
+        copies -- Whether to add full copies of the old and new sheets
+    '''
+    return stream_files(path_OLD, path_NEW, keys, copies)[0]
+
+
+def stream_files(path_OLD, path_NEW, keys=None, copies=True):
+    '''Compares two Excel files like stream_diff. Returns the console
+    summary and the number of new, dropped and changed rows. Unlike
+    diff_files, no change set is kept, as it grows with the changes
+
+    Keyword Arguments:
+        path_OLD -- Path of the old Excel file
+        path_NEW -- Path of the new Excel file
+        keys -- Columns to match rows on. Rows are matched by position if None
+        copies -- Whether to add full copies of the old and new sheets
+    '''
+    header_OLD = read_header(path_OLD)
+    header_NEW = read_header(path_NEW)
+    cols_OLD = set(header_OLD) - EXCLUSION_SET
+    cols_NEW = set(header_NEW) - EXCLUSION_SET
+    newCols = list(cols_NEW - cols_OLD)
+    droppedCols = list(cols_OLD - cols_NEW)
+
+    keys = [key for key in keys or [] if key in header_OLD and key in header_NEW]
+    excluded = set(keys) if keys else EXCLUSION_SET
+    sharedCols = [col for col in header_NEW if col in header_OLD and col not in excluded]
+    diff_header = header_NEW + [col for col in header_OLD if col not in header_NEW]
+    old_pos = {col: header_OLD.index(col) for col in header_OLD}
+    compare_pos = [(header_NEW.index(col), old_pos[col]) for col in sharedCols]
+
+    fname = '{} vs {}.xlsx'.format(path_OLD.stem, path_NEW.stem)
+    workbook = export.open_workbook('../output/diff/' + fname)
+    diff_sheet = workbook.add_worksheet('DIFF')
+    if copies:
+        sheets = (diff_sheet, workbook.add_worksheet(path_NEW.stem[:31]),
+                  workbook.add_worksheet(path_OLD.stem[:31]))
+    else:
+        sheets = (diff_sheet, None, None)
+    diff_sheet.hide_gridlines(2)
+    diff_sheet.set_default_row(15)
+    formats = {'header' : workbook.add_format({'bold': True, 'border': 1, 'align': 'center'}),
+               'grey' : workbook.add_format({'font_color': '#E0E0E0'}),
+               'new' : workbook.add_format({'font_color': '#32CD32','bold':True})}
+    highlight_fmt = workbook.add_format({'font_color': '#FF0000', 'bg_color':'#B1B3B3'})
+    diff_sheet.write_row(0, 1, diff_header, formats['header'])
+
+    if keys:
+        newRows, droppedRows, changedCells, number = diff_by_key(
+            path_OLD, path_NEW, keys, sharedCols, sheets, formats, diff_header, old_pos,
+            compare_pos)
+    else:
+        newRows, droppedRows, changedCells, number = diff_by_position(
+            path_OLD, path_NEW, sheets, formats, diff_header, old_pos, compare_pos)
+
+    end = 'ZZ' + str(number)
+    diff_sheet.conditional_format('A1:' + end, {'type': 'text',
+                                                'criteria': 'containing',
+                                                'value':'→',
+                                                'format': highlight_fmt})
+    workbook.close()
+
+    output_string = summarize(keys, newRows, droppedRows, changedCells,
+                              newCols, droppedCols)
+    output_string += '\nExported DIFF to ' + str(Path.cwd()) + '\\output\\' + fname + '\n'
+    counts = {'new_rows' : len(newRows), 'dropped_rows' : len(droppedRows),
+              'changed_rows' : len({xl_cell_to_rowcol(cell)[0] for cell in changedCells})}
+    return output_string, counts